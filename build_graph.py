@@ -0,0 +1,344 @@
+"""
+A tiny make-like build system, for running a pipeline of stages
+(flip a file, make plots, fit resonances, ...) and only redoing the
+stages whose inputs have changed since last time.
+
+Each stage declares:
+
+- input files, whose contents are fingerprinted
+- output files, which must exist for the stage to be up to date
+- the stages it depends on (they run first, and their results can be
+  passed to this stage with ``Result``)
+- params, anything else that should trigger a rebuild when it changes
+  (e.g. render resolution)
+
+Fingerprints and stage results are stored in a JSON state file,
+so a stage that's up to date is skipped and its old result reused.
+Stage results must therefore be JSON-friendly (lists, strings, numbers).
+
+Typical use::
+
+    graph = build_graph.BuildGraph("/path/to/.build_state.json")
+    graph.add(build_graph.Stage(
+        "flip", flipper.flip, args=(path,),
+        inputs=[path], outputs=[path + "_flipped"]))
+    graph.add(build_graph.Stage(
+        "plot", resonance_plotter.plot, args=(build_graph.Result("flip"),),
+        inputs=[path + "_flipped"], deps=["flip"]))
+    graph.run()  # or graph.run(dry_run=True) to see what's stale
+
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import profiler
+
+
+class Result:
+    """
+    Placeholder for the result of another stage, used in a stage's args.
+    It's swapped for the real result when the stage runs.
+
+    name:
+        string, name of the stage whose result we want
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "Result({!r})".format(self.name)
+
+
+class Stage:
+    """
+    One step of a pipeline.
+
+    name:
+        string, unique name of the stage
+
+    func:
+        function to run. Stages that run in parallel need a module-level
+        function so it can be sent to other processes.
+
+    args:
+        tuple, arguments for func. Any ``Result`` in here is replaced
+        by the result of that stage (which must be in deps).
+
+    inputs:
+        list of file paths read by the stage
+
+    outputs:
+        list of file paths made by the stage
+
+    deps:
+        list of names of stages that must run before this one
+
+    params:
+        dict, other settings that should cause a rebuild when changed
+
+    interactive:
+        boolean, does the stage need a human (input(), GUI windows)?
+        Interactive stages always run in the main process, one at a time.
+
+    clean:
+        boolean, delete the outputs before running again if any input
+        file changed, e.g. saved fits for data that's different now.
+        (Not if only params changed, or the stage has no stored record.)
+    """
+
+    def __init__(self, name, func, args=(), inputs=(), outputs=(), deps=(),
+                 params=None, interactive=False, clean=False):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.params = params or {}
+        self.interactive = interactive
+        self.clean = clean
+
+
+def _call(job):
+    """Run a stage's function"""
+    func, args = job
+    return func(*args)
+
+
+def _call_in_worker(job):
+    """
+    Run a stage's function in a worker process, and send back
+    anything the profiler recorded there along with the result
+    """
+    return _call(job), profiler.take()
+
+
+class BuildGraph:
+    """
+    A set of stages, plus the state saved from previous runs.
+
+    state_path:
+        string, path to the JSON file where fingerprints and
+        results are stored
+    """
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.stages = {}  # key = name, value = Stage, in the order added
+        self.state = {"files": {}, "stages": {}}
+        if os.path.exists(state_path):
+            try:
+                with open(state_path, "r") as state_file:
+                    self.state = json.load(state_file)
+            except ValueError:
+                # a broken state file just means rebuilding everything
+                pass
+        self.results = {}  # results of stages in this run
+
+    def add(self, stage):
+        """
+        Add a stage. Its deps must already be in the graph.
+
+        stage:
+            Stage object
+        """
+        if stage.name in self.stages:
+            raise ValueError("stage {} added twice".format(stage.name))
+        for dep in stage.deps:
+            if dep not in self.stages:
+                raise ValueError(
+                    "stage {} depends on unknown stage {}".format(
+                        stage.name, dep))
+        self.stages[stage.name] = stage
+
+    def file_hash(self, path):
+        """
+        Hash of a file's contents, or None if it doesn't exist.
+
+        Hashes are remembered along with the file's size and modification
+        time, so unchanged files aren't read again.
+
+        path:
+            string, path to a file
+        """
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        known = self.state["files"].get(path)
+        if (known is not None and known["size"] == stat.st_size
+                and known["mtime"] == stat.st_mtime_ns):
+            return known["hash"]
+        sha = hashlib.sha1()
+        with open(path, "rb") as open_file:
+            for block in iter(lambda: open_file.read(1 << 20), b""):
+                sha.update(block)
+        self.state["files"][path] = {
+            "size": stat.st_size, "mtime": stat.st_mtime_ns,
+            "hash": sha.hexdigest()}
+        return sha.hexdigest()
+
+    def input_hashes(self, stage):
+        """
+        Hashes of a stage's input files.
+
+        stage:
+            Stage object
+
+        returns:
+            dict, key = path, value = hash (None for missing files)
+        """
+        return {path: self.file_hash(path) for path in stage.inputs}
+
+    def fingerprint(self, stage):
+        """
+        Fingerprint of everything that goes into a stage:
+        its input files, its params, and its deps' results.
+
+        stage:
+            Stage object
+        """
+        parts = {
+            "inputs": self.input_hashes(stage),
+            "params": stage.params,
+            "results": [self.results.get(dep) for dep in stage.deps],
+        }
+        text = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def is_stale(self, stage):
+        """
+        Does this stage need to run? True if it has never run,
+        an output is missing, or its fingerprint has changed.
+
+        stage:
+            Stage object
+        """
+        record = self.state["stages"].get(stage.name)
+        if record is None:
+            return True
+        if not all(os.path.exists(path) for path in stage.outputs):
+            return True
+        return record["fingerprint"] != self.fingerprint(stage)
+
+    def stale_stages(self):
+        """
+        List the names of stages that would run, in order, without
+        running anything. A stage counts as stale if any of its deps
+        are, since we can't know yet whether their outputs will change.
+        """
+        stale = []
+        for name, stage in self.stages.items():
+            # use stored results, like a real run would for fresh stages
+            for dep in stage.deps:
+                if dep not in self.results:
+                    self.results[dep] = self.state["stages"].get(
+                        dep, {}).get("result")
+            if (any(dep in stale for dep in stage.deps)
+                    or self.is_stale(stage)):
+                stale.append(name)
+        self.results = {}
+        return stale
+
+    def _args(self, stage):
+        """Swap ``Result`` placeholders in a stage's args for real results"""
+        return tuple(self.results[arg.name] if isinstance(arg, Result)
+                     else arg for arg in stage.args)
+
+    def _record(self, stage, result):
+        """Save a stage's result and fingerprint once it has run"""
+        # round trip through JSON so results look the same
+        # whether they were just made or loaded from the state file
+        result = json.loads(json.dumps(result))
+        self.results[stage.name] = result
+        self.state["stages"][stage.name] = {
+            "fingerprint": self.fingerprint(stage), "result": result,
+            "inputs": self.input_hashes(stage)}
+        self.save()
+
+    def run(self, dry_run=False, processes=None, initializer=None,
+            initargs=()):
+        """
+        Run all stale stages, in dependency order.
+
+        Stages whose deps are done are run together: the non-interactive
+        ones on a process pool, then the interactive ones in this process.
+
+        dry_run:
+            boolean, if True just print which stages are stale
+
+        processes:
+            int or None, number of worker processes
+            (None = one per core, 1 = run everything in this process)
+
+        initializer, initargs:
+            function and arguments to set up each worker process
+
+        returns:
+            dict, key = stage name, value = result of that stage
+        """
+        if dry_run:
+            stale = self.stale_stages()
+            print("{} of {} stages are stale:".format(
+                len(stale), len(self.stages)))
+            for name in stale:
+                print("   ", name)
+            return {}
+
+        self.results = {}
+        pending = list(self.stages)
+        n_run = 0
+        while pending:
+            ready = [name for name in pending
+                     if all(dep in self.results for dep in
+                            self.stages[name].deps)]
+            parallel, interactive = [], []
+            for name in ready:
+                pending.remove(name)
+                stage = self.stages[name]
+                if not self.is_stale(stage):
+                    self.results[name] = self.state["stages"][name]["result"]
+                    continue
+                record = self.state["stages"].get(name)
+                if (stage.clean and record is not None
+                        and record.get("inputs") != self.input_hashes(stage)):
+                    for path in stage.outputs:
+                        if os.path.exists(path):
+                            os.remove(path)
+                if stage.interactive:
+                    interactive.append(stage)
+                else:
+                    parallel.append(stage)
+
+            jobs = [(stage.func, self._args(stage)) for stage in parallel]
+            if processes == 1 or len(jobs) <= 1:
+                results = [_call(job) for job in jobs]
+            else:
+                with ProcessPoolExecutor(
+                        max_workers=processes, initializer=initializer,
+                        initargs=initargs) as pool:
+                    results = []
+                    for result, stats in pool.map(_call_in_worker, jobs):
+                        profiler.merge(stats)
+                        results.append(result)
+            for stage, result in zip(parallel, results):
+                self._record(stage, result)
+
+            for stage in interactive:
+                self._record(stage, stage.func(*self._args(stage)))
+            n_run += len(parallel) + len(interactive)
+
+        print("ran {} of {} stages".format(n_run, len(self.stages)))
+        return self.results
+
+    def save(self):
+        """Write fingerprints and results to the state file"""
+        directory = os.path.dirname(self.state_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as state_file:
+            json.dump(self.state, state_file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
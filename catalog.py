@@ -0,0 +1,384 @@
+"""
+A catalog of NCSMC runs, in a local SQLite database, so finding e.g.
+"all n+Li8 srg2.0 runs at freq 20, any Nmax" doesn't mean globbing
+lots of directories.
+
+Runs are found from the file names made by ``rename_post_ncsmc.py``
+(``[prefix]_[projectile][target]_[potential]_[freq]_Nmax[Nmax][_affix]
+[suffix]``), including files inside bundles made with its ``--archive``
+option. For every file we store its path, size, modification time and a
+hash of its contents, and for every run a summary:
+
+- threshold and ground state energies, and bound states (from the .out file)
+- channels with strong resonances (from the eigenphase shifts, see
+  ``resonance_info.classify_channels``)
+
+Indexing again only looks at files whose size or modification time changed,
+and summaries are only recomputed when their source files did.
+
+Typical use::
+
+    python catalog.py --index /path/to/runs /other/runs
+    python catalog.py target=Li8 potential=n3lo-NN3Nlnl-srg2.0 freq=20
+
+or from python::
+
+    cat = catalog.Catalog()
+    cat.index(["/path/to/runs"])
+    for run in cat.find(target="Li8", freq="20"):
+        print(run["Nmax"], cat.files(run["id"], "eigenphase_shift"))
+
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import zipfile
+
+import flipper
+import output_simplifier
+import rename_post_ncsmc
+import resonance_info
+import utils
+
+# where the database goes, by default next to the output from
+# process_ncsmc_output (see config.txt)
+db_file = os.path.join(utils.directory, "ncsmc_catalog.sqlite")
+
+# metadata describing a run, in the order they appear in file names
+metadata_keys = ["projectile", "target", "potential", "freq", "Nmax", "affix"]
+
+# e.g. nLi8_n3lo-NN3Nlnl-srg2.0_20_Nmax6_extra
+details_regex = re.compile(
+    r"^(?P<projectile>[a-z]*[0-9]*)(?P<target>[A-Z][a-z]?[0-9]+)_"
+    r"(?P<potential>.+)_(?P<freq>[0-9.]+)_Nmax(?P<Nmax>[0-9]+)"
+    r"(?:_(?P<affix>.+))?$")
+
+# kinds of files we make summaries from
+out_kind = "ncsm_rgm_Am2_1_1.out"
+eigenphase_kind = "eigenphase_shift"
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    projectile TEXT, target TEXT, potential TEXT, freq TEXT, Nmax INTEGER,
+    affix TEXT, directory TEXT,
+    UNIQUE (projectile, target, potential, freq, Nmax, affix, directory));
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    run_id INTEGER REFERENCES runs (id),
+    kind TEXT, size INTEGER, mtime REAL, hash TEXT);
+CREATE TABLE IF NOT EXISTS summaries (
+    run_id INTEGER PRIMARY KEY REFERENCES runs (id),
+    threshold REAL, ground_E REAL, bound_states TEXT,
+    strong_channels TEXT, source_hashes TEXT);
+CREATE INDEX IF NOT EXISTS runs_by_nucleus
+    ON runs (projectile, target, potential, freq);
+CREATE INDEX IF NOT EXISTS files_by_run ON files (run_id, kind);
+"""
+
+
+def parse_name(name):
+    """
+    Get the kind of file and run metadata from a renamed NCSMC file name.
+
+    name:
+        string, file name, e.g.
+        eigenphase_shift_nLi8_n3lo-NN3Nlnl-srg2.0_20_Nmax6.agr
+
+    returns:
+        (kind, metadata) where kind is the file's original prefix
+        (e.g. "eigenphase_shift") and metadata is a dict with keys
+        ``metadata_keys``, or None if it's not a renamed NCSMC file
+    """
+    # not files we made from NCSMC output
+    if name.endswith(("_flipped", "_simplified")):
+        return None
+    # longest prefix first, e.g. wavefunction_NCSMC before wavefunction
+    for prefix, suffix in sorted(rename_post_ncsmc.output_files,
+                                 key=lambda pair: -len(pair[0])):
+        if not (name.startswith(prefix + "_") and name.endswith(suffix)):
+            continue
+        details = name[len(prefix) + 1:len(name) - len(suffix)]
+        match = details_regex.match(details)
+        if match is not None:
+            metadata = match.groupdict()
+            metadata["Nmax"] = int(metadata["Nmax"])
+            metadata["affix"] = metadata["affix"] or ""
+            return prefix, metadata
+    return None
+
+
+def file_hash(path):
+    """sha1 of a file's contents"""
+    sha = hashlib.sha1()
+    with open(path, "rb") as open_file:
+        for block in iter(lambda: open_file.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class Catalog:
+    """
+    The database of runs.
+
+    db_path:
+        string, path to the SQLite file (made if it doesn't exist)
+    """
+
+    def __init__(self, db_path=db_file):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(schema)
+
+    def close(self):
+        self.connection.close()
+
+    def _run_id(self, metadata, directory):
+        """ID of a run, adding it if it's new"""
+        values = [metadata[key] for key in metadata_keys] + [directory]
+        self.connection.execute(
+            "INSERT OR IGNORE INTO runs ({}, directory) VALUES ({})".format(
+                ", ".join(metadata_keys), ", ".join("?" * len(values))),
+            values)
+        return self.connection.execute(
+            "SELECT id FROM runs WHERE {} AND directory = ?".format(
+                " AND ".join(key + " = ?" for key in metadata_keys)),
+            values).fetchone()[0]
+
+    def _known(self, path):
+        """(size, mtime, hash) we have for a file, or None"""
+        row = self.connection.execute(
+            "SELECT size, mtime, hash FROM files WHERE path = ?",
+            (path,)).fetchone()
+        return None if row is None else tuple(row)
+
+    def _files_under(self, prefix):
+        """
+        Rows (path, run_id) of files whose paths start with prefix.
+        (Not LIKE, since paths are full of _, which it takes as a wildcard.)
+        """
+        return self.connection.execute(
+            "SELECT path, run_id FROM files WHERE substr(path, 1, ?) = ?",
+            (len(prefix), prefix)).fetchall()
+
+    def _add_file(self, path, metadata, kind, size, mtime, hash_value,
+                  directory):
+        run_id = self._run_id(metadata, directory)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+            (path, run_id, kind, size, mtime, hash_value))
+        return run_id
+
+    def _index_bundle(self, path, stat, seen):
+        """Add every NCSMC file inside a bundle"""
+        directory = os.path.dirname(path)
+        known = self._known(path)
+        if known is not None and known[:2] == (stat.st_size, stat.st_mtime):
+            # bundle unchanged, so are its members
+            for row in self._files_under(path + utils.bundle_separator):
+                seen.add(row["path"])
+            seen.add(path)
+            return set()
+        changed = set()
+        with zipfile.ZipFile(path) as bundle:
+            for info in bundle.infolist():
+                parsed = parse_name(info.filename)
+                if parsed is None:
+                    continue
+                kind, metadata = parsed
+                member_path = path + utils.bundle_separator + info.filename
+                # zip already stores a checksum, no need to read the file
+                hash_value = "crc32:{:08x}".format(info.CRC)
+                seen.add(member_path)
+                if self._known(member_path) != (info.file_size, stat.st_mtime,
+                                                hash_value):
+                    changed.add(self._add_file(
+                        member_path, metadata, kind, info.file_size,
+                        stat.st_mtime, hash_value, directory))
+        # the bundle itself, so we can tell if it changes
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, NULL, 'bundle', ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime, None))
+        seen.add(path)
+        return changed
+
+    def index(self, directories):
+        """
+        Find NCSMC files in directories (and all their subdirectories),
+        and update the catalog. Only new or changed files are read.
+        Files that are gone are removed from the catalog.
+
+        directories:
+            list of strings, directories to look in
+
+        returns:
+            int, number of runs with new or changed files
+        """
+        seen = set()
+        changed = set()  # IDs of runs with new / changed files
+        roots = [utils.abs_path(directory) for directory in directories]
+        for root in roots:
+            for directory, _, names in os.walk(root):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    if name.endswith(".zip") and name.startswith("ncsmc_"):
+                        changed |= self._index_bundle(path, os.stat(path),
+                                                      seen)
+                        continue
+                    parsed = parse_name(name)
+                    if parsed is None:
+                        continue
+                    kind, metadata = parsed
+                    seen.add(path)
+                    stat = os.stat(path)
+                    known = self._known(path)
+                    if (known is not None
+                            and known[:2] == (stat.st_size, stat.st_mtime)):
+                        continue
+                    hash_value = file_hash(path)
+                    changed.add(self._add_file(
+                        path, metadata, kind, stat.st_size, stat.st_mtime,
+                        hash_value, directory))
+
+        # forget files under these roots that aren't there any more
+        for root in roots:
+            for row in self._files_under(os.path.join(root, "")):
+                if row["path"] not in seen:
+                    self.connection.execute(
+                        "DELETE FROM files WHERE path = ?", (row["path"],))
+                    if row["run_id"] is not None:
+                        changed.add(row["run_id"])
+        self.connection.execute(
+            "DELETE FROM runs WHERE id NOT IN "
+            "(SELECT run_id FROM files WHERE run_id IS NOT NULL)")
+        self.connection.execute(
+            "DELETE FROM summaries WHERE run_id NOT IN (SELECT id FROM runs)")
+
+        for run_id in changed:
+            self.summarize(run_id)
+        self.connection.commit()
+        print("indexed {} files, {} runs new or changed".format(
+            len(seen), len(changed)))
+        return len(changed)
+
+    def summarize(self, run_id):
+        """
+        Work out the summary of a run from its files, if they've changed.
+
+        run_id:
+            int, ID of the run
+        """
+        sources = {kind: self.files(run_id, kind)
+                   for kind in [out_kind, eigenphase_kind]}
+        sources = {kind: paths[0] for kind, paths in sources.items() if paths}
+        hashes = json.dumps({kind: self._known(path)[2]
+                             for kind, path in sources.items()},
+                            sort_keys=True)
+        row = self.connection.execute(
+            "SELECT source_hashes FROM summaries WHERE run_id = ?",
+            (run_id,)).fetchone()
+        if row is not None and row[0] == hashes:
+            return
+
+        threshold, ground_E, bound_states, strong = None, None, [], []
+        if out_kind in sources:
+            with utils.open_text(sources[out_kind]) as out_file:
+                ground_E, threshold, _, energies, titles = \
+                    output_simplifier.read_bound_states(out_file.readlines())
+            ground_E = None if ground_E == "ERROR" else ground_E
+            threshold = None if threshold == "ERROR" else threshold
+            bound_states = [[E, title] for E, title in zip(energies, titles)]
+        if eigenphase_kind in sources:
+            channels, _ = flipper.flipped_channels(sources[eigenphase_kind])
+            strong = [key.title for key, res_type in
+                      resonance_info.classify_channels(channels).items()
+                      if res_type == "strong"]
+        self.connection.execute(
+            "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?, ?)",
+            (run_id, threshold, ground_E, json.dumps(bound_states),
+             json.dumps(strong), hashes))
+
+    def find(self, **metadata):
+        """
+        Find runs, e.g. ``find(target="Li8", freq="20")``.
+
+        metadata:
+            values of any of ``metadata_keys`` (or "directory") to match
+
+        returns:
+            list of dicts, one per run, with its metadata, directory, id
+            and summary (threshold, ground_E, bound_states, strong_channels),
+            sorted by Nmax
+        """
+        for key in metadata:
+            if key not in metadata_keys + ["directory"]:
+                raise ValueError("can't search by {}, pick from {}".format(
+                    key, metadata_keys + ["directory"]))
+        where = " AND ".join("runs.{} = ?".format(key) for key in metadata)
+        rows = self.connection.execute(
+            "SELECT runs.*, threshold, ground_E, bound_states, "
+            "strong_channels FROM runs "
+            "LEFT JOIN summaries ON summaries.run_id = runs.id "
+            + ("WHERE " + where if where else "")
+            + " ORDER BY projectile, target, potential, freq, Nmax",
+            list(metadata.values())).fetchall()
+        runs = []
+        for row in rows:
+            run = dict(row)
+            for key in ["bound_states", "strong_channels"]:
+                run[key] = json.loads(run[key]) if run[key] else []
+            runs.append(run)
+        return runs
+
+    def files(self, run_id, kind=None):
+        """
+        Paths of a run's files (``bundle.zip::member`` for bundled ones).
+
+        run_id:
+            int, ID of the run
+
+        kind:
+            string, e.g. "eigenphase_shift" or "ncsm_rgm_Am2_1_1.out",
+            or None for all files
+        """
+        query = "SELECT path FROM files WHERE run_id = ?"
+        values = [run_id]
+        if kind is not None:
+            query += " AND kind = ?"
+            values.append(kind)
+        return [row[0] for row in
+                self.connection.execute(query + " ORDER BY path", values)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Catalog of NCSMC runs")
+    parser.add_argument("--db", type=str, default=db_file,
+                        help="path to the catalog database")
+    parser.add_argument("--index", nargs="+", default=[],
+                        help="directories to (re-)index")
+    parser.add_argument("query", nargs="*",
+                        help="key=value pairs to search for, e.g. target=Li8")
+    args = parser.parse_args()
+    catalog = Catalog(args.db)
+    if args.index:
+        catalog.index(args.index)
+    if args.query or not args.index:
+        query = dict(pair.split("=", 1) for pair in args.query)
+        if "Nmax" in query:
+            query["Nmax"] = int(query["Nmax"])
+        for run in catalog.find(**query):
+            print("{}{} {} freq={} Nmax={} {} ({})".format(
+                run["projectile"], run["target"], run["potential"],
+                run["freq"], run["Nmax"], run["affix"], run["directory"]))
+            print("    threshold = {}, ground state = {}".format(
+                run["threshold"], run["ground_E"]))
+            print("    bound states:", ", ".join(
+                "{} ({} MeV)".format(title, E)
+                for E, title in run["bound_states"]) or "none")
+            print("    strong resonances:",
+                  ", ".join(run["strong_channels"]) or "none")
+    catalog.close()
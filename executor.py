@@ -0,0 +1,557 @@
+"""
+Submit batch jobs (e.g. the NCSMC runs made by ``pheno.py``) and keep
+track of them, on a cluster or on this machine.
+
+Backends:
+
+- ``qsub``: PBS / Torque (or SGE) clusters
+- ``sbatch``: Slurm clusters
+- ``local``: runs jobs as subprocesses here, at most ``max_jobs`` at once.
+  Handy for testing off-cluster, e.g. with ``fake_ncsmc.py`` standing in
+  for NCSMC.
+
+Every job gets an entry in a small JSON ledger on disk (job ID, batch file,
+state, times), so you can check on a scan later, from another process.
+Job states are "pending" (not submitted yet, local only), "queued",
+"running", "done" and "failed". Clusters don't always tell us whether a job
+succeeded, so finished cluster jobs are usually just "done"; check their
+output to be sure.
+
+Typical use::
+
+    jobs = executor.get_executor("qsub", "/path/to/jobs.json")
+    job_ids = jobs.submit_array(["E_1/batch.sh", "E_2/batch.sh"])
+    jobs.wait(job_ids)  # or jobs.poll() now and then
+
+You can also check on a ledger with
+``python executor.py -l /path/to/jobs.json``.
+"""
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+# seconds between checks when waiting for jobs
+poll_interval = 60
+
+# how array jobs are requested from qsub: "-t" for Torque / SGE,
+# "-J" for PBS Pro
+qsub_array_flag = "-t"
+
+# directives copied from a batch file into array job scripts
+directive_prefixes = ["#PBS", "#SBATCH", "#$"]
+
+finished_states = ["done", "failed"]
+
+
+class Ledger:
+    """
+    A JSON file with a record for every job.
+
+    path:
+        string, path to the JSON file (made if it doesn't exist)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.jobs = {}  # key = job ID, value = dict describing the job
+        if os.path.exists(path):
+            with open(path, "r") as ledger_file:
+                self.jobs = json.load(ledger_file)["jobs"]
+
+    def add(self, job_id, batch_file, backend, name=None, **fields):
+        """
+        Add a job.
+
+        job_id:
+            string, ID of the job
+
+        batch_file:
+            string, path to the job's batch file
+
+        backend:
+            string, name of the backend that runs it
+
+        name:
+            string, a name for the job, by default the batch file's directory
+
+        fields:
+            anything else to record, e.g. state
+        """
+        if name is None:
+            name = os.path.basename(os.path.dirname(os.path.abspath(
+                batch_file)))
+        record = {"id": job_id, "name": name,
+                  "batch": os.path.abspath(batch_file), "backend": backend,
+                  "state": "queued", "submitted": time.time(),
+                  "finished": None}
+        record.update(fields)
+        self.jobs[job_id] = record
+
+    def update(self, job_id, state, **fields):
+        """
+        Change a job's state (and anything else).
+
+        job_id:
+            string, ID of the job
+
+        state:
+            string, new state of the job
+        """
+        record = self.jobs[job_id]
+        if state in finished_states and record["finished"] is None:
+            record["finished"] = time.time()
+        record["state"] = state
+        record.update(fields)
+
+    def unfinished(self, backend=None):
+        """IDs of jobs that haven't finished (for one backend, or all)"""
+        return [job_id for job_id, record in self.jobs.items()
+                if record["state"] not in finished_states
+                and backend in (None, record["backend"])]
+
+    def save(self):
+        """Write the ledger to disk"""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as ledger_file:
+            json.dump({"jobs": self.jobs}, ledger_file, indent=1,
+                      sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def run_command(command, cwd=None):
+    """
+    Run a command and return what it printed.
+
+    command:
+        list of strings, command and its arguments
+
+    cwd:
+        string, directory to run it in
+
+    returns:
+        string, stripped stdout
+    """
+    output = subprocess.run(
+        command, cwd=cwd, check=True, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, universal_newlines=True)
+    return output.stdout.strip()
+
+
+def array_script(batch_files, script_path, task_variable):
+    """
+    Write a script that runs one of many batch files,
+    picked by the array task number, for array job submission.
+
+    The scheduler directives (#PBS etc.) of the first batch file are
+    copied over, so all batch files should ask for the same resources.
+
+    batch_files:
+        list of strings, paths to batch files
+
+    script_path:
+        string, where to write the script
+
+    task_variable:
+        string, shell expression for the task number (starting at 1)
+
+    returns:
+        string, script_path
+    """
+    with open(batch_files[0], "r") as first_batch:
+        directives = [line for line in first_batch
+                      if any(line.startswith(prefix)
+                             for prefix in directive_prefixes)]
+    list_path = script_path + ".list"
+    with open(list_path, "w") as list_file:
+        list_file.writelines(
+            os.path.abspath(batch) + "\n" for batch in batch_files)
+    with open(script_path, "w") as script:
+        script.write("#!/bin/bash\n")
+        script.writelines(directives)
+        script.write('batch=$(sed -n "{}p" {})\n'.format(
+            task_variable, list_path))
+        script.write('cd "$(dirname "$batch")"\n')
+        script.write('bash "$batch"\n')
+    return script_path
+
+
+def pid_alive(pid):
+    """Is there a process with this ID?"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # someone else's process, but it exists
+    return True
+
+
+def array_path(ledger_path):
+    """
+    Where to write an array job script, next to the ledger.
+    The name is unique (the file is made here, empty), so arrays
+    submitted at the same time don't overwrite each other's scripts.
+    """
+    fd, path = tempfile.mkstemp(
+        prefix="array_{}_".format(int(time.time())), suffix=".sh",
+        dir=os.path.dirname(os.path.abspath(ledger_path)))
+    os.close(fd)
+    return path
+
+
+class Executor:
+    """
+    Base class for backends, see ``get_executor``.
+
+    ledger_path:
+        string, path to the JSON ledger of jobs
+    """
+    name = None
+
+    def __init__(self, ledger_path):
+        self.ledger = Ledger(ledger_path)
+
+    def submit(self, batch_file, name=None):
+        """
+        Submit one job.
+
+        batch_file:
+            string, path to batch file. It's submitted from its directory.
+
+        name:
+            string, a name for the job, by default the batch file's directory
+
+        returns:
+            string, job ID
+        """
+        raise NotImplementedError
+
+    def submit_array(self, batch_files, names=None):
+        """
+        Submit many jobs at once, e.g. one per test energy.
+
+        batch_files:
+            list of strings, paths to batch files
+
+        names:
+            list of strings, names for the jobs (optional)
+
+        returns:
+            list of strings, job IDs
+        """
+        names = names or [None] * len(batch_files)
+        job_ids = [self.submit(batch, name)
+                   for batch, name in zip(batch_files, names)]
+        return job_ids
+
+    def poll(self):
+        """
+        Check on all unfinished jobs of this backend, and update the ledger.
+
+        returns:
+            dict, key = job ID, value = state, for every job in the ledger
+        """
+        raise NotImplementedError
+
+    def wait(self, job_ids=None, interval=None, timeout=None):
+        """
+        Wait for jobs to finish.
+
+        job_ids:
+            list of strings, jobs to wait for (default: all unfinished jobs)
+
+        interval:
+            float, seconds between checks (default: ``poll_interval``)
+
+        timeout:
+            float, give up after this many seconds (default: never)
+
+        returns:
+            dict, key = job ID, value = ledger record, for the jobs waited on
+        """
+        if job_ids is None:
+            job_ids = self.ledger.unfinished(self.name)
+        if interval is None:
+            interval = poll_interval
+        start = time.time()
+        while True:
+            states = self.poll()
+            waiting = [job_id for job_id in job_ids
+                       if states[job_id] not in finished_states]
+            if not waiting:
+                break
+            if timeout is not None and time.time() - start > timeout:
+                print("gave up waiting for", len(waiting), "jobs")
+                break
+            time.sleep(interval)
+        return {job_id: self.ledger.jobs[job_id] for job_id in job_ids}
+
+    def status(self):
+        """
+        A table of every job in the ledger.
+
+        returns:
+            string
+        """
+        lines = ["{:<20} {:<8} {:<8} {}".format(
+            "job", "backend", "state", "name")]
+        for job_id, record in sorted(self.ledger.jobs.items(),
+                                     key=lambda item: item[1]["submitted"]):
+            lines.append("{:<20} {:<8} {:<8} {}".format(
+                job_id, record["backend"], record["state"], record["name"]))
+        return "\n".join(lines)
+
+
+class LocalExecutor(Executor):
+    """
+    Runs jobs as subprocesses on this machine.
+
+    Jobs only run while this object is around, so call ``wait()``
+    (or ``poll()`` now and then) after submitting.
+
+    ledger_path:
+        string, path to the JSON ledger of jobs
+
+    max_jobs:
+        int, most jobs to run at once
+
+    command:
+        list of strings, command to run in each batch file's directory
+        instead of the batch file, e.g.
+        ``[sys.executable, "/path/to/fake_ncsmc.py"]``.
+        None = run the batch file with bash.
+    """
+    name = "local"
+
+    def __init__(self, ledger_path, max_jobs=1, command=None):
+        super().__init__(ledger_path)
+        self.max_jobs = max_jobs
+        self.command = command
+        self.processes = {}  # key = job ID, value = running Popen
+        self.submitted = []  # IDs of jobs submitted here
+
+    def submit(self, batch_file, name=None):
+        job_id = "local-{}-{}".format(os.getpid(), len(self.ledger.jobs))
+        self.ledger.add(job_id, batch_file, self.name, name, state="pending",
+                        pid=None, returncode=None)
+        self.submitted.append(job_id)
+        self.ledger.save()
+        self.poll()
+        return job_id
+
+    def _start(self, job_id):
+        """Start a pending job"""
+        record = self.ledger.jobs[job_id]
+        run_dir = os.path.dirname(record["batch"])
+        command = self.command or ["bash", record["batch"]]
+        log_path = os.path.join(run_dir, "{}.log".format(job_id))
+        with open(log_path, "w") as log:
+            process = subprocess.Popen(command, cwd=run_dir, stdout=log,
+                                       stderr=subprocess.STDOUT)
+        self.processes[job_id] = process
+        self.ledger.update(job_id, "running", pid=process.pid, log=log_path)
+
+    def poll(self):
+        for job_id, process in list(self.processes.items()):
+            returncode = process.poll()
+            if returncode is not None:
+                del self.processes[job_id]
+                self.ledger.update(job_id,
+                                   "done" if returncode == 0 else "failed",
+                                   returncode=returncode)
+        for job_id in self.ledger.unfinished(self.name):
+            record = self.ledger.jobs[job_id]
+            if (record["state"] == "running" and job_id not in self.processes
+                    and not pid_alive(record["pid"])):
+                # started by a process that's gone, so it was killed with it
+                self.ledger.update(job_id, "failed")
+            elif (record["state"] == "pending" and job_id in self.submitted
+                    and len(self.processes) < self.max_jobs):
+                self._start(job_id)
+        self.ledger.save()
+        return {job_id: record["state"]
+                for job_id, record in self.ledger.jobs.items()}
+
+
+class QsubExecutor(Executor):
+    """
+    Submits jobs with qsub, and checks on them with qstat.
+
+    ledger_path:
+        string, path to the JSON ledger of jobs
+    """
+    name = "qsub"
+
+    # qstat state letters, anything else counts as running
+    queued_letters = "QHWT"
+    finished_letters = "CEF"
+
+    def submit(self, batch_file, name=None):
+        job_id = run_command(["qsub", os.path.basename(batch_file)],
+                             cwd=os.path.dirname(os.path.abspath(batch_file)))
+        self.ledger.add(job_id, batch_file, self.name, name)
+        self.ledger.save()
+        return job_id
+
+    def submit_array(self, batch_files, names=None):
+        if len(batch_files) == 1:
+            return super().submit_array(batch_files, names)
+        names = names or [None] * len(batch_files)
+        script = array_script(
+            batch_files, array_path(self.ledger.path),
+            "${PBS_ARRAYID:-${PBS_ARRAY_INDEX:-$SGE_TASK_ID}}")
+        array_id = run_command([
+            "qsub", qsub_array_flag, "1-{}".format(len(batch_files)), script])
+        job_ids = []
+        for i, (batch, name) in enumerate(zip(batch_files, names)):
+            # e.g. 123[].server --> 123[1].server
+            job_id = array_id.replace("[]", "[{}]".format(i + 1))
+            self.ledger.add(job_id, batch, self.name, name, array=array_id)
+            job_ids.append(job_id)
+        self.ledger.save()
+        return job_ids
+
+    def poll(self):
+        job_ids = self.ledger.unfinished(self.name)
+        if job_ids:
+            # qstat -t lists array tasks too
+            try:
+                output = run_command(["qstat", "-t"])
+            except subprocess.CalledProcessError:
+                output = ""
+            letters = {}
+            for line in output.splitlines():
+                words = line.split()
+                if len(words) >= 5:
+                    letters[words[0]] = words[4]
+            for job_id in job_ids:
+                # qstat may cut the ID short, e.g. "123[1].serv"
+                letter = next((letter for listed, letter in letters.items()
+                               if job_id.startswith(listed.rstrip("+"))),
+                              None)
+                if letter is None or letter in self.finished_letters:
+                    self.ledger.update(job_id, "done")
+                elif letter in self.queued_letters:
+                    self.ledger.update(job_id, "queued")
+                else:
+                    self.ledger.update(job_id, "running")
+            self.ledger.save()
+        return {job_id: record["state"]
+                for job_id, record in self.ledger.jobs.items()}
+
+
+class SbatchExecutor(Executor):
+    """
+    Submits jobs with sbatch, and checks on them with squeue / sacct.
+
+    ledger_path:
+        string, path to the JSON ledger of jobs
+    """
+    name = "sbatch"
+
+    # Slurm job states, anything else counts as failed once it's
+    # left the queue
+    queued_states = ["PENDING", "CONFIGURING", "REQUEUED", "SUSPENDED"]
+    running_states = ["RUNNING", "COMPLETING"]
+
+    def submit(self, batch_file, name=None):
+        # --parsable prints "id" or "id;cluster"
+        job_id = run_command(
+            ["sbatch", "--parsable", os.path.basename(batch_file)],
+            cwd=os.path.dirname(os.path.abspath(batch_file))).split(";")[0]
+        self.ledger.add(job_id, batch_file, self.name, name)
+        self.ledger.save()
+        return job_id
+
+    def submit_array(self, batch_files, names=None):
+        if len(batch_files) == 1:
+            return super().submit_array(batch_files, names)
+        names = names or [None] * len(batch_files)
+        script = array_script(
+            batch_files, array_path(self.ledger.path),
+            "$SLURM_ARRAY_TASK_ID")
+        array_id = run_command([
+            "sbatch", "--parsable", "--array=1-{}".format(len(batch_files)),
+            script]).split(";")[0]
+        job_ids = []
+        for i, (batch, name) in enumerate(zip(batch_files, names)):
+            job_id = "{}_{}".format(array_id, i + 1)
+            self.ledger.add(job_id, batch, self.name, name, array=array_id)
+            job_ids.append(job_id)
+        self.ledger.save()
+        return job_ids
+
+    def poll(self):
+        job_ids = self.ledger.unfinished(self.name)
+        if job_ids:
+            states = {}
+            # sacct knows about finished jobs too, but isn't always set up
+            for command in [["squeue", "-h", "-r", "-o", "%i %T"],
+                            ["sacct", "-n", "-P", "-X", "-o", "JobID,State",
+                             "-j", ",".join(job_ids)]]:
+                try:
+                    output = run_command(command)
+                except (subprocess.CalledProcessError, OSError):
+                    continue
+                for line in output.replace("|", " ").splitlines():
+                    words = line.split()
+                    if len(words) >= 2:
+                        states.setdefault(words[0], words[1])
+            for job_id in job_ids:
+                state = states.get(job_id)
+                if state is None or state == "COMPLETED":
+                    self.ledger.update(job_id, "done")
+                elif state in self.queued_states:
+                    self.ledger.update(job_id, "queued")
+                elif state in self.running_states:
+                    self.ledger.update(job_id, "running")
+                else:
+                    self.ledger.update(job_id, "failed", slurm_state=state)
+            self.ledger.save()
+        return {job_id: record["state"]
+                for job_id, record in self.ledger.jobs.items()}
+
+
+backends = {
+    "local": LocalExecutor,
+    "qsub": QsubExecutor,
+    "sbatch": SbatchExecutor,
+}
+
+
+def get_executor(backend, ledger_path, **kwargs):
+    """
+    Make an executor for a backend.
+
+    backend:
+        string, "qsub", "sbatch" or "local"
+
+    ledger_path:
+        string, path to the JSON ledger of jobs
+
+    kwargs:
+        other arguments for the backend, e.g. max_jobs for "local"
+    """
+    if backend not in backends:
+        raise ValueError("unknown backend {}, pick from {}".format(
+            backend, sorted(backends)))
+    return backends[backend](ledger_path, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check on submitted jobs")
+    parser.add_argument("-l", "--ledger", type=str, required=True,
+                        help="path to JSON ledger of jobs")
+    parser.add_argument("-b", "--backend", type=str, default=None,
+                        help="backend to poll before printing (qsub, sbatch)")
+    args = parser.parse_args()
+    executor = get_executor(args.backend or "qsub", args.ledger)
+    if args.backend is not None:
+        executor.poll()
+    print(executor.status())
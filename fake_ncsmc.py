@@ -0,0 +1,145 @@
+"""
+A stand-in for NCSMC, for testing pheno scans off-cluster
+(e.g. with the "local" backend in ``executor.py``).
+
+Run it in a run directory made by ``pheno.make_run_dir``. It finds the
+energy of the adjusted state (``pheno.J``, ``pheno.T``) in the coupling
+kernels there, and writes the files a real run would, with made-up
+but smooth physics:
+
+- ``ncsm_rgm_Am2_1_1.out``, with a bound state if the state ends up
+  below threshold
+- ``eigenphase_shift.agr``, with a resonance in that channel if it ends
+  up above threshold, plus a background channel
+
+The state's energy relative to threshold is
+``slope * (kernel energy - zero) + curvature * (kernel energy - zero)**2``,
+so scans have something a little non-linear to find.
+
+``python fake_ncsmc.py [--zero E] [--seconds s]``
+"""
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+
+import pheno
+
+# made-up physics, see above
+threshold_E = -69.0645
+ground_state_E = -68.4838
+zero = -33.0  # kernel energy that puts the state right at threshold
+slope = 0.8
+curvature = 0.01
+parity_sign = "+" if pheno.parity == 1 else "-"
+
+# eigenphase energies (relative to threshold)
+energies = np.arange(0.01, 8.0, 0.02)
+
+out_file = "ncsm_rgm_Am2_1_1.out"
+eigenphase_file = "eigenphase_shift.agr"
+
+
+def state_energy(kernel_energy):
+    """
+    Energy of the state relative to threshold, for a given kernel energy.
+
+    kernel_energy:
+        float, energy of the state in the coupling kernels
+    """
+    shift = kernel_energy - zero
+    return slope * shift + curvature * shift ** 2
+
+
+def width(energy):
+    """Width of a resonance at this energy (above threshold)"""
+    return 0.05 + 0.3 * energy ** 1.5
+
+
+def write_out(energy):
+    """
+    Write a (tiny) .out file, with a bound state if energy < 0
+
+    energy:
+        float, energy of the state relative to threshold
+    """
+    lines = [
+        " Ground-state E= {}  T_rel=   9.3033".format(ground_state_E),
+        " (the real thing has more here)",
+        " Lowest eigenenergy= {} MeV".format(ground_state_E),
+        " Threshold E= {} MeV".format(threshold_E),
+    ]
+    if energy < 0:
+        lines += [
+            " 2*J=  {}    parity={}".format(pheno.J2, pheno.parity),
+            " 2*T= {}".format(int(2 * pheno.T)),
+            " Bound state found at E_b= {:.4f} MeV".format(energy),
+            " i_p,p_chan,p_st = 1 1 1",
+        ]
+    lines.append(" end")
+    with open(out_file, "w") as dot_out:
+        dot_out.write("\n".join(lines) + "\n")
+
+
+def write_eigenphases(energy):
+    """
+    Write an xmgrace eigenphase file, with a resonance at energy if > 0
+
+    energy:
+        float, energy of the state relative to threshold
+    """
+    if energy > 0:
+        # Breit-Wigner phase, which NCSMC reports between -90 and 90
+        phase = np.degrees(np.arctan2(width(energy) / 2, energy - energies))
+        phase = (phase + 90) % 180 - 90
+    else:
+        # just a bit of smooth background above a bound state
+        phase = -10 * np.sqrt(energies)
+    background = -20 * np.sqrt(energies)
+    sections = [
+        ("{}\\S{}\\N{}".format(pheno.J2, parity_sign, int(2 * pheno.T)),
+         phase),
+        ("{}\\S{}\\N{}".format(pheno.J2 + 2, parity_sign, int(2 * pheno.T)),
+         background),
+    ]
+    with open(eigenphase_file, "w") as agr:
+        for i, (title, values) in enumerate(sections):
+            agr.write('@    s{} legend "{}"\n'.format(i, title))
+            for E, value in zip(energies, values):
+                agr.write("   {:.5f}   {:.5f}\n".format(E, value))
+            agr.write("&\n")
+
+
+def run(seconds=0):
+    """
+    Pretend to run NCSMC in the current directory.
+
+    seconds:
+        float, how long to pretend it takes
+    """
+    kernel_files = sorted(glob.glob("NCSMC_kernels.dat*"))
+    kernel_files = [f for f in kernel_files if not f.endswith(".json")]
+    if not kernel_files:
+        raise ValueError("no coupling kernels here, is this a run dir?")
+    kernel_energy = pheno.find_state(os.path.abspath(kernel_files[0]))["E"]
+    energy = state_energy(kernel_energy)
+    time.sleep(seconds)
+    write_out(energy)
+    write_eigenphases(energy)
+    if energy < 0:
+        print("bound state at", energy, "MeV")
+    else:
+        print("resonance at", energy, "MeV, width", width(energy), "MeV")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pretend to be NCSMC")
+    parser.add_argument("--zero", type=float, default=zero,
+                        help="kernel energy that puts the state at threshold")
+    parser.add_argument("--seconds", type=float, default=0,
+                        help="how long the fake run takes")
+    args = parser.parse_args()
+    zero = args.zero
+    run(args.seconds)
@@ -2,16 +2,24 @@
 Module for fitting cubics to resonances interactively.
 
 Creates GUI with interactive sliders to play with, to set left/right limits.
+
+Once a fit window has been chosen, ``bootstrap_resonance`` (or
+``bootstrap_channels`` for many channels at once) resamples the points and
+window edges around it to put confidence intervals on the resonance energy
+and width.
 """
 import csv
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
 import numpy as np
 import os
-import matplotlib.pyplot as plt
-from matplotlib.widgets import Slider, Button, TextBox
+
+import utils
 
 # a few global variables to edit as we edit the graphs
 width = 0
 res_energy = 0
+fit_window = (None, None)  # (left, right) energy bounds of the last fit
 
 
 def read_csv(filename):
@@ -71,7 +79,10 @@ def make_plot(x, y, title):
 
     (both list elements are floats)
     """
-    global res_energy, width
+    global res_energy, width, fit_window
+    # matplotlib is slow to import, so only import it once we need the GUI
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import Slider, Button, TextBox
 
     # there are a bunch of style parameters here that I had to play with
     # manually. If you can think of a better way to set up the graph,
@@ -119,6 +130,7 @@ def make_plot(x, y, title):
     # calculate resonance energy, resonance width
     res_energy = - c / (3 * d)
     width = 2 / np.radians(b + 2*c*res_energy + 3*d*res_energy**2)
+    fit_window = (min(x), max(x))
 
     # set up on-screen text
     res_energy_ax = plt.axes((0.7, 0.3, 0.2, 0.05))
@@ -140,9 +152,10 @@ def make_plot(x, y, title):
 
     # function to redraw graph
     def update(val):
-        global res_energy, width
+        global res_energy, width, fit_window
         left = l_slider.val
         right = r_slider.val
+        fit_window = (left, right)
 
         # get data that is within bounds
         indices = (left <= x) * (x <= right)
@@ -213,7 +226,68 @@ def make_plot(x, y, title):
     return [width, res_energy]
 
 
-def find_resonance(csv_filename):
+def auto_window(x, y, slope_fraction=0.25, min_points=6):
+    """
+    Choose a fit window without a human: the stretch of points around
+    the steepest part of the curve (the "upward swoop"), where the slope
+    stays above some fraction of its maximum.
+
+    x, y:
+        1D arrays of floats
+
+    slope_fraction:
+        float between 0 and 1, the window ends where the slope drops
+        below this fraction of the max slope
+
+    min_points:
+        int, the window is widened if needed to include this many points
+
+    returns:
+        (left, right) tuple of floats, energy bounds of the window
+    """
+    slope = np.gradient(y, x)
+    peak = int(np.argmax(slope))
+    steep = slope >= slope_fraction * slope[peak]
+    left, right = peak, peak
+    while left > 0 and steep[left-1]:
+        left -= 1
+    while right < len(x) - 1 and steep[right+1]:
+        right += 1
+    # a cubic needs a few points to be sensible
+    while right - left + 1 < min_points and (left > 0 or right < len(x) - 1):
+        left = max(left - 1, 0)
+        right = min(right + 1, len(x) - 1)
+    return float(x[left]), float(x[right])
+
+
+def fit_resonance(x, y, window=None):
+    """
+    The same fit as ``make_plot``, but without the GUI,
+    for running in batch jobs.
+
+    x, y:
+        1D arrays of floats
+
+    window:
+        (left, right) tuple of floats, energy bounds of the fit.
+        If None, one is chosen with ``auto_window``.
+
+    returns:
+        list of the form [(width of resonance), (energy of resonance)]
+    """
+    global res_energy, width, fit_window
+    if window is None:
+        window = auto_window(x, y)
+    left, right = window
+    indices = (left <= x) * (x <= right)
+    _, _, b, c, d = fit_cubic(x[indices], y[indices])
+    res_energy = - c / (3 * d)
+    width = 2 / np.radians(b + 2*c*res_energy + 3*d*res_energy**2)
+    fit_window = (left, right)
+    return [width, res_energy]
+
+
+def find_resonance(csv_filename, interactive=True, window=None):
     """
     Finds the energy at which a resonance occurs for given channel.
 
@@ -223,28 +297,25 @@ def find_resonance(csv_filename):
         or more generally,
 
         ``path/to/file/[word]_[2J]_[parity]_[2T]_column_[col]_Nmax_[Nmax].csv``
-    """
-    # get the important stuff out of filename
-    filename = os.path.split(csv_filename)[-1]
-    filename = filename.replace(".csv", "")
-    # "important stuff" = [word]_[2J]_[parity]_[2T]_column_[col]_Nmax_[Nmax]
-    _, J2, parity, T2, _, _, _, _ = filename.split("_")
 
-    # are J and T integers?
-    J_int = int(J2) / 2 == int(int(J2) / 2)
-    T_int = int(T2) / 2 == int(int(T2) / 2)
+    interactive:
+        boolean, fit with the GUI (``make_plot``)?
+        If False, use ``fit_resonance`` with the given window.
 
-    # strings for J and T, either in fraction or integer form
-    J = str(int(int(J2) / 2)) if J_int else "\\frac{{{}}}{{{}}}".format(J2, 2)
-    T = str(int(int(T2) / 2)) if T_int else "\\frac{{{}}}{{{}}}".format(T2, 2)
+    window:
+        (left, right) tuple of floats, or None to choose one automatically.
+        Only used if interactive is False.
+    """
+    # get the channel out of the filename
+    key = utils.ChannelKey.from_filename(csv_filename)
 
     # get data from csv file
     x, y = read_csv(csv_filename)
-
-    nice_title = "$J={},\\pi={},T={}$".format(J, parity, T)
+    if not interactive:
+        return fit_resonance(x, y, window)
 
     # res_info = [resonance width, resonance energy]
-    res_info = make_plot(x, y, nice_title)
+    res_info = make_plot(x, y, key.fit_title)
     return res_info
 
 
@@ -272,6 +343,315 @@ def save_info(csv_path, titles, widths, energies):
     with open(csv_path, "w+") as csv_file:
         csv_file.write(file_string)
 
+
+def save_windows(csv_path, titles, windows):
+    """
+    Save the fit window chosen for each resonance to a csv file,
+    so uncertainties can be estimated later without redoing the fits.
+
+    csv_path:
+        string, where to save the file
+
+    titles:
+        list of strings, titles of resonances
+
+    windows:
+        list of (left, right) tuples of floats, energy bounds of each fit
+    """
+    file_string = "2J_parity_2T_column,left,right\n"
+    for title, (left, right) in zip(titles, windows):
+        file_string += ",".join([title, str(left), str(right)]) + "\n"
+    with open(csv_path, "w+") as csv_file:
+        csv_file.write(file_string)
+
+
+def read_windows(csv_path):
+    """
+    Read fit windows saved by ``save_windows``.
+
+    csv_path:
+        string, path to the windows csv file
+
+    returns:
+        titles, windows; a list of strings and a list of (left, right) tuples
+    """
+    titles, windows = [], []
+    with open(csv_path, "r") as csv_file:
+        lines = csv_file.readlines()[1:]  # first line is a header
+    for line in lines:
+        title, left, right = line.strip().split(",")
+        titles.append(title)
+        windows.append((float(left), float(right)))
+    return titles, windows
+
+
+def fit_cubic_batch(x, y, weights):
+    """
+    Fit many weighted cubics to the same x, y data at once.
+
+    x, y:
+        1D arrays of floats, length N
+
+    weights:
+        2D array of shape (B, N), one row of point weights per fit.
+        A weight of 0 drops a point, a weight of 2 counts it twice, ...
+
+    returns:
+        (B, 4) array of coefficients a, b, c, d (y = a + bx + cx^2 + dx^3),
+        with rows of NaN where the fit was underdetermined
+    """
+    # centre x so the normal equations stay well conditioned
+    x0 = np.mean(x)
+    u = x - x0
+    vander = np.stack([np.ones_like(u), u, u**2, u**3], axis=1)  # (N, 4)
+
+    # weighted normal equations, (V^T W V) p = V^T W y, for every row of W
+    lhs = np.einsum("bn,ni,nj->bij", weights, vander, vander)
+    rhs = np.einsum("bn,ni,n->bi", weights, vander, y)
+
+    # a cubic needs at least 4 distinct points
+    ok = np.count_nonzero(weights, axis=1) >= 4
+    lhs[~ok] = np.eye(4)
+    rhs[~ok] = 0
+    coeffs = np.linalg.solve(lhs, rhs[..., None])[..., 0]
+    coeffs[~ok] = np.nan
+
+    # shift back from u = x - x0 to x
+    a, b, c, d = coeffs.T
+    shifted = np.stack([
+        a - b*x0 + c*x0**2 - d*x0**3,
+        b - 2*c*x0 + 3*d*x0**2,
+        c - 3*d*x0,
+        d], axis=1)
+    return shifted
+
+
+def resonance_from_coeffs(coeffs):
+    """
+    Resonance energy and width from cubic coefficients,
+    same definitions as in ``make_plot``.
+
+    coeffs:
+        (B, 4) array of a, b, c, d values, as returned by ``fit_cubic_batch``
+
+    returns:
+        energies, widths; 1D arrays of floats
+    """
+    _, b, c, d = coeffs.T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        energies = - c / (3 * d)
+        widths = 2 / np.radians(b + 2*c*energies + 3*d*energies**2)
+    return energies, widths
+
+
+def bootstrap_resonance(x, y, window=None, n_samples=1000, edge_jitter=3,
+                        method="bootstrap", confidence=0.68, seed=None,
+                        batch_size=250):
+    """
+    Estimate confidence intervals for a resonance's energy and width
+    by resampling around a chosen fit window.
+
+    x, y:
+        1D arrays of floats, the whole channel (energies and phases)
+
+    window:
+        (left, right) tuple of floats, the fit window, e.g. ``fit_window``
+        after ``make_plot``. Defaults to the full range of x.
+
+    n_samples:
+        int, number of bootstrap resamples (ignored for the jackknife)
+
+    edge_jitter:
+        int, each window edge is moved by up to this many points per resample
+
+    method:
+        string, "bootstrap" (resample points with replacement and move the
+        window edges) or "jackknife" (leave one point out at a time)
+
+    confidence:
+        float between 0 and 1, width of the confidence intervals
+
+    seed:
+        int or None, for reproducible resampling
+
+    batch_size:
+        int, how many fits to solve per vectorized batch
+
+    returns:
+        dict with keys energy, width (point estimates from the full window),
+        energy_ci, width_ci ((low, high) tuples) and n_samples
+        (number of resamples that gave a usable fit)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if window is None:
+        window = (x[0], x[-1])
+    lo = int(np.searchsorted(x, window[0], side="left"))
+    hi = int(np.searchsorted(x, window[1], side="right")) - 1
+    if hi - lo + 1 < 4:
+        raise ValueError("Need at least 4 points in the fit window!")
+
+    # point estimate, i.e. what the GUI would show for this window
+    full = np.zeros((1, n))
+    full[0, lo:hi+1] = 1
+    energy, width = resonance_from_coeffs(fit_cubic_batch(x, y, full))
+    energy, width = float(energy[0]), float(width[0])
+
+    rng = np.random.default_rng(seed)
+    energies, widths = [], []
+    if method == "jackknife":
+        n_samples = hi - lo + 1
+    elif method != "bootstrap":
+        raise ValueError("Unknown method '{}'".format(method))
+
+    for start in range(0, n_samples, batch_size):
+        size = min(batch_size, n_samples - start)
+        weights = np.zeros((size, n))
+        if method == "jackknife":
+            weights[:, lo:hi+1] = 1
+            left_out = np.arange(lo + start, lo + start + size)
+            weights[np.arange(size), left_out] = 0
+        else:
+            # move each window edge by a few points
+            los = np.clip(
+                lo + rng.integers(-edge_jitter, edge_jitter+1, size), 0, n-1)
+            his = np.clip(
+                hi + rng.integers(-edge_jitter, edge_jitter+1, size), 0, n-1)
+            counts = np.maximum(his - los + 1, 0)
+            # then draw that many points, with replacement, inside the window
+            max_count = max(counts.max(), 1)
+            picks = los[:, None] + np.floor(
+                rng.random((size, max_count)) * counts[:, None]).astype(int)
+            used = np.arange(max_count)[None, :] < counts[:, None]
+            rows = np.repeat(np.arange(size), max_count)
+            np.add.at(weights, (rows[used.ravel()], picks[used]), 1)
+        e, w = resonance_from_coeffs(fit_cubic_batch(x, y, weights))
+        energies.append(e)
+        widths.append(w)
+
+    energies = np.concatenate(energies)
+    widths = np.concatenate(widths)
+    good = np.isfinite(energies) & np.isfinite(widths)
+    energies, widths = energies[good], widths[good]
+    if len(energies) == 0:
+        raise ValueError("None of the resampled fits worked!")
+
+    if method == "jackknife":
+        # jackknife standard error, then a normal interval around the estimate
+        m = len(energies)
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        e_se = np.sqrt((m - 1) / m * np.sum((energies - energies.mean())**2))
+        w_se = np.sqrt((m - 1) / m * np.sum((widths - widths.mean())**2))
+        energy_ci = (energy - z * e_se, energy + z * e_se)
+        width_ci = (width - z * w_se, width + z * w_se)
+    else:
+        # percentile intervals
+        tails = [50 * (1 - confidence), 50 * (1 + confidence)]
+        energy_ci = tuple(np.percentile(energies, tails))
+        width_ci = tuple(np.percentile(widths, tails))
+
+    return {
+        "energy": energy,
+        "width": width,
+        "energy_ci": tuple(float(v) for v in energy_ci),
+        "width_ci": tuple(float(v) for v in width_ci),
+        "n_samples": len(energies),
+    }
+
+
+def _bootstrap_csv(job):
+    """
+    Worker for ``bootstrap_channels``, runs in a separate process.
+
+    job:
+        tuple of (csv_filename, window, keyword arguments)
+    """
+    csv_filename, window, kwargs = job
+    x, y = read_csv(csv_filename)
+    return bootstrap_resonance(x, y, window=window, **kwargs)
+
+
+def bootstrap_channels(csv_filenames, windows=None, processes=None, seed=0,
+                       **kwargs):
+    """
+    Run ``bootstrap_resonance`` for many channels, spread over a process pool.
+
+    csv_filenames:
+        list of strings, 2-column channel csv files
+        (e.g. those returned by ``resonance_plotter.plot``)
+
+    windows:
+        list of (left, right) tuples, one per file, or None to use full ranges
+
+    processes:
+        int or None, number of worker processes (None = one per core).
+        Use 1 to do everything in this process.
+
+    seed:
+        int, channel i is resampled with seed ``seed + i`` so results
+        don't depend on how the work is split up
+
+    any other keyword arguments are passed on to ``bootstrap_resonance``
+
+    returns:
+        list of dicts from ``bootstrap_resonance``, in the same order as
+        csv_filenames
+    """
+    if windows is None:
+        windows = [None] * len(csv_filenames)
+    jobs = [(f, w, dict(kwargs, seed=seed+i))
+            for i, (f, w) in enumerate(zip(csv_filenames, windows))]
+    if processes == 1 or len(jobs) <= 1:
+        return [_bootstrap_csv(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_bootstrap_csv, jobs))
+
+
+def save_uncertainties(csv_path, titles, results):
+    """
+    Save bootstrap / jackknife confidence intervals to a csv file.
+
+    csv_path:
+        string, where to save the file
+
+    titles:
+        list of strings, titles of resonances
+
+    results:
+        list of dicts, as returned by ``bootstrap_channels``
+    """
+    file_string = ("2J_parity_2T_column,width,width_low,width_high,"
+                   "energy,energy_low,energy_high\n")
+    for title, res in zip(titles, results):
+        values = [res["width"], *res["width_ci"],
+                  res["energy"], *res["energy_ci"]]
+        file_string += ",".join([title] + [str(v) for v in values]) + "\n"
+    with open(csv_path, "w+") as csv_file:
+        csv_file.write(file_string)
+
+
+def read_uncertainties(csv_path):
+    """
+    Read confidence intervals saved by ``save_uncertainties``.
+
+    csv_path:
+        string, path to the uncertainties csv file
+
+    returns:
+        dict, key = title, value = (width_ci, energy_ci),
+        each a (low, high) tuple of floats
+    """
+    uncertainties = {}
+    with open(csv_path, "r") as csv_file:
+        lines = csv_file.readlines()[1:]  # first line is a header
+    for line in lines:
+        title, _, w_lo, w_hi, _, e_lo, e_hi = line.strip().split(",")
+        uncertainties[title] = ((float(w_lo), float(w_hi)),
+                                (float(e_lo), float(e_hi)))
+    return uncertainties
+
+
 if __name__ == "__main__":
 
     eigenphase_csvs = [
@@ -26,9 +26,9 @@ if you've edited the filepath at the top of this file, or with::
 
 """
 import argparse
+import math
 
-import numpy as np
-
+import profiler
 import utils
 
 filepath = "/path/to/eigenphase_shift.agr"
@@ -53,26 +53,28 @@ def flip_if_needed(top_nums, btm_nums):
     
     for i in range(len(top_nums)):  # there might be more new nums than old
         diff = top_nums[i] - btm_nums[i]
-        flipped_diff = top_nums[i] - (btm_nums[i] + np.sign(diff) * 180)
+        flipped_diff = top_nums[i] - (btm_nums[i] + math.copysign(180, diff))
         if abs(diff) > abs(flipped_diff):
-            btm_nums[i] += np.sign(diff) * 180
+            btm_nums[i] += math.copysign(180, diff)
     return btm_nums
 
 
+@profiler.timed("flipper.sanitize")
 def sanitize(filename):
     """
     Opens NCSMC output file, reads each line, separates into text lines and
     number lines. Sets NaN values to zero.
 
     filename:
-        ncsmc eigenphase_shift or phase_shift file path
+        ncsmc eigenphase_shift or phase_shift file path,
+        or ``bundle.zip::member`` for one inside a bundle
 
     returns:
         - one list of strings, for title lines 
         - one list of number lines, each entry is a sub-list of floats
 
     """
-    with open(filename, "r+") as read_file:
+    with utils.open_text(filename) as read_file:
         lines = read_file.readlines()
     text_lines = []
     number_lines = []
@@ -89,6 +91,7 @@ def sanitize(filename):
             # save numbers for analysis later
             nums = [float(n) for n in nums]
             number_lines.append(nums)
+    profiler.count(rows=len(number_lines), text_lines=len(text_lines))
     return text_lines, number_lines
 
 
@@ -221,10 +224,12 @@ def separate_into_megasections(sections):
     return list(reversed(mega_sections))  # now it's top-to-bottom
 
 
+@profiler.timed("flipper.separate_into_channels")
 def separate_into_channels(filename):
     """
     Returns channels (i.e. individual columns within megasections)
-    as lists of floats, along with their associated labels (strings).
+    as lists of floats, along with their associated labels
+    (``utils.ChannelKey``).
 
     Also returns energies associated with each row. Note that not all
     channels have the same length as the energy list!
@@ -234,7 +239,38 @@ def separate_into_channels(filename):
     """
     text_lines, num_lines = sanitize(filename)
     sections = separate_into_sections(num_lines)
+    channels, energies = channels_from_sections(sections, text_lines)
+    profiler.count(channels=len(channels))
+    return channels, energies
+
+
+def flipped_channels(filename):
+    """
+    Same as ``separate_into_channels(flip(filename))``, but without
+    writing the flipped file, e.g. for just looking at a file.
+
+    filename:
+        string, the path to a phase_shift / eigenphase_shift file
+        (or ``bundle.zip::member``)
+    """
+    text_lines, number_lines = sanitize(filename)
+    sections = separate_into_sections(number_lines)
+    sections = flip_columns(sections)
+    sections = flip_all_sections(sections)
+    sections = start_from_zero(sections)
+    return channels_from_sections(sections, text_lines)
+
 
+def channels_from_sections(sections, text_lines):
+    """
+    Split sections into channels, see ``separate_into_channels``.
+
+    sections:
+        list, same format as output by ``separate_into_sections``
+
+    text_lines:
+        lines from the file which contained non-number characters
+    """
     titles = []
     for line in text_lines:
         if "&" not in line:  # all that's left is titles
@@ -250,9 +286,9 @@ def separate_into_channels(filename):
 
         # note that we're ignoring energy columns here (the first columns)
 
-        channel_title_fmt = ms_title+" column {}"
+        section_key = utils.ChannelKey.from_xmgrace(ms_title)
         channel_titles = [
-            channel_title_fmt.format(i) for i in range(1, max_cols)]
+            section_key.with_column(i) for i in range(1, max_cols)]
 
         for i in range(max_cols-1):
             channels[channel_titles[i]] = []
@@ -264,10 +300,24 @@ def separate_into_channels(filename):
 
     # now make list to contain energy values
     energies = [line[0] for line in mega_sections[0]]
-
     return channels, energies
 
 
+def channel_energies(energies, phases):
+    """
+    Energies that go with one channel's phases. Channels that open partway
+    through a file are missing their first energies, not their last, so
+    these are the last len(phases) energies.
+
+    energies:
+        list (or array) of floats, e.g. from ``separate_into_channels``
+
+    phases:
+        list of floats, phases of one channel
+    """
+    return energies[len(energies) - len(phases):]
+
+
 def do_one_flip(section):
     """
     Perform the flip operation on one section one time
@@ -300,6 +350,7 @@ def flip_one_section(section):
     return new_section
 
 
+@profiler.timed("flipper.write_data")
 def write_data(sections, text_lines, filename):
     """
     Write flipped data back into a file,
@@ -313,9 +364,10 @@ def write_data(sections, text_lines, filename):
         lines from the original file which did contained non-number characters
 
     filename:
-        path to phase_shift / eigenphase_shift file
+        path to phase_shift / eigenphase_shift file. For one inside a bundle,
+        the flipped file goes next to the bundle.
     """
-    write_filename = filename+'_flipped'
+    write_filename = utils.unbundled_path(filename)+'_flipped'
     text_line_counter = 0
     tlc = text_line_counter
     with open(write_filename, "w+") as write_file:
@@ -504,6 +556,7 @@ def apply_add_mapping(line, mapping):
     return new_line
 
 
+@profiler.timed("flipper.flip_columns")
 def flip_columns(sections):
     """
     Take a list of sections and return those same sections, but with
@@ -566,6 +619,7 @@ def flip_columns(sections):
     return separate_into_sections(list_of_lines)
 
 
+@profiler.timed("flipper.flip_all_sections")
 def flip_all_sections(sections):
     """
     Perform flipping operation on each section and make sure that there
@@ -617,6 +671,7 @@ def flip_all_sections(sections):
     return separate_into_sections(list_of_lines)
 
 
+@profiler.timed("flipper.start_from_zero")
 def start_from_zero(sections):
     """
     Ensure that all channels start "from zero",
@@ -665,6 +720,7 @@ def start_from_zero(sections):
     return separate_into_sections(list_of_lines)
 
 
+@profiler.timed("flipper.flip")
 def flip(read_filename, verbose=True):
     """
     Performs flipping operation from start to finish,
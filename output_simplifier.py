@@ -11,6 +11,7 @@ or just running the file with the command:
 import argparse
 import re
 
+import profiler
 import utils
 
 # enter a filename here,
@@ -176,36 +177,24 @@ def get_thresh_e(line):
     return float(E)
 
 
-def simplify(filename, verbose=False):
+def read_bound_states(lines, verbose=False):
     """
-    Makes a simpler version of ncsmc .out files,
-    no more scrolling through 100000 line files!
-
-    Steps:
-
-    1. Look for J, parity, T.
-        - we may have many of these values before seeing a bound state
-        - keep the most recent values before the bound state is mentioned
+    Get ground state / threshold energies and bound states from the lines
+    of a ncsmc .out file, see ``simplify`` for the steps.
 
-    2. Get bound state energy
-        - there may be multiple bound states with the same J pi T,
-          so don't stop looping through when we find one
-
-    3. Get details
-
-    filename:
-        string, path to ncsmc "dot out" file
+    lines:
+        list of strings, lines of the file
 
     verbose:
         boolean, whether or not to print messages
-    """
-    filename = utils.abs_path(filename)
-    if verbose:
-        print("Simplifying "+filename)
-    # get all lines from the file, as a list of strings
-    with open(filename, "r+") as file_to_simplify:
-        lines = file_to_simplify.readlines()
 
+    returns:
+        - ground state energy (float, or "ERROR" if not found)
+        - threshold energy (same)
+        - list of strings describing each bound state (see state_format)
+        - list of bound state energies (floats)
+        - list of bound state titles, like "J_parity_T"
+    """
     # if something went wrong, we'll see this where the right value should be
     default = "ERROR"
 
@@ -342,6 +331,44 @@ def simplify(filename, verbose=False):
     if step != "looking for bound state":
         raise IOError("unable to parse file correctly, exited at wrong step!")
 
+    return ground_E, thresh_E, states, E_list, state_titles
+
+
+@profiler.timed("output_simplifier.simplify")
+def simplify(filename, verbose=False):
+    """
+    Makes a simpler version of ncsmc .out files,
+    no more scrolling through 100000 line files!
+
+    Steps:
+
+    1. Look for J, parity, T.
+        - we may have many of these values before seeing a bound state
+        - keep the most recent values before the bound state is mentioned
+
+    2. Get bound state energy
+        - there may be multiple bound states with the same J pi T,
+          so don't stop looping through when we find one
+
+    3. Get details
+
+    filename:
+        string, path to ncsmc "dot out" file,
+        or ``bundle.zip::member`` for one inside a bundle
+
+    verbose:
+        boolean, whether or not to print messages
+    """
+    filename = utils.abs_path(filename)
+    if verbose:
+        print("Simplifying "+filename)
+    # get all lines from the file, as a list of strings
+    with utils.open_text(filename) as file_to_simplify:
+        lines = file_to_simplify.readlines()
+
+    ground_E, thresh_E, states, E_list, state_titles = read_bound_states(
+        lines, verbose)
+
     # write everything to a file
     if len(states) == 0:
         states = "No bound states found..."
@@ -352,12 +379,14 @@ def simplify(filename, verbose=False):
         ground_E=ground_E,
         thresh_E=thresh_E,
         states=states)
-    with open(filename+"_simplified", "w+") as out_file:
+    simplified_name = utils.unbundled_path(filename)+"_simplified"
+    with open(simplified_name, "w+") as out_file:
         out_file.write(file_str)
     if verbose:
         E_string = ", ".join([str(E) for E in E_list])
         print("Done simplifying! Found bound states at "+E_string)
-        print("Simplified output file: "+filename+"_simplified")
+        print("Simplified output file: "+simplified_name)
+    profiler.count(lines=len(lines), bound_states=len(E_list))
     return E_list, state_titles
 
 
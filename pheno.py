@@ -8,9 +8,22 @@ Warning:
 
 """
 from os.path import relpath, dirname, join, realpath, split, exists
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import errno
+import fcntl
+import glob
+import json
 import os
 import shutil
+import time
 import numpy as np
+
+import executor
+import fitter
+import flipper
+import output_simplifier
+import utils
 this_dir = dirname(__file__)  # directory of current file, for use later
 
 # NOTE: All energies in here are in MeV!
@@ -25,11 +38,23 @@ T = 1
 
 # data from TUNL
 tunl_E = 0.9808  # above ground state energy
+# experimental ground state energy relative to threshold (i.e. -S_n),
+# so the state should come out of NCSMC at tunl_E + tunl_ground_E
+tunl_ground_E = -4.0639
 
 # we'll make adjustments from our current energy value to the tunl value
 # how many adjustments do we make?
 n_adjustments = 1
 
+# or, search for the right kernel energy (python pheno.py --search):
+# stop when the state is this close to the TUNL value (MeV)
+search_tolerance = 0.02
+# and give up after this many NCSMC runs
+max_search_runs = 8
+# how much the state moves per MeV change in kernel energy, our first guess
+# (after one run we use the real slope)
+initial_slope = 1.0
+
 # relative paths are okay, relative to the directory containing this file
 ncsmc_output_dir = "../../Li8Li9/ncsmc/Nmax6/"
 batch_file = join(ncsmc_output_dir, "batch_ncsmc_6.sh")
@@ -41,52 +66,132 @@ rgm_kernels_file = join(ncsmc_output_dir, "RGM_kernels.dat_nLi8_NNn3lo3Nlnl-srg2
 dot_out_file = join(ncsmc_output_dir, "ncsm_rgm_Am2_1_1.out_nLi8_n3lo-NN3Nlnl-srg2.0_20_Nmax6")
 input_file = join(ncsmc_output_dir, "ncsm_rgm_Am2_1_1.in")
 exe_file = join(ncsmc_output_dir, "ncsm_rgm_Am3_3_plus_Am2_1_1_rmatrix_ortg_omp_mpi.exe")
+# interaction (.int) files NCSMC reads from the run directory,
+# None = every file in ncsmc_output_dir with ".int" in its name
+int_files = None
+
+# how to put unchanged inputs (exe, RGM kernels, .int files) in run dirs:
+# "hardlink" (falls back to "symlink" across filesystems), "symlink", "copy".
+# Links take no time or space; NCSMC only reads these files.
+link_mode = "hardlink"
+
+# most decimal places to write new state energies with
+energy_decimals = 6
+
+# how to run NCSMC: "qsub", "sbatch", or "local" (subprocesses on this machine)
+backend = "qsub"
+# wait for all runs to finish before returning? (always True for "local")
+wait_for_jobs = False
+# for the "local" backend: most runs at once, and what to run in each
+# run dir instead of the batch file, e.g. to test with the fake NCSMC:
+# ["python", join(this_dir, "fake_ncsmc.py")]. None = run the batch file
+max_local_jobs = 2
+local_command = None
+# where submitted jobs are tracked, see executor.py
+ledger_file = "pheno_jobs.json"
+
+# harvesting (python pheno.py --harvest): processes to use
+# (None = one per core), and the table of results it makes
+n_processes = None
+harvest_file = "scan_results.csv"
 
 # stop editing here
 
 J2 = J * 2
 
-def get_current_state_energy(coupling_file):
-    """Find the current energy of the state of interest."""
-    cpl_file = join(this_dir, coupling_file)
-    # get current value of state energy
-    with open(cpl_file, "r+") as kernels:
-        kernel_lines = kernels.readlines()
-
-    possible_channels = []
-    for i, line in enumerate(kernel_lines):
-        # check if it's the state we want
-        # if so, it will have exactly 3 "words" (entities separated by space)
-        words = line.split()
-        if len(words) != 3:
-            continue
-        # the first word should be 2J
-        file_J = int(words[0]) / 2
-        if file_J != J:
-            continue
-        # and the second word should be 2T
-        file_T = int(words[1]) / 2
-        if file_T != T:
-            continue
-
-        # the third word should be the state energy
-        file_E = float(words[2])
-
-        # if we made it this far, we've found a possible channel
-        possible_channels.append([file_J, file_T, file_E, i])
+def index_kernels(coupling_file):
+    """
+    Find every state energy line in a coupling kernels file.
+
+    State lines have exactly 3 "words": 2J, 2T and the state energy.
+    The file is streamed once (it can be huge), and for each state we keep
+    the byte offset and width of its energy field, so it can be changed
+    later without reading the file again (see ``patch_energy``).
+    The index is saved next to the file, as ``<file>.index.json``,
+    and reused as long as the file's size and modification time match.
+
+    coupling_file:
+        string, path to coupling kernels file
+
+    returns:
+        list of dicts with keys:
+        J2, T2, E (floats / ints), text (energy as written in the file),
+        line (index of the line, starting at 0),
+        offset (byte offset of the energy field), width (its width in bytes)
+    """
+    cpl_file = realpath(join(this_dir, coupling_file))
+    index_path = cpl_file + ".index.json"
+    stat = os.stat(cpl_file)
+    if exists(index_path):
+        try:
+            with open(index_path, "r") as index_file:
+                index = json.load(index_file)
+            if (index["size"] == stat.st_size
+                    and index["mtime"] == stat.st_mtime_ns):
+                return index["states"]
+        except (ValueError, KeyError):
+            pass  # broken index, just make a new one
+
+    states = []
+    offset = 0
+    with open(cpl_file, "rb") as kernels:
+        for i, line in enumerate(kernels):
+            words = line.split()
+            if len(words) == 3:
+                try:
+                    J2_i, T2_i = int(words[0]), int(words[1])
+                    E_i = float(words[2])
+                except ValueError:
+                    words = None
+                if words is not None:
+                    # the energy field is everything after the space
+                    # following 2T, up to the end of the line, so there's
+                    # room to write a longer number in its place
+                    T_end = line.index(words[1], line.index(words[0]) +
+                                       len(words[0])) + len(words[1])
+                    start = T_end + 1
+                    end = len(line.rstrip(b"\r\n"))
+                    states.append({
+                        "J2": J2_i, "T2": T2_i, "E": E_i,
+                        "text": words[2].decode(), "line": i,
+                        "offset": offset + start, "width": end - start})
+            offset += len(line)
+
+    try:
+        with open(index_path, "w") as index_file:
+            json.dump({"size": stat.st_size, "mtime": stat.st_mtime_ns,
+                       "states": states}, index_file)
+    except OSError:
+        pass  # e.g. read only directory, we'll just index it again next time
+    return states
+
+
+def find_state(coupling_file):
+    """
+    Find the state of interest (J, T, lowest energy)
+    in a coupling kernels file.
+
+    coupling_file:
+        string, path to coupling kernels file
+
+    returns:
+        dict, that state's entry from ``index_kernels``
+    """
+    possible_channels = [state for state in index_kernels(coupling_file)
+                         if state["J2"] / 2 == J and state["T2"] / 2 == T]
 
     # make sure we found at least one channel
     if len(possible_channels) == 0:
         raise ValueError("Channel with J, T, parity not found!")
 
-    # find which line had the lowest energy
-    line_num = 0
-    min_E = 1e100  # filler, we'll find real value soon
-    for _, _, E_i, i in possible_channels:
-        if E_i < min_E:
-            min_E = E_i
-            line_num = i
-    return min_E, line_num
+    # take the one with the lowest energy
+    return min(possible_channels, key=lambda state: state["E"])
+
+
+def get_current_state_energy(coupling_file):
+    """Find the current energy of the state of interest, and its line."""
+    state = find_state(coupling_file)
+    return state["E"], state["line"]
 
 def get_ground_state_energy(dot_out_file):
     """Get ground state energy from ncsmc output."""
@@ -104,37 +209,190 @@ def get_ground_state_energy(dot_out_file):
             # this won't ever change through the file so return the first one
             return float(E)
 
-def make_run_dir(new_energy, old_energy, line_num):
-    """Put all files needed to run ncsmc in a directory"""
+# ioctl request to clone a file's data (copy on write), from linux/fs.h
+FICLONE = 0x40049409
+
+
+def stage_file(source, destination, mode=link_mode):
+    """
+    Put an input file that NCSMC won't change into a run directory,
+    without copying its data if possible.
+
+    source:
+        string, path to the original file
+
+    destination:
+        string, where it should appear
+
+    mode:
+        string, "hardlink", "symlink" or "copy".
+        Hardlinks fall back to symlinks (e.g. across filesystems),
+        symlinks fall back to copies.
+
+    returns:
+        string, what was actually done: "hardlink", "symlink" or "copy"
+    """
+    source = realpath(source)
+    if mode == "hardlink":
+        try:
+            os.link(source, destination)
+            return "hardlink"
+        except OSError:
+            mode = "symlink"
+    if mode == "symlink":
+        try:
+            os.symlink(source, destination)
+            return "symlink"
+        except OSError:
+            pass
+    shutil.copy2(source, destination)  # keeps permissions, e.g. for the exe
+    return "copy"
+
+
+def materialize_file(source, destination):
+    """
+    Make a real, separate copy of a file we're about to modify.
+
+    Uses a reflink (copy-on-write clone) where the filesystem supports it
+    (btrfs, XFS, ...), so only the blocks we change take up new space.
+    Otherwise does a normal copy.
+
+    source:
+        string, path to the original file
+
+    destination:
+        string, where the copy should go
+
+    returns:
+        string, "reflink" or "copy"
+    """
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return "reflink"
+        except OSError as error:
+            if error.errno not in (errno.EOPNOTSUPP, errno.ENOTTY,
+                                   errno.EXDEV, errno.EINVAL, errno.ENOSYS,
+                                   errno.EBADF, errno.EPERM):
+                raise
+    shutil.copyfile(source, destination)
+    return "copy"
+
+
+def format_energy(energy, min_decimals):
+    """
+    Write an energy with ``energy_decimals`` decimal places,
+    dropping trailing zeros.
+
+    energy:
+        float, energy to write
+
+    min_decimals:
+        int, keep at least this many decimal places, e.g. as many as
+        the number we're replacing had
+
+    returns:
+        string
+    """
+    text = "{:.{}f}".format(energy, max(energy_decimals, min_decimals))
+    if "." in text:
+        integer, decimals = text.split(".")
+        decimals = decimals.rstrip("0").ljust(max(min_decimals, 1), "0")
+        text = integer + "." + decimals
+    return text
+
+
+def patch_energy(filename, state, new_energy):
+    """
+    Change a state energy in a copy of a coupling kernels file.
+
+    Only the energy field is overwritten (at the offset found by
+    ``index_kernels``), so it costs a few bytes of I/O however big the
+    file is, and a reflinked copy keeps sharing all its other blocks.
+    If the new number doesn't fit in the field, we fall back to
+    rewriting the whole file.
+
+    filename:
+        string, path to the (copied) file to change. It must have the same
+        contents as the file ``state`` was found in.
+
+    state:
+        dict, the state's entry from ``index_kernels``
+
+    new_energy:
+        float, new energy of the state
+    """
+    old_text = state["text"]
+    decimals = len(old_text.split(".")[1]) if "." in old_text else 0
+    new_text = format_energy(new_energy, decimals)
+    if len(new_text) <= state["width"]:
+        with open(filename, "r+b") as open_file:
+            open_file.seek(state["offset"])
+            open_file.write(new_text.rjust(state["width"]).encode())
+        return
+
+    # too long for the field, so everything after this line has to move
+    print("new energy doesn't fit in", filename, "rewriting the whole file")
+    tmp_name = filename + ".tmp"
+    with open(filename, "rb") as src, open(tmp_name, "wb") as dst:
+        for i, line in enumerate(src):
+            if i == state["line"]:
+                line = line.replace(old_text.encode(), new_text.encode())
+            dst.write(line)
+    os.replace(tmp_name, filename)
+
+
+def find_int_files():
+    """
+    Get the .int files to put in each run directory,
+    i.e. ``int_files``, or all files with ".int" in their name
+    in ``ncsmc_output_dir`` if that's None.
+    """
+    if int_files is not None:
+        return int_files
+    output_dir = join(this_dir, ncsmc_output_dir)
+    return [join(output_dir, f) for f in sorted(os.listdir(output_dir))
+            if ".int" in f]
+
+
+def make_run_dir(new_energy):
+    """
+    Put all files needed to run ncsmc in a directory
+
+    Inputs that don't change (exe, RGM kernels, .int files) are linked
+    (see ``stage_file``), coupling kernels are cloned / copied and then
+    have one energy changed, so a run directory takes seconds and
+    barely any disk space.
+
+    new_energy:
+        float, energy of the state of interest in this run
+
+    returns:
+        string, path to the batch file for this run
+    """
+    start = time.time()
+    how = []  # how each file was staged
     # first off make the dir
-    e_str = "{:05f}".format(new_energy).replace(".", "_").replace("-", "neg_")
-    run_dir = realpath(join(this_dir, "E_"+e_str))
+    run_dir = run_dir_name(new_energy)
     # if it exists delete it
     if exists(run_dir):
         shutil.rmtree(run_dir)
     os.mkdir(run_dir)
 
-    # copy exe
-    current_exe = realpath(join(this_dir, exe_file))
-    new_exe = join(run_dir, split(exe_file)[-1])
-    shutil.copyfile(current_exe, new_exe)
-
-    # copy rgm kernels
-    current_rgm = realpath(join(this_dir, rgm_kernels_file))
-    new_rgm = join(run_dir, split(rgm_kernels_file)[-1])
-    shutil.copyfile(current_rgm, new_rgm)
+    # link exe, rgm kernels and .int files, these don't change
+    for unchanged_file in ([exe_file, rgm_kernels_file] +
+                           find_int_files()):
+        current_file = realpath(join(this_dir, unchanged_file))
+        new_file = join(run_dir, split(unchanged_file)[-1])
+        how.append(stage_file(current_file, new_file))
 
     # copy coupling kernels and adjust the value in the new file
     for coupling_kernels_file in coupling_kernels_files:
-        current_coupling = realpath(coupling_kernels_file)
+        current_coupling = realpath(join(this_dir, coupling_kernels_file))
         new_coupling = join(run_dir, split(coupling_kernels_file)[-1])
-        shutil.copyfile(current_coupling, new_coupling)
-        with open(new_coupling, "r+") as coupling:
-            lines = coupling.readlines()
-        line = lines[line_num]
-        lines[line_num] = line.replace(str(old_energy), str(new_energy))
-        with open(new_coupling, "w+") as coupling:
-            coupling.writelines(lines)
+        state = find_state(current_coupling)
+        how.append(materialize_file(current_coupling, new_coupling))
+        patch_energy(new_coupling, state, new_energy)
     
     # copy and adjust input file so that the lines for 
     # J2min_in, J2_max_in, parity_min_in, parity_max_in
@@ -172,16 +430,236 @@ def make_run_dir(new_energy, old_energy, line_num):
     lines[cd_line] = "cd "+run_dir
     with open(new_batch, "w+") as batch:
         batch.writelines(lines)
-    
+
+    # remember what this run is, for harvesting later
+    with open(join(run_dir, "run_info.json"), "w") as info_file:
+        json.dump({"kernel_E": new_energy, "J": J, "parity": parity, "T": T,
+                   "made": time.time()}, info_file, indent=1)
+
+    print("made", run_dir, "in {:.1f} s ({})".format(
+        time.time() - start, ", ".join(
+            "{} x {}".format(how.count(h), h) for h in sorted(set(how)))))
+
     # that should be it! Return batch file so we can run that later
     return new_batch
 
-def adjust_energy(n_points):
-    """Make run directories for a bunch of different energies"""
+def run_dir_name(energy):
+    """
+    Path of the run directory for a kernel energy
+
+    energy:
+        float, kernel energy of the state of interest
+    """
+    e_str = "{:05f}".format(energy).replace(".", "_").replace("-", "neg_")
+    return realpath(join(this_dir, "E_"+e_str))
+
+
+def find_output_file(run_dir, prefix):
+    """
+    Find an NCSMC output file in a run directory,
+    before or after renaming by rename_post_ncsmc.py
+
+    run_dir:
+        string, directory NCSMC ran in
+
+    prefix:
+        string, start of the file name, e.g. "eigenphase_shift"
+
+    returns:
+        string, path to the file, or None if there isn't one
+    """
+    paths = [path for path in sorted(glob.glob(join(run_dir, prefix + "*")))
+             if not path.endswith(("_flipped", "_simplified"))]
+    return paths[0] if paths else None
+
+
+def measure_run(run_dir):
+    """
+    Find where the state of interest (J, parity, T) ended up in an NCSMC run,
+    without any human input.
+
+    If there's a bound state in that channel in the .out file, we take the
+    lowest one. Otherwise we flip the eigenphase shifts, take the column of
+    that channel that changes the most, and fit its resonance with
+    ``fitter.fit_resonance``. Nothing is written next to the run's files.
+
+    run_dir:
+        string, directory NCSMC ran in
+
+    returns:
+        dict with keys kind ("bound" or "resonance"), E (MeV, relative
+        to threshold), width (MeV, 0 for bound states), or None if the run
+        has no output, or the state is neither bound nor resonant
+    """
+    out_path = find_output_file(run_dir, "ncsm_rgm_Am2_1_1.out")
+    if out_path is None:
+        return None
+    # read, not simplify / flip, so nothing is written next to the data
+    with utils.open_text(out_path) as out_file:
+        _, _, _, energies, titles = output_simplifier.read_bound_states(
+            out_file.readlines())
+    sign = "+" if parity == 1 else "-"
+    state = utils.ChannelKey(J2, sign, round(2 * T))
+    bound = [E for E, title in zip(energies, titles)
+             if utils.ChannelKey.from_state(title) is state]
+    if bound:
+        return {"kind": "bound", "E": min(bound), "width": 0.0}
+
+    agr_path = find_output_file(run_dir, "eigenphase_shift")
+    if agr_path is None:
+        return None
+    channels, channel_energies = flipper.flipped_channels(agr_path)
+    best, best_change = None, 0
+    for key, phases in channels.items():
+        change = max(phases) - min(phases)
+        if key.with_column(None) is state and change > best_change:
+            best, best_change = phases, change
+    # same cut as resonance_info for a "possible" resonance
+    if best is None or best_change < 60:
+        return None
+    x = np.array(flipper.channel_energies(channel_energies, best))
+    width, res_energy = fitter.fit_resonance(x, np.array(best))
+    return {"kind": "resonance", "E": float(res_energy),
+            "width": float(width)}
+
+
+def kernel_energy(run_dir):
+    """
+    Kernel energy a run directory was made with, from its run_info.json,
+    or from its name (e.g. E_neg_33_463000 --> -33.463) for older runs.
+
+    run_dir:
+        string, path to a run directory
+    """
+    info_path = join(run_dir, "run_info.json")
+    if exists(info_path):
+        with open(info_path, "r") as info_file:
+            return json.load(info_file)["kernel_E"]
+    e_str = split(realpath(run_dir))[-1][len("E_"):]
+    return float(e_str.replace("neg_", "-").replace("_", "."))
+
+
+def find_run_dirs(directory=None):
+    """
+    All run directories (E_<energy>) in a directory, by kernel energy
+
+    directory:
+        string, where to look (default: the one containing this file)
+    """
+    if directory is None:
+        directory = this_dir
+    run_dirs = [path for path in glob.glob(join(directory, "E_*"))
+                if os.path.isdir(path)]
+    return sorted(run_dirs, key=kernel_energy)
+
+
+def harvest_run(run_dir):
+    """
+    Measure one run, see ``harvest``.
+
+    run_dir:
+        string, path to a run directory
+
+    returns:
+        dict with keys run_dir, kernel_E, kind, E, width.
+        kind is "bound", "resonance", "none" (neither) or "no output"
+        (e.g. NCSMC is still running, or failed).
+    """
+    row = {"run_dir": run_dir, "kernel_E": kernel_energy(run_dir),
+           "kind": "no output", "E": None, "width": None}
+    if find_output_file(run_dir, "ncsm_rgm_Am2_1_1.out") is None:
+        return row
+    result = measure_run(run_dir)
+    if result is None:
+        row["kind"] = "none"
+    else:
+        row.update(result)
+    return row
+
+
+def harvest(directory=None, processes=n_processes):
+    """
+    Collect the results of a scan: for every run directory, flip its
+    eigenphases, get bound states from its .out file, and find the state of
+    interest (see ``measure_run``), all in parallel. Then save one table of
+    kernel energy vs. state energy and width, as ``harvest_file``.
+
+    directory:
+        string, where the run directories are (default: next to this file)
+
+    processes:
+        int or None, number of processes (None = one per core)
+
+    returns:
+        list of dicts, one per run, see ``harvest_run``
+    """
+    if directory is None:
+        directory = this_dir
+    run_dirs = find_run_dirs(directory)
+    if not run_dirs:
+        print("no run directories (E_*) found in", directory)
+        return []
+    if processes == 1 or len(run_dirs) == 1:
+        rows = [harvest_run(run_dir) for run_dir in run_dirs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            rows = list(pool.map(harvest_run, run_dirs))
+
+    table_path = join(directory, harvest_file)
+    with open(table_path, "w") as table:
+        table.write("kernel_E,kind,E,width,run_dir\n")
+        for row in rows:
+            table.write("{},{},{},{},{}\n".format(
+                row["kernel_E"], row["kind"],
+                "" if row["E"] is None else row["E"],
+                "" if row["width"] is None else row["width"],
+                row["run_dir"]))
+
+    print("{:>14} {:>10} {:>10} {:>10}".format(
+        "kernel E", "kind", "E", "width"))
+    for row in rows:
+        print("{:>14.6f} {:>10} {:>10} {:>10}".format(
+            row["kernel_E"], row["kind"],
+            "" if row["E"] is None else "{:.4f}".format(row["E"]),
+            "" if row["width"] is None else "{:.4f}".format(row["width"])))
+    print("Saved table of", len(rows), "runs to", table_path)
+    return rows
+
+
+def get_executor(backend=backend):
+    """
+    Make an executor (see executor.py) for running NCSMC,
+    which tracks jobs in ``ledger_file``.
+
+    backend:
+        string, "qsub", "sbatch" or "local"
+    """
+    ledger_path = join(this_dir, ledger_file)
+    if backend == "local":
+        return executor.get_executor(backend, ledger_path,
+                                     max_jobs=max_local_jobs,
+                                     command=local_command)
+    return executor.get_executor(backend, ledger_path)
+
+
+def adjust_energy(n_points, backend=backend):
+    """
+    Make run directories for a bunch of different energies,
+    and submit them all as one array of jobs.
+
+    n_points:
+        int, number of energies to try
+
+    backend:
+        string, how to run NCSMC, "qsub", "sbatch" or "local"
+
+    returns:
+        list of strings, job IDs
+    """
     # get value of lowest energy of the state we want
     # (as well as its line number)
     ck_file = coupling_kernels_files[0]
-    current_energy, line_num = get_current_state_energy(ck_file)
+    current_energy, _ = get_current_state_energy(ck_file)
 
     # get ground state energy from .out file
     ground_state_E = get_ground_state_energy(dot_out_file)
@@ -196,12 +674,152 @@ def adjust_energy(n_points):
         test_energies = np.linspace(
             current_energy, experiment_energy, n_points)
 
+    batches = []
     for test_energy in test_energies:
         print("running NCSMC for E =", test_energy, "MeV")
         # make a directory with all required input files for NCSMC
-        batch = make_run_dir(test_energy, current_energy, line_num)
-        # run batch script
-        os.system("qsub "+batch)
+        batches.append(make_run_dir(test_energy))
+
+    # then submit them all at once
+    jobs = get_executor(backend)
+    job_ids = jobs.submit_array(batches)
+    print("submitted", len(job_ids), "jobs with", backend)
+    if wait_for_jobs or backend == "local":
+        jobs.wait(job_ids, interval=1 if backend == "local" else None)
+        print(jobs.status())
+    return job_ids
+
+
+def run_and_measure(energy, jobs):
+    """
+    Run NCSMC for one kernel energy and wait for it, then find the state.
+    A finished run already in the run directory is reused.
+
+    energy:
+        float, kernel energy of the state of interest
+
+    jobs:
+        Executor object, see ``get_executor``
+
+    returns:
+        dict, see ``measure_run``
+    """
+    run_dir = run_dir_name(energy)
+    result = measure_run(run_dir) if exists(run_dir) else None
+    if result is not None:
+        print("using finished run in", run_dir)
+        return result
+    print("running NCSMC for E =", energy, "MeV")
+    job_ids = jobs.submit_array([make_run_dir(energy)])
+    jobs.wait(job_ids, interval=1 if jobs.name == "local" else None)
+    result = measure_run(run_dir)
+    if result is None:
+        raise ValueError("couldn't find the J, parity, T state in the output "
+                         "in {}, did NCSMC fail?".format(run_dir))
+    return result
+
+
+def search_energy(backend=backend):
+    """
+    Find the kernel energy that puts the state of interest at the TUNL
+    energy, with as few NCSMC runs as possible.
+
+    We treat (state energy from NCSMC) - (TUNL energy) as a function of
+    the kernel energy and find its zero: a secant step from the last two
+    runs, or bisection once we have runs on both sides of the target and
+    the secant step would leave that bracket. The first step uses
+    ``initial_slope``. We stop within ``search_tolerance``, or after
+    ``max_search_runs`` runs.
+
+    Runs happen one at a time, since each one depends on the last.
+    Every run is logged to search_log.json.
+
+    backend:
+        string, how to run NCSMC, "qsub", "sbatch" or "local"
+
+    returns:
+        float, best kernel energy found
+    """
+    target = tunl_E + tunl_ground_E
+    jobs = get_executor(backend)
+    log_path = join(this_dir, "search_log.json")
+    points = []  # list of [kernel energy, state energy - target, result]
+
+    def add_point(energy, result):
+        points.append([energy, result["E"] - target, result])
+        print("kernel E = {:.6f} MeV --> {} at {:.4f} MeV, off by {:.4f} "
+              "MeV".format(energy, result["kind"], result["E"],
+                           points[-1][1]))
+        with open(log_path, "w") as log_file:
+            json.dump({"target": target, "runs": [
+                dict(result, kernel_E=energy) for energy, _, result in points]},
+                log_file, indent=1)
+
+    # start from the original run, if its output is there
+    current_energy, _ = get_current_state_energy(coupling_kernels_files[0])
+    result = measure_run(realpath(join(this_dir, ncsmc_output_dir)))
+    if result is None:
+        result = run_and_measure(current_energy, jobs)
+    add_point(current_energy, result)
+
+    while abs(points[-1][1]) > search_tolerance:
+        if len(points) >= max_search_runs:
+            print("no luck after", len(points), "runs, giving up")
+            break
+        energy, misfit = points[-1][:2]
+        if len(points) == 1:
+            slope = initial_slope
+        else:
+            last_energy, last_misfit = points[-2][:2]
+            slope = (misfit - last_misfit) / (energy - last_energy)
+        # the closest runs on either side of the target, if any
+        below = [p for p in points if p[1] < 0]
+        above = [p for p in points if p[1] > 0]
+        if below and above:
+            low = min(below, key=lambda p: -p[1])[0]
+            high = min(above, key=lambda p: p[1])[0]
+            left, right = sorted([low, high])
+        else:
+            left, right = None, None
+        next_energy = None
+        if slope != 0:
+            next_energy = energy - misfit / slope
+        if left is not None and (next_energy is None
+                                 or not left < next_energy < right):
+            print("secant step left the bracket, bisecting")
+            next_energy = (left + right) / 2
+        if next_energy is None:
+            raise ValueError("state didn't move between the last two runs, "
+                             "can't pick the next kernel energy")
+        add_point(next_energy, run_and_measure(next_energy, jobs))
+
+    best = min(points, key=lambda p: abs(p[1]))
+    print("best kernel energy: {:.6f} MeV (off by {:.4f} MeV after {} runs)"
+          .format(best[0], best[1], len(points)))
+    print("log of all runs saved to", log_path)
+    return best[0]
+
 
 if __name__ == "__main__":
-    adjust_energy(n_adjustments)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Phenomenological adjustment")
+    parser.add_argument("-b", "--backend", type=str, default=backend,
+                        help="how to run NCSMC: qsub, sbatch or local")
+    parser.add_argument("-s", "--status", action="store_true",
+                        help="just print the state of submitted runs")
+    parser.add_argument("--harvest", action="store_true",
+                        help="collect results from all run directories "
+                        "into one table")
+    parser.add_argument("--search", action="store_true",
+                        help="search for the kernel energy that matches "
+                        "experiment, one run at a time")
+    args = parser.parse_args()
+    if args.harvest:
+        harvest()
+    elif args.search:
+        search_energy(args.backend)
+    elif args.status:
+        jobs = get_executor(args.backend)
+        jobs.poll()
+        print(jobs.status())
+    else:
+        adjust_energy(n_adjustments, args.backend)
\ No newline at end of file
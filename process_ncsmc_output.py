@@ -8,9 +8,19 @@ feed it the NCSMC output, and it gives you a bunch of useful stuff:
 """
 
 import os
-
-# what resolution to use for final spaghetti + scheme plot images
-high_res_dpi = 900
+import argparse
+import json
+import time
+try:
+    import tomllib  # python 3.11+
+except ImportError:
+    tomllib = None
+
+# "preview" = quick, low resolution images while you pick channels and fit,
+# "final" = high resolution interesting-channel + scheme plots for papers.
+# (resolutions are in utils.render_tiers). You can also pick the tier with
+# python process_ncsmc_output.py --tier final
+render_tier = "preview"
 
 Nmax_list = [7]
 # files in the same order as Nmax_list:
@@ -58,32 +68,44 @@ The program just looks for the THRESH line, and all lines with commas.
 Use question marks for values that are not known experimentally.
 """
 
-# stop editing here unless you want to change program behaviour
+# put error bars on resonance energies / widths in the level scheme?
+# "bootstrap" or "jackknife" (see fitter.bootstrap_resonance), or None
+uncertainty_method = None
+n_bootstrap = 1000  # number of resamples per channel, for "bootstrap"
 
-# write config file
-conf_file = os.path.join(os.path.dirname(__file__), "config.txt")
-if put_output_in_file_dir:
-    with open(conf_file, "w") as conf:
-        conf.write(file_dir)
+# draw lines joining the same state at different Nmax in the level scheme?
+# (matched by tracker.py, which also saves tracks.csv next to the scheme)
+connect_levels = False
+
+# how many steps (plotting, flipping, simplifying, ...) to run at once.
+# None = one per core, 1 = one by one
+n_processes = None
+
+# stop editing here unless you want to change program behaviour
 
 # import a bunch of stuff
-# I know it's not normal to import here but these files need the config file
-# or they'll default to the old storage location
+import build_graph
 import flipper
 import output_simplifier
+import profiler
 import resonance_plotter
 import fitter
 import scheme_plot
+import tracker
 import utils
 
-# remove config file
-if os.path.exists(conf_file):
-    os.remove(conf_file)
+# tell the other modules where output goes
+# (otherwise they use config.txt or the dir with python files)
+if put_output_in_file_dir:
+    utils.directory = file_dir
+    utils.output_dir = os.path.join(file_dir, "resonances_Nmax_{}")
 
 overall_energies = []
 overall_widths = []
 overall_channels = []
 overall_titles = []
+overall_energy_cis = []
+overall_width_cis = []
 
 eigen_help_str = """
 First, take a look at the PNGs_phase files, to figure out which
@@ -91,6 +113,9 @@ channels are interesting
 
 (just look at the graph, if you see a swoop up, it's interesting)
 
+(if resonance_plotter.channel_output is "pdf" or "sheet", all channels are
+in one file in PNGs_eigenphase instead, each labeled with its csv line)
+
 Then, figure out which columns in the eigenphase file those match with.
 (they should have the same J, pi, T, but may have a different column #)
 
@@ -145,22 +170,67 @@ something like this:
 """
 
 
-def select_interesting_channels(Nmax):
+def auto_channels(res_file_name, res_types):
+    """
+    Pick interesting channels without a human, using the classification
+    in a resonance info file (see ``resonance_info.get_resonance_info``)
+
+    res_file_name:
+        string, path to resonances_[eigen]phase_Nmax_[#].csv
+
+    res_types:
+        list of strings, which resonance types to keep, e.g. ["strong"]
+
+    returns:
+        string, the chosen lines of the file, one channel per line
+    """
+    with open(res_file_name, "r") as res_file:
+        lines = res_file.read().splitlines()[1:]  # first line is a header
+    chosen = [line for line in lines
+              if line and line.split(",")[-1] in res_types]
+    return "".join(line + "\n" for line in chosen)
+
+
+def select_interesting_channels(Nmax, output_dir=None, channels=None,
+                                phase_channels=None, res_types=None):
     """
     Get interesting channels (i.e. those channels which contain resonances)
     by using human inputs in files.
 
+    For batch jobs, channels can be given instead (or picked automatically
+    with res_types), so nobody has to edit the files.
+
     Nmax:
         float
+
+    output_dir:
+        string, directory with all output, see ``utils.nmax_dir``
+
+    channels, phase_channels:
+        strings, lines to write to interesting.txt / interesting_phase.txt,
+        in the same format as a human would. None = don't write anything.
+
+    res_types:
+        list of strings, e.g. ["strong"]. If given, and there are no
+        channels in a file yet, pick channels of these resonance types
+        with ``auto_channels`` instead of asking.
     """
-    eigenphase_interesting_file = os.path.join(
-        utils.output_dir.format(Nmax), "interesting.txt")
+    nmax_dir = utils.nmax_dir(Nmax, output_dir)
+    eigenphase_interesting_file = os.path.join(nmax_dir, "interesting.txt")
+    if channels is not None:
+        with open(eigenphase_interesting_file, "w") as eigen_ch_file:
+            eigen_ch_file.write(channels)
     eigen_exists = os.path.exists(eigenphase_interesting_file)
     eigen_blank = (True if not eigen_exists
                    else os.path.getsize(eigenphase_interesting_file) == 0)
     eigen_must_write = (not eigen_exists) or eigen_blank
 
-    if eigen_must_write:
+    if eigen_must_write and res_types is not None:
+        res_file_name = os.path.join(
+            nmax_dir, "resonances_eigenphase_Nmax_{}.csv".format(Nmax))
+        with open(eigenphase_interesting_file, "w") as eigen_ch_file:
+            eigen_ch_file.write(auto_channels(res_file_name, res_types))
+    elif eigen_must_write:
         # here you have to look at the resonance images,
         # and figure out which ones are interesting.
 
@@ -181,18 +251,26 @@ def select_interesting_channels(Nmax):
 
     # differently formatted version for use as titles
     eigen_channel_titles = [
-        "_".join(line.split(",")[:-1])
-        for line in eigen_channels_str.splitlines()]
+        utils.ChannelKey.from_csv_row(line).short_title
+        for line in eigen_channels_str.splitlines() if line != ""]
 
     if make_phase_plots_too:
         phase_interesting_file = os.path.join(
-            utils.output_dir.format(Nmax), "interesting_phase.txt")
+            nmax_dir, "interesting_phase.txt")
+        if phase_channels is not None:
+            with open(phase_interesting_file, "w") as phase_ch_file:
+                phase_ch_file.write(phase_channels)
         phase_exists = os.path.exists(phase_interesting_file)
         phase_blank = (True if not phase_exists
                        else os.path.getsize(phase_interesting_file) == 0)
         phase_must_write = (not phase_exists) or phase_blank
 
-        if phase_must_write:
+        if phase_must_write and res_types is not None:
+            res_file_name = os.path.join(
+                nmax_dir, "resonances_phase_Nmax_{}.csv".format(Nmax))
+            with open(phase_interesting_file, "w") as phase_ch_file:
+                phase_ch_file.write(auto_channels(res_file_name, res_types))
+        elif phase_must_write:
             print("Enter all interesting channels in", phase_interesting_file)
             print(phase_help_str)
             open(phase_interesting_file, "a+").close()
@@ -210,12 +288,12 @@ def select_interesting_channels(Nmax):
 
 def add_resonances(Nmax,
                    eigenphase_flipped, eigen_channels_str,
-                   eigen_channel_titles,
                    phase_flipped, phase_channels_str,
-                   bound_energies, bound_titles):
+                   bound_energies, bound_titles, output_dir=None,
+                   windows=None):
     """
-    Use eigenphase file to add details about resonances (widths, energies, ...)
-    to the overall lists of data to be plotted.
+    Use eigenphase file to get details about resonances (widths, energies, ...)
+    for one Nmax, to be added to the overall lists of data to be plotted.
 
     Also takes phase data for plotting purposes if needed
 
@@ -229,9 +307,6 @@ def add_resonances(Nmax,
         string, the contents of the csv file with the details
         of interesting resonances (width, energy, state)
 
-    eigen_channel_titles:
-        list of strings, again representing channels but formatted nicely
-
     phase_flipped, phase_channels_str:
         Same idea as all the eigen ones but for phase.
         Last one may be None.
@@ -241,33 +316,63 @@ def add_resonances(Nmax,
 
     bound_titles:
         list of strings, titles of bound states
+
+    output_dir:
+        string, directory with all output, see ``utils.nmax_dir``
+
+    windows:
+        None to fit resonances by hand with the GUI. For batch jobs,
+        a dict instead, key = channel title (e.g. 3_-_3_1),
+        value = (left, right) fit window. Channels that aren't in the dict
+        get a window from ``fitter.auto_window``.
+
+    returns:
+        tuple of (energies, widths, channel titles, plot title,
+        energy confidence intervals, width confidence intervals)
+        for this Nmax
     """
 
     # plot interesting resonances / spaghetti plot, in high-res
     eigenphase_csvs = resonance_plotter.plot(
         eigenphase_flipped, flipped=True, Nmax=Nmax,
-        channels=eigen_channels_str, dpi=high_res_dpi)
+        channels=eigen_channels_str, dpi=utils.tier_dpi(render_tier),
+        output_dir=output_dir)
+
+    # titles from the csvs themselves, since they're in eigenphase file
+    # order, which needn't be the order of interesting.txt
+    csv_titles = [utils.ChannelKey.from_filename(csv).short_title
+                  for csv in eigenphase_csvs]
 
     # save channel info if needed
-    eigenphase_info_path = os.path.join(
-        utils.output_dir.format(Nmax), "eigenphase_info.csv")
+    nmax_dir = utils.nmax_dir(Nmax, output_dir)
+    eigenphase_info_path = os.path.join(nmax_dir, "eigenphase_info.csv")
+    eigenphase_windows_path = os.path.join(nmax_dir, "eigenphase_windows.csv")
     if not os.path.exists(eigenphase_info_path):
         # find the energy of each resonance
         # (i.e. point of highest slope within the "upward swoop")
         eigenphase_widths = []
         eigenphase_energies = []
-        for csv in eigenphase_csvs:
-            width, energy = fitter.find_resonance(csv)
+        eigenphase_windows = []
+        for csv, title in zip(eigenphase_csvs, csv_titles):
+            if windows is None:
+                width, energy = fitter.find_resonance(csv)
+            else:
+                width, energy = fitter.find_resonance(
+                    csv, interactive=False, window=windows.get(title))
             eigenphase_widths.append(width)
             eigenphase_energies.append(energy)
+            eigenphase_windows.append(fitter.fit_window)
         # save that information in files for easy access later
-        fitter.save_info(eigenphase_info_path, eigen_channel_titles,
+        fitter.save_info(eigenphase_info_path, csv_titles,
                          eigenphase_widths, eigenphase_energies)
+        fitter.save_windows(eigenphase_windows_path, csv_titles,
+                            eigenphase_windows)
 
     if make_phase_plots_too:
         resonance_plotter.plot(
             phase_flipped, flipped=True, Nmax=Nmax,
-            channels=phase_channels_str, dpi=high_res_dpi)
+            channels=phase_channels_str, dpi=utils.tier_dpi(render_tier),
+            output_dir=output_dir)
         # we don't need widths and energies for phase plots
 
     # grab energy / width of resonances from file
@@ -288,51 +393,365 @@ def add_resonances(Nmax,
     this_nmax_channels = eigenphase_titles + bound_titles
     this_nmax_title = "${}\\hbar\\Omega$".format(Nmax)
 
-    overall_energies.append(this_nmax_energies)
-    overall_widths.append(this_nmax_widths)
-    overall_channels.append(this_nmax_channels)
-    overall_titles.append(this_nmax_title)
+    # confidence intervals, if we want them (bound states don't get any)
+    this_nmax_energy_cis = [None] * len(this_nmax_energies)
+    this_nmax_width_cis = [None] * len(this_nmax_energies)
+    if uncertainty_method is not None:
+        uncertainties = get_uncertainties(
+            Nmax, eigenphase_csvs, csv_titles,
+            eigenphase_windows_path, output_dir)
+        for i, title in enumerate(eigenphase_titles):
+            if title in uncertainties:
+                width_ci, energy_ci = uncertainties[title]
+                this_nmax_width_cis[i] = width_ci
+                this_nmax_energy_cis[i] = energy_ci
+
+    return (this_nmax_energies, this_nmax_widths, this_nmax_channels,
+            this_nmax_title, this_nmax_energy_cis, this_nmax_width_cis)
+
+
+def get_uncertainties(Nmax, eigenphase_csvs, eigen_channel_titles,
+                      eigenphase_windows_path, output_dir=None):
+    """
+    Get confidence intervals on resonance energies / widths for one Nmax,
+    resampling around the saved fit windows on a process pool.
+    Results are saved, so this only happens once.
+
+    Nmax:
+        float
+
+    eigenphase_csvs:
+        list of strings, paths to csv files of interesting channels
+
+    eigen_channel_titles:
+        list of strings, titles of those channels, in the same order
+
+    eigenphase_windows_path:
+        string, path to the fit windows saved by ``fitter.save_windows``.
+        Channels without a saved window (or all of them, if the file
+        doesn't exist) get one from ``fitter.auto_window``.
+
+    output_dir:
+        string, directory with all output, see ``utils.nmax_dir``
+
+    returns:
+        dict, key = title, value = (width_ci, energy_ci)
+    """
+    uncertainty_path = os.path.join(
+        utils.nmax_dir(Nmax, output_dir),
+        "eigenphase_uncertainties_{}.csv".format(uncertainty_method))
+    if not os.path.exists(uncertainty_path):
+        print("Estimating uncertainties ({})...".format(uncertainty_method))
+        saved_windows = {}
+        if os.path.exists(eigenphase_windows_path):
+            saved_windows = dict(zip(
+                *fitter.read_windows(eigenphase_windows_path)))
+        # look windows up by title, in case the channels have changed
+        windows = []
+        for csv_path, title in zip(eigenphase_csvs, eigen_channel_titles):
+            window = saved_windows.get(title)
+            if window is None:
+                print("No fit window saved for", title,
+                      "so resampling around an automatic window instead")
+                window = fitter.auto_window(*fitter.read_csv(csv_path))
+            windows.append(window)
+        results = fitter.bootstrap_channels(
+            eigenphase_csvs, windows, method=uncertainty_method,
+            n_samples=n_bootstrap)
+        fitter.save_uncertainties(
+            uncertainty_path, eigen_channel_titles, results)
+    return fitter.read_uncertainties(uncertainty_path)
+
+
+def _init_nmax_worker(output_dir, tier, profile=False, trace_memory=False,
+                      settings=None):
+    """
+    Set up a worker process for the pipeline stages.
 
+    Workers get the output directory (and render tier, and whether we're
+    profiling) from the main process. In batch mode fits run in workers
+    too, so settings (a dict, e.g. uncertainty_method) from the batch
+    config come along as well.
+    """
+    global render_tier
+    utils.output_dir = output_dir
+    render_tier = tier
+    globals().update(settings or {})
+    if profile:
+        # start from scratch, not with records copied from the main process
+        profiler.reset()
+        profiler.enable(trace_memory)
+
+
+def plot_file(filename, Nmax, suffix="", processes=None, output_dir=None):
+    """
+    Plot every channel in an (already flipped, or deliberately unflipped)
+    phase shift file, with ``resonance_plotter.plot``.
+
+    filename:
+        string, path to phase / eigenphase shift file
+
+    Nmax:
+        float
+
+    suffix:
+        string, added to the end of the main plot filenames
 
-def add_nmax_data(Nmax_list):
+    processes:
+        int or None, number of processes for rendering channel plots
+
+    output_dir:
+        string, directory with all output, see ``utils.nmax_dir``
     """
-    Add data to be plotted on the level scheme for each Nmax in Nmax_list
+    resonance_plotter.plot(
+        filename, flipped=True, Nmax=Nmax, suffix=suffix, processes=processes,
+        output_dir=output_dir)
+
+
+def fit_resonances(Nmax, eigenphase_flipped, phase_flipped, bound_states,
+                   output_dir=None, windows=None):
+    """
+    Get resonances for one Nmax: read the interesting channels,
+    then fit (or read saved fits) with ``add_resonances``.
+
+    Nmax:
+        float
+
+    eigenphase_flipped, phase_flipped:
+        strings, paths to flipped eigenphase / phase files
+
+    bound_states:
+        [energies, titles] of bound states, from ``output_simplifier``
+
+    output_dir:
+        string, directory with all output, see ``utils.nmax_dir``
+
+    windows:
+        None to fit by hand, or a dict of fit windows, see ``add_resonances``
+
+    returns:
+        same as ``add_resonances``
+    """
+    nmax_dir = utils.nmax_dir(Nmax, output_dir)
+    info_path = os.path.join(nmax_dir, "eigenphase_info.csv")
+    if windows is not None and os.path.exists(info_path):
+        # automatic fits are quick, so just redo them in case windows changed
+        os.remove(info_path)
+    if not os.path.exists(info_path):
+        # new fits, so old uncertainties don't apply any more
+        for filename in os.listdir(nmax_dir):
+            if filename.startswith("eigenphase_uncertainties_"):
+                os.remove(os.path.join(nmax_dir, filename))
+    e_ch_str, _, p_ch_str = select_interesting_channels(
+        Nmax, output_dir)
+    bound_energies, bound_titles = bound_states
+    return add_resonances(Nmax, eigenphase_flipped, e_ch_str,
+                          phase_flipped, p_ch_str,
+                          bound_energies, bound_titles,
+                          output_dir=output_dir, windows=windows)
+
+
+def make_level_scheme(save_dir, Nmax_list, eigenphase_flipped_list,
+                      *nmax_results):
+    """
+    Combine results for each Nmax with experimental data,
+    and plot the level scheme.
+
+    save_dir:
+        string, directory to save the level scheme in
 
     Nmax_list:
-        list of floats
+        list of floats, Nmax values in order
+
+    eigenphase_flipped_list:
+        list of paths to flipped eigenphase files, one per Nmax,
+        for matching states across Nmax (if ``connect_levels``)
+
+    nmax_results:
+        results of ``fit_resonances`` for each Nmax, in order
     """
-    for i, Nmax in enumerate(Nmax_list):
-        print("working on Nmax =", Nmax)
-        # get ncsmc, .out output files
-        ps = phase_shift_list[i]
-        es = eigenphase_shift_list[i]
-        dot_out = ncsmc_dot_out_list[i]
+    n_before = len(overall_energies)
+    for energies, widths, channels, title, energy_cis, width_cis in \
+            nmax_results:
+        overall_energies.append(energies)
+        overall_widths.append(widths)
+        # bound states are J_parity_T, resonances 2J_parity_2T_column
+        overall_channels.append([
+            utils.ChannelKey.from_state(c) if c.count("_") == 2
+            else utils.ChannelKey.from_title(c) for c in channels])
+        overall_titles.append(title)
+        overall_energy_cis.append(energy_cis)
+        overall_width_cis.append(width_cis)
+    get_experimental()
 
-        # make unflipped plots, flipped=True prevents flipping
-        resonance_plotter.plot(
-            ps, flipped=True, Nmax=Nmax, suffix='_unflipped')
-        resonance_plotter.plot(
-            es, flipped=True, Nmax=Nmax, suffix='_unflipped')
+    tracks = None
+    if connect_levels:
+        levels_list = [
+            tracker.scheme_levels(energies, widths, channels, flipped)
+            for energies, widths, channels, flipped in zip(
+                overall_energies[n_before:], overall_widths[n_before:],
+                overall_channels[n_before:], eigenphase_flipped_list)]
+        all_tracks = tracker.track(Nmax_list, levels_list)
+        tracker.print_tracks(all_tracks)
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+        tracker.save_tracks(all_tracks, os.path.join(save_dir, "tracks.csv"))
+        # Nmax plots come after any that were there already
+        tracks = [[(n_before + i, E) for i, E in line]
+                  for line in tracker.connectors(all_tracks, Nmax_list)]
+
+    scheme_plot.plot_multi_levels(
+        overall_energies,
+        overall_widths,
+        overall_channels,
+        overall_titles,
+        energy_ci_list=overall_energy_cis,
+        width_ci_list=overall_width_cis,
+        save_dpi=utils.tier_dpi(render_tier),
+        save_dir=save_dir, tracks=tracks)
 
-        # flip phase files
-        ps = flipper.flip(ps, verbose=False)
-        es = flipper.flip(es, verbose=False)
 
-        # make flipped plots
-        resonance_plotter.plot(ps, flipped=True, Nmax=Nmax)
-        resonance_plotter.plot(es, flipped=True, Nmax=Nmax)
+def build_pipeline(Nmax_list, n_processes=n_processes, output_dir=None,
+                   batch=None):
+    """
+    Set up all the steps, from NCSMC output files to level scheme,
+    as a ``build_graph.BuildGraph``, so only out-of-date steps are redone.
+
+    For each Nmax: plot unflipped files, flip, plot flipped files,
+    get bound states, select interesting channels, and fit resonances.
+    Then one level scheme for everything.
+
+    e.g. if one Nmax's eigenphase file changes, only its flip, plots,
+    fits, and the level scheme are redone.
+
+    Nmax_list:
+        list of floats
 
-        # get bound state info
-        bound_energies, bound_titles = output_simplifier.simplify(dot_out)
+    n_processes:
+        int or None, how many stages to run at once
+        (None = one per core, 1 = one by one)
 
-        # select interesting channels, i.e. those with resonances
-        # eigen_channels_string, eigen_channels_titles, phase_channels_string
-        # just shortened so the line wasn't weirdly long
-        e_ch_str, e_ch_titles, p_ch_str = select_interesting_channels(Nmax)
-        # stick those channels in the overall plot
-        add_resonances(Nmax, es, e_ch_str, e_ch_titles,
-                       ps, p_ch_str,
-                       bound_energies, bound_titles)
+    output_dir:
+        string, directory to put all output in, or None to use
+        ``utils.output_dir`` (see ``utils.nmax_dir``)
+
+    batch:
+        None to have a human pick channels and fit resonances.
+        For batch jobs, a dict from ``read_config`` instead, with keys
+        channels, phase_channels, res_types and windows.
+    """
+    if output_dir is None:
+        base_dir = os.path.dirname(utils.output_dir)
+        save_dir = os.path.abspath("level_schemes")
+    else:
+        base_dir = output_dir
+        save_dir = os.path.join(output_dir, "level_schemes")
+    graph = build_graph.BuildGraph(
+        os.path.join(base_dir, ".build_state.json"))
+
+    n_cores = os.cpu_count() or 1
+    n_parallel = min(n_processes or n_cores, 2 * len(Nmax_list))
+    # share the cores between stages when rendering plots
+    render_processes = (resonance_plotter.processes if n_parallel <= 1
+                        else max(1, n_cores // n_parallel))
+    render_params = {"tier": render_tier,
+                     "version": resonance_plotter.render_version,
+                     "output": resonance_plotter.channel_output,
+                     "max_points": resonance_plotter.max_spaghetti_points}
+
+    fit_stages = []
+    eigenphase_flipped_list = []
+    for i, Nmax in enumerate(Nmax_list):
+        nmax_dir = utils.nmax_dir(Nmax, output_dir)
+        # made here so stages running at once don't race to make it
+        if not os.path.exists(nmax_dir):
+            os.makedirs(nmax_dir)
+
+        flipped = {}
+        for phase_word, path in [("phase", phase_shift_list[i]),
+                                 ("eigenphase", eigenphase_shift_list[i])]:
+            path = utils.abs_path(path)
+            flipped[phase_word] = path + "_flipped"
+            graph.add(build_graph.Stage(
+                "plot_unflipped_{}_{}".format(phase_word, Nmax), plot_file,
+                args=(path, Nmax, "_unflipped", render_processes, output_dir),
+                inputs=[path], params=render_params,
+                outputs=[resonance_plotter.main_plot_path(
+                    path, Nmax, suffix="_unflipped", output_dir=output_dir)]))
+            graph.add(build_graph.Stage(
+                "flip_{}_{}".format(phase_word, Nmax), flipper.flip,
+                args=(path, False),
+                inputs=[path], outputs=[flipped[phase_word]]))
+            graph.add(build_graph.Stage(
+                "plot_{}_{}".format(phase_word, Nmax), plot_file,
+                args=(flipped[phase_word], Nmax, "", render_processes,
+                      output_dir),
+                inputs=[flipped[phase_word]], params=render_params,
+                deps=["flip_{}_{}".format(phase_word, Nmax)],
+                outputs=[resonance_plotter.main_plot_path(
+                    flipped[phase_word], Nmax, output_dir=output_dir)]))
+
+        eigenphase_flipped_list.append(flipped["eigenphase"])
+
+        dot_out = utils.abs_path(ncsmc_dot_out_list[i])
+        graph.add(build_graph.Stage(
+            "bound_states_{}".format(Nmax), output_simplifier.simplify,
+            args=(dot_out,),
+            inputs=[dot_out], outputs=[dot_out + "_simplified"]))
+
+        # a human picks channels after looking at the plots,
+        # or in batch mode they come from the config file / are automatic
+        interesting = [os.path.join(nmax_dir, "interesting.txt")]
+        if make_phase_plots_too:
+            interesting.append(
+                os.path.join(nmax_dir, "interesting_phase.txt"))
+        if batch is None:
+            channel_args = (Nmax,)
+            windows = None
+        else:
+            channel_args = (Nmax, output_dir,
+                            batch["channels"].get(str(Nmax)),
+                            batch["phase_channels"].get(str(Nmax)),
+                            batch["res_types"])
+            windows = batch["windows"].get(str(Nmax), {})
+        graph.add(build_graph.Stage(
+            "channels_{}".format(Nmax), select_interesting_channels,
+            args=channel_args, outputs=interesting, params={
+                "args": channel_args[1:]}, interactive=batch is None,
+            deps=["plot_phase_{}".format(Nmax),
+                  "plot_eigenphase_{}".format(Nmax)]))
+
+        # fits are redone (and old ones removed) if the data
+        # or the chosen channels change
+        fit_inputs = [flipped["eigenphase"]] + interesting
+        if make_phase_plots_too:
+            fit_inputs.append(flipped["phase"])
+        fit_stages.append("fit_{}".format(Nmax))
+        graph.add(build_graph.Stage(
+            fit_stages[-1], fit_resonances,
+            args=(Nmax, flipped["eigenphase"], flipped["phase"],
+                  build_graph.Result("bound_states_{}".format(Nmax)),
+                  output_dir, windows),
+            inputs=fit_inputs,
+            outputs=[os.path.join(nmax_dir, "eigenphase_info.csv")],
+            params={"tier": render_tier,
+                    "uncertainty_method": uncertainty_method,
+                    "n_bootstrap": n_bootstrap,
+                    "windows": windows},
+            deps=["channels_{}".format(Nmax), "bound_states_{}".format(Nmax),
+                  "flip_eigenphase_{}".format(Nmax),
+                  "flip_phase_{}".format(Nmax)],
+            interactive=batch is None, clean=True))
+
+    graph.add(build_graph.Stage(
+        "level_scheme", make_level_scheme,
+        args=[save_dir, list(Nmax_list), eigenphase_flipped_list] +
+        [build_graph.Result(name) for name in fit_stages],
+        inputs=[utils.abs_path(experiment)],
+        outputs=[os.path.join(save_dir, "level_scheme.png")],
+        params={"tier": render_tier, "connect_levels": connect_levels},
+        deps=fit_stages, interactive=True))
+    return graph
 
 
 def get_experimental():
@@ -372,14 +791,148 @@ def get_experimental():
     overall_widths.append(expt_widths)
     overall_channels.append(expt_channels)
     overall_titles.append("Experiment")
+    overall_energy_cis.append([None] * len(expt_energies))
+    overall_width_cis.append([None] * len(expt_energies))
     print("got experimental data")
 
 
-def plot_scheme():
+def read_config(config_path):
+    """
+    Read settings for a batch job from a JSON or TOML file, so nothing
+    has to be edited in this file and nobody has to be around to pick
+    channels or fit resonances.
+
+    Any of the settings at the top of this file can be in the config
+    (Nmax_list, file_dir, phase_shift_list, eigenphase_shift_list,
+    ncsmc_dot_out_list, experiment, make_phase_plots_too, render_tier,
+    uncertainty_method, n_bootstrap, connect_levels, n_processes),
+    as well as:
+
+    - output_dir: where to put all output (default: file_dir)
+    - channels / phase_channels: interesting channels for each Nmax,
+      lines like in interesting.txt. Any Nmax without them gets channels
+      picked automatically (only if interesting.txt is empty / missing).
+    - res_types: resonance types that are picked automatically,
+      default ["strong"] (see ``resonance_info``)
+    - windows: fit windows for each Nmax and channel. Any channel
+      without one gets a window from ``fitter.auto_window``.
+
+    e.g. as JSON::
+
+        {
+            "Nmax_list": [4, 6],
+            "file_dir": "/scratch/me/Li9",
+            "phase_shift_list": ["phase_4.agr", "phase_6.agr"],
+            "eigenphase_shift_list": ["eigenphase_4.agr", "eigenphase_6.agr"],
+            "ncsmc_dot_out_list": ["ncsmc_4.out", "ncsmc_6.out"],
+            "experiment": "experiment_Li9.txt",
+            "output_dir": "/scratch/me/Li9/output",
+            "channels": {"4": ["3,-,3,1,strong", "5,-,3,2,strong"]},
+            "windows": {"4": {"3_-_3_1": [1.2, 2.5]}}
+        }
+
+    File names are relative to file_dir. Nmax values are strings in the
+    channels and windows tables, since JSON / TOML keys have to be.
+
+    config_path:
+        string, path to a .json or .toml file
+
+    returns:
+        output_dir, batch; a string and a dict for ``build_pipeline``
+    """
+    global Nmax_list, file_dir, phase_shift_list, eigenphase_shift_list
+    global ncsmc_dot_out_list, experiment, make_phase_plots_too, render_tier
+    global uncertainty_method, n_bootstrap, connect_levels, n_processes
+
+    if config_path.endswith(".toml"):
+        if tomllib is None:
+            raise ImportError("Reading TOML needs Python 3.11 or newer, "
+                              "use a JSON config file instead")
+        with open(config_path, "rb") as config_file:
+            config = tomllib.load(config_file)
+    else:
+        with open(config_path, "r") as config_file:
+            config = json.load(config_file)
+
+    settings = ["Nmax_list", "file_dir", "phase_shift_list",
+                "eigenphase_shift_list", "ncsmc_dot_out_list", "experiment",
+                "make_phase_plots_too", "render_tier", "uncertainty_method",
+                "n_bootstrap", "connect_levels", "n_processes"]
+    batch_settings = ["output_dir", "channels", "phase_channels",
+                      "res_types", "windows"]
+    unknown = set(config) - set(settings) - set(batch_settings)
+    if unknown:
+        raise ValueError("Unknown settings in {}: {}".format(
+            config_path, ", ".join(sorted(unknown))))
+
+    Nmax_list = config.get("Nmax_list", Nmax_list)
+    file_dir = config.get("file_dir", file_dir)
+    # file names are relative to file_dir (absolute paths are fine too)
+    phase_shift_list = [os.path.join(file_dir, f) for f in config.get(
+        "phase_shift_list", phase_shift_list)]
+    eigenphase_shift_list = [os.path.join(file_dir, f) for f in config.get(
+        "eigenphase_shift_list", eigenphase_shift_list)]
+    ncsmc_dot_out_list = [os.path.join(file_dir, f) for f in config.get(
+        "ncsmc_dot_out_list", ncsmc_dot_out_list)]
+    experiment = os.path.join(file_dir, config.get("experiment", experiment))
+    make_phase_plots_too = config.get(
+        "make_phase_plots_too", make_phase_plots_too)
+    render_tier = config.get("render_tier", render_tier)
+    uncertainty_method = config.get("uncertainty_method", uncertainty_method)
+    n_bootstrap = config.get("n_bootstrap", n_bootstrap)
+    connect_levels = config.get("connect_levels", connect_levels)
+    n_processes = config.get("n_processes", n_processes)
+
+    for file_list in [phase_shift_list, eigenphase_shift_list,
+                      ncsmc_dot_out_list]:
+        if len(file_list) != len(Nmax_list):
+            raise ValueError("Need one file per Nmax, got {} files "
+                             "for {} Nmax values".format(
+                                 len(file_list), len(Nmax_list)))
+
+    def channel_strings(table):
+        # channels can be one big string or a list of lines
+        return {str(Nmax): (channels if isinstance(channels, str)
+                            else "".join(line + "\n" for line in channels))
+                for Nmax, channels in table.items()}
+
+    batch = {
+        "channels": channel_strings(config.get("channels", {})),
+        "phase_channels": channel_strings(config.get("phase_channels", {})),
+        "res_types": config.get("res_types", ["strong"]),
+        "windows": {str(Nmax): windows for Nmax, windows
+                    in config.get("windows", {}).items()},
+    }
+    output_dir = utils.abs_path(config.get("output_dir", file_dir))
+    return output_dir, batch
+
+
+def plot_scheme(dry_run=False, config_path=None, profile=False,
+                trace_memory=False):
     """
-    Plot a level scheme! Grab all data and call
-    ``scheme_plot.plot_multi_levels()``
+    Plot a level scheme! Runs every step that's out of date
+    (see ``build_pipeline``), ending with ``scheme_plot.plot_multi_levels()``
+
+    dry_run:
+        boolean, if True just list the steps that are out of date
+
+    config_path:
+        string, path to a JSON / TOML config file for running as a
+        batch job (see ``read_config``), or None to use the settings
+        at the top of this file and ask a human for channels and fits
+
+    profile:
+        boolean, if True print a table of how long each part took
+        (see ``profiler``), and save it as profile.json with the output
+
+    trace_memory:
+        boolean, if profiling, also track peak memory of each part.
+        This makes the whole run a few times slower.
     """
+    output_dir, batch = None, None
+    if config_path is not None:
+        output_dir, batch = read_config(config_path)
+
     # first ensure files exist
     files = (phase_shift_list + eigenphase_shift_list +
              ncsmc_dot_out_list + [experiment])
@@ -389,17 +942,52 @@ def plot_scheme():
         if not os.path.getsize(f) > 0:
             raise ValueError("file "+f+" is empty!")
 
-    # then get the data we need
-    add_nmax_data(Nmax_list)
-    get_experimental()
-
-    # then plot the level scheme
-    scheme_plot.plot_multi_levels(
-        overall_energies,
-        overall_widths,
-        overall_channels,
-        overall_titles)
+    # then do whatever needs doing
+    graph = build_pipeline(Nmax_list, n_processes, output_dir, batch)
+    if profile:
+        profiler.enable(trace_memory)
+    start = time.time()
+    with profiler.timed("process_ncsmc_output.plot_scheme"):
+        graph.run(dry_run=dry_run, processes=n_processes,
+                  initializer=_init_nmax_worker,
+                  initargs=(utils.output_dir, render_tier, profile,
+                            trace_memory, {
+                                "make_phase_plots_too": make_phase_plots_too,
+                                "uncertainty_method": uncertainty_method,
+                                "n_bootstrap": n_bootstrap}))
+    if not dry_run:
+        print("done in {:.1f} s".format(time.time() - start))
+    if profile:
+        base_dir = (os.path.dirname(utils.output_dir) if output_dir is None
+                    else output_dir)
+        profiler.report(os.path.join(base_dir, "profile.json"))
 
 
 if __name__ == "__main__":
-    plot_scheme()
+    parser = argparse.ArgumentParser("Process NCSMC Output")
+    parser.add_argument(
+        "--tier", choices=sorted(utils.render_tiers), default=render_tier,
+        help="render tier: quick previews, or high-res final plots. "
+             "Plots that are already up to date are not re-rendered, so "
+             "running with --tier final after a preview run only re-renders "
+             "the interesting channels and the level scheme")
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="list the steps that are out of date, without running them")
+    parser.add_argument(
+        "--config", default=None,
+        help="JSON / TOML file with settings, to run as a batch job "
+             "without any questions or fitting windows")
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="time each part of the run (wall / cpu time, io, counts), "
+             "print a summary and save it as profile.json")
+    parser.add_argument(
+        "--profile-memory", action="store_true",
+        help="like --profile, plus peak memory of each part (with "
+             "tracemalloc, which makes the run a few times slower)")
+    args = parser.parse_args()
+    render_tier = args.tier
+    plot_scheme(dry_run=args.dry_run, config_path=args.config,
+                profile=args.profile or args.profile_memory,
+                trace_memory=args.profile_memory)
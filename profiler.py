@@ -0,0 +1,352 @@
+"""
+Lightweight timing / memory / io instrumentation, to find out which
+part of a run is slow (parsing, flipping, rendering, ...).
+
+Wrap a function or a block of code, and each time it runs we record:
+
+- wall time and CPU time (of this process)
+- peak memory used on top of what was already in use, via ``tracemalloc``
+  (only with ``enable(trace_memory=True)``, since it slows things down)
+- bytes read and written (from /proc/self/io, so Linux only; 0 elsewhere)
+- counts you add yourself, e.g. rows parsed or channels plotted
+
+Nothing is recorded (and almost no time is spent) unless ``enable()``
+has been called, e.g. by ``python process_ncsmc_output.py --profile``.
+
+Typical use::
+
+    @profiler.timed("flipper.flip")
+    def flip(filename):
+        ...
+        profiler.count(rows=len(lines))
+
+    with profiler.timed("render"):
+        ...
+
+    profiler.enable()
+    flip(...)
+    profiler.report("profile.json")  # prints a table, writes JSON
+
+To see how long the command line scripts take to start (their imports),
+run ``python profiler.py --imports [module ...]``.
+
+"""
+import functools
+import json
+import os
+import time
+import tracemalloc
+
+enabled = False
+"""are we recording? Use ``enable()`` / ``disable()`` to change this"""
+
+io_path = "/proc/self/io"
+
+_stats = {}  # key = stage name, value = dict of totals
+_stack = []  # stages currently running, innermost last
+
+
+def enable(trace_memory=False):
+    """
+    Start recording.
+
+    trace_memory:
+        boolean, track peak memory with tracemalloc? It makes python code
+        (matplotlib especially) a few times slower, so timings are
+        pessimistic with it on. Peak memory is 0 with it off.
+    """
+    global enabled
+    enabled = True
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    """Stop recording (what's been recorded so far is kept)"""
+    global enabled
+    enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    """
+    Forget everything recorded so far, e.g. in a new worker process
+    that inherited its parent's records. Don't call it inside a stage.
+    """
+    _stats.clear()
+    del _stack[:]
+
+
+def _io_bytes():
+    """(bytes read, bytes written) by this process so far"""
+    try:
+        with open(io_path, "r") as io_file:
+            fields = dict(line.split(": ") for line in io_file)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _empty_stats():
+    return {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_mb": 0.0,
+            "read_bytes": 0, "written_bytes": 0, "counts": {}}
+
+
+def timed(name):
+    """
+    Record a stage, as a context manager or a function decorator.
+
+    name:
+        string, name of the stage, e.g. "flipper.flip".
+        Calls with the same name are added together.
+
+    returns:
+        Timer object
+    """
+    return Timer(name)
+
+
+class Timer:
+    """
+    Measures one stage each time it's entered, see ``timed``.
+
+    name:
+        string, name of the stage
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with Timer(self.name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        if not enabled:
+            self.running = False
+            return self
+        self.running = True
+        self.counts = {}
+        self.peak = 0
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # fold the peak so far into the stages around this one,
+            # since we're about to reset it
+            for outer in _stack:
+                outer.peak = max(outer.peak, peak)
+            if hasattr(tracemalloc, "reset_peak"):  # python 3.9+
+                tracemalloc.reset_peak()
+            self.start_memory = current
+        self.start_io = _io_bytes()
+        self.start_cpu = time.process_time()
+        self.start_wall = time.perf_counter()
+        _stack.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.running:
+            return False
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.process_time() - self.start_cpu
+        read, written = _io_bytes()
+        peak_mb = 0.0
+        if tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            peak_mb = (self.peak - self.start_memory) / 1e6
+        _stack.pop()
+        if _stack:
+            _stack[-1].peak = max(_stack[-1].peak, self.peak)
+
+        stats = _stats.setdefault(self.name, _empty_stats())
+        stats["calls"] += 1
+        stats["wall_s"] += wall
+        stats["cpu_s"] += cpu
+        stats["peak_mb"] = max(stats["peak_mb"], peak_mb)
+        stats["read_bytes"] += read - self.start_io[0]
+        stats["written_bytes"] += written - self.start_io[1]
+        for key, value in self.counts.items():
+            stats["counts"][key] = stats["counts"].get(key, 0) + value
+        return False
+
+    def add(self, **counts):
+        """
+        Add to counts for this stage, e.g. ``stage.add(rows=100)``
+        """
+        if self.running:
+            for key, value in counts.items():
+                self.counts[key] = self.counts.get(key, 0) + value
+
+
+def count(**counts):
+    """
+    Add to counts (rows, channels, ...) of the innermost running stage,
+    e.g. ``profiler.count(rows=len(lines))``. Does nothing if no stage is
+    running, or we aren't recording.
+    """
+    if enabled and _stack:
+        _stack[-1].add(**counts)
+
+
+def take():
+    """
+    Get everything recorded so far, and forget it.
+    Used to send records from worker processes back to the main one.
+
+    returns:
+        dict, key = stage name, value = dict of totals
+    """
+    stats = {name: dict(values, counts=dict(values["counts"]))
+             for name, values in _stats.items()}
+    _stats.clear()
+    return stats
+
+
+def merge(stats):
+    """
+    Add records from ``take()`` (e.g. from another process) to ours.
+
+    stats:
+        dict, as returned by ``take()``
+    """
+    for name, values in stats.items():
+        totals = _stats.setdefault(name, _empty_stats())
+        for key in ["calls", "wall_s", "cpu_s",
+                    "read_bytes", "written_bytes"]:
+            totals[key] += values[key]
+        totals["peak_mb"] = max(totals["peak_mb"], values["peak_mb"])
+        for key, value in values["counts"].items():
+            totals["counts"][key] = totals["counts"].get(key, 0) + value
+
+
+def summary():
+    """
+    A table of everything recorded, slowest stages first.
+
+    returns:
+        string
+    """
+    header = "{:<40} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9}  {}".format(
+        "stage", "calls", "wall (s)", "cpu (s)", "peak MB",
+        "read MB", "write MB", "counts")
+    lines = [header, "-" * len(header)]
+    for name, stats in sorted(_stats.items(),
+                              key=lambda item: -item[1]["wall_s"]):
+        counts = ", ".join("{}={}".format(key, value)
+                           for key, value in sorted(stats["counts"].items()))
+        lines.append(
+            "{:<40} {:>6} {:>9.3f} {:>9.3f} {:>9.1f} {:>9.2f} {:>9.2f}  {}"
+            .format(name, stats["calls"], stats["wall_s"], stats["cpu_s"],
+                    stats["peak_mb"], stats["read_bytes"] / 1e6,
+                    stats["written_bytes"] / 1e6, counts))
+    lines.append("(cpu time is for this process only, worker processes "
+                 "that render plots are in wall time but not cpu time)")
+    return "\n".join(lines)
+
+
+def report(json_path=None):
+    """
+    Print a summary table, and save all records as JSON.
+
+    json_path:
+        string, where to save the JSON report, or None to just print
+    """
+    print(summary())
+    if json_path is not None:
+        directory = os.path.dirname(json_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(json_path, "w") as json_file:
+            json.dump({"stages": _stats}, json_file, indent=1,
+                      sort_keys=True)
+        print("Saved profile to", json_path)
+
+
+# modules with command line entry points, for ``benchmark_imports``
+entry_points = ["flipper", "output_simplifier", "resonance_info",
+                "rename_post_ncsmc", "catalog", "pheno", "sweep",
+                "resonance_plotter", "fitter", "scheme_plot",
+                "process_ncsmc_output"]
+
+# imports that cost a lot, which entry points should only pay for if they
+# plot (or crunch numbers)
+heavy_imports = ["matplotlib.pyplot", "numpy"]
+
+
+def benchmark_imports(modules=None, repeats=5):
+    """
+    Time how long it takes to import each module, in a fresh python
+    (``python -X importtime``) each time, i.e. how long a script waits
+    before it does anything. ``heavy_imports`` are timed too, to compare.
+
+    modules:
+        list of strings, module names, or None for ``entry_points``
+
+    repeats:
+        int, times to import each one (we report the median)
+
+    returns:
+        dict, key = module, value = (import time in ms,
+        list of ``heavy_imports`` that got imported along with it).
+        The time is None if the import failed.
+    """
+    # only needed here, so the profiler itself stays quick to import
+    import statistics
+    import subprocess
+    import sys
+
+    if modules is None:
+        modules = entry_points
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module in heavy_imports + modules:
+        times = []
+        for _ in range(repeats):
+            process = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c",
+                 "import " + module],
+                cwd=here, capture_output=True, text=True)
+            if process.returncode != 0:
+                break
+            # lines look like "import time: self [us] | cumulative | name",
+            # with names of nested imports indented
+            names = {}
+            for line in process.stderr.splitlines():
+                if line.startswith("import time:") and "|" in line:
+                    _, cumulative, name = line.split("|")
+                    if cumulative.strip().isdigit():
+                        names[name.strip()] = int(cumulative)
+            times.append(names[module] / 1e3)
+        if len(times) < repeats:
+            results[module] = (None, [])
+            continue
+        heavy = [name for name in heavy_imports
+                 if name != module and name in names]
+        results[module] = (statistics.median(times), heavy)
+
+    print("{:<25} {:>10}  {}".format("module", "import ms", "heavy imports"))
+    for module, (ms, heavy) in results.items():
+        ms = "failed" if ms is None else "{:.1f}".format(ms)
+        print("{:<25} {:>10}  {}".format(
+            module, ms, ", ".join(heavy) if heavy else "-"))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser("Profiler")
+    parser.add_argument("--imports", nargs="*", metavar="MODULE",
+                        help="time imports of these modules (default: "
+                             "all the command line scripts)")
+    parser.add_argument("-n", type=int, default=5,
+                        help="number of times to import each module")
+    args = parser.parse_args()
+    if args.imports is not None:
+        benchmark_imports(args.imports or None, args.n)
+    else:
+        parser.print_help()
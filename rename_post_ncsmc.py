@@ -6,10 +6,16 @@ You can add a line to the end of your NCSMC batch script to call this, e.g.::
     python /path/to/rename_post_ncsmc.py --projectile=$projectile
     --target=$target --potential=$potential --freq=$freq --Nmax=$Nmax
     --affix=$affix
+
+Add ``--archive`` to pack the (renamed) files into one compressed bundle
+per run instead, see ``archive_all``.
 """
 
 import os
 import argparse
+import json
+import shutil
+import zipfile
 
 # IF YOU'RE RUNNING THIS WITH A BATCH SCRIPT, YOU DON'T HAVE TO EDIT ANYTHING!
 # parameters describing nucleus, potential, ...
@@ -21,8 +27,89 @@ Nmax = '6'
 affix = ''
 
 
+# files NCSMC makes, as (prefix, suffix) pairs: x.y --> x_details.y
+# (note that "suffix" is not always equal to "extension")
+output_files = [
+    ('t', '.o'),
+    ('kernels_n_np', '.dat'),
+    ('kernels_plot_n_np', '.dat'),
+    ('RGM_kernels_n_np', '.dat'),
+    ('model_space_wf', '.agr'),
+    ('model_space_wf_RGM', '.agr'),
+    ('model_space_wf_NCSMC', '.agr'),
+    ('wavefunction', '.agr'),
+    ('wavefunction_NCSMC', '.agr'),
+    ('wavefunction_xy', '.agr'),
+    ('norm_sqrt_r_rp', '.dat'),
+    ('norm_sqrt_r_rp_RGM', '.dat'),
+    ('scattering_wf', '.agr'),
+    ('scattering_wf_NCSMC', '.agr'),
+    ('ortogkernel_r_rp', '.dat'),
+    ('phase_shift', '.agr'),
+    ('eigenphase_shift', '.agr'),
+    ('ncsm_rgm_Am3_3.out', ''),
+    ('ncsm_rgm_Am2_2.out', ''),
+    ('ncsm_rgm_Am2_1_1.out', ''),
+    ('NCSMC_form_factors_g_h', '.dat'),
+    ('expansion_coeff_NCSMC', '.dat'),
+    ('file_S_matrix', '.tmp_fmt'),
+    ('InputForRmatrixAnalysis', '.tmp'),
+    ('Rmatrix', '.tmp'),
+    ('sigma_tot', '.agr'),
+    ('sigma_reac', '.agr'),
+    ('dsigma_dOmega', '.agr'),
+    ('iT11', '.agr'),
+    ('T0022_target-beam', '.agr'),
+]
+
+# bundles (see ``archive_all``): compression level 0-9,
+# and the name of the table of contents inside each bundle
+compress_level = 6
+toc_name = "TOC.json"
+
+
+def get_details(projectile=projectile, target=target, potential=potential,
+                freq=freq, Nmax=Nmax, affix=affix):
+    """
+    Stuff to be written into filenames, e.g. nLi8_n3lo-srg2.0_20_Nmax11
+    """
+    details = projectile+target+'_'+potential+'_'+freq+'_Nmax'+Nmax
+    if len(affix) > 0:
+        details = details+'_'+affix
+    return details
+
+
+def find_outputs(details, directory="."):
+    """
+    Find the NCSMC output files in a directory (looking through it once),
+    and what they should be called.
+
+    e.g. phase_shift.agr --> phase_shift_nLi8_n3lo-srg2.0_20_Nmax11.agr
+
+    Files that only contain \n or something are skipped.
+
+    details:
+        string, from ``get_details``
+
+    directory:
+        string, directory NCSMC ran in
+
+    returns:
+        list of (old name, new name, os.DirEntry) tuples
+    """
+    with os.scandir(directory) as entries:
+        files = {entry.name: entry for entry in entries if entry.is_file()}
+    outputs = []
+    for prefix, suffix in output_files:
+        entry = files.get(prefix + suffix)
+        if entry is not None and entry.stat().st_size > 2:
+            outputs.append(
+                (entry.name, prefix + '_' + details + suffix, entry))
+    return outputs
+
+
 def rename_all(projectile=projectile, target=target, potential=potential,
-               freq=freq, Nmax=Nmax, affix=affix):
+               freq=freq, Nmax=Nmax, affix=affix, directory="."):
     """
     Given a bunch of nucleus details, rename files after running ncsmc
 
@@ -36,66 +123,86 @@ def rename_all(projectile=projectile, target=target, potential=potential,
         freq = '20'
         Nmax = '4'
         affix = ''
-    
+
+    directory:
+        string, directory NCSMC ran in
     """
+    details = get_details(projectile, target, potential, freq, Nmax, affix)
+    for old_name, new_name, _ in find_outputs(details, directory):
+        os.rename(os.path.join(directory, old_name),
+                  os.path.join(directory, new_name))
+        print("renamed "+old_name)
 
-    # stuff to be written into your filenames e.g. x.y --> x_details.y
-    details = projectile+target+'_'+potential+'_'+freq+'_Nmax'+Nmax
-    if len(affix) > 0:
-        details = details+'_'+affix
 
-    def rename(prefix, suffix=''):
-        """
-        Renames a file whose name consists of a prefix and suffix
-
-        e.g. phase_shift.agr --> phase_shift_nLi8_n3lo-srg2.0_20_Nmax11.agr
-
-        (e.g. prefix = "phase_shift", suffix = ".agr",
-        but note that "suffix" is not always equal to "extension")
-
-        The stuff that gets added in the middle is defined as 'details' above.
-        """
-        old_file = prefix + suffix
-        # if old_file exists and is in fact a file
-        if os.path.isfile(old_file):
-            # and if old_file contains more than just \n or something
-            if os.path.getsize(old_file) > 2:
-                # rename to new_file by adding details in the middle
-                new_file = prefix + '_' + details + suffix
-                os.rename(old_file, new_file)
-                print("renamed "+old_file)
-
-    # rename all the following files, if they exist
-    rename('t', '.o')
-    rename('kernels_n_np', '.dat')
-    rename('kernels_plot_n_np', '.dat')
-    rename('RGM_kernels_n_np', '.dat')
-    rename('model_space_wf', '.agr')
-    rename('model_space_wf_RGM', '.agr')
-    rename('model_space_wf_NCSMC', '.agr')
-    rename('wavefunction', '.agr')
-    rename('wavefunction_NCSMC', '.agr')
-    rename('wavefunction_xy', '.agr')
-    rename('norm_sqrt_r_rp', '.dat')
-    rename('norm_sqrt_r_rp_RGM', '.dat')
-    rename('scattering_wf', '.agr')
-    rename('scattering_wf_NCSMC', '.agr')
-    rename('ortogkernel_r_rp', '.dat')
-    rename('phase_shift', '.agr')
-    rename('eigenphase_shift', '.agr')
-    rename('ncsm_rgm_Am3_3.out')
-    rename('ncsm_rgm_Am2_2.out')
-    rename('ncsm_rgm_Am2_1_1.out')
-    rename('NCSMC_form_factors_g_h', '.dat')
-    rename('expansion_coeff_NCSMC', '.dat')
-    rename('file_S_matrix', '.tmp_fmt')
-    rename('InputForRmatrixAnalysis', '.tmp')
-    rename('Rmatrix', '.tmp')
-    rename('sigma_tot', '.agr')
-    rename('sigma_reac', '.agr')
-    rename('dsigma_dOmega', '.agr')
-    rename('iT11', '.agr')
-    rename('T0022_target-beam', '.agr')
+def archive_all(projectile=projectile, target=target, potential=potential,
+                freq=freq, Nmax=Nmax, affix=affix, directory=".", keep=False):
+    """
+    Like ``rename_all``, but instead of renaming files, pack them all
+    (with their new names) into one compressed bundle,
+    ``ncsmc_[details].zip``, and delete the loose files.
+
+    The bundle has a table of contents, TOC.json, listing the details
+    above and every file (new name, original name, size, modification time).
+    Files can be read straight from the bundle, without extracting them,
+    by flipper.py and output_simplifier.py, using a path like
+    ``/path/to/ncsmc_[details].zip::eigenphase_shift_[details].agr``
+    (or ``python -m zipfile -e bundle.zip dir`` extracts everything).
+
+    If the bundle already exists, new files are added to it
+    (replacing files with the same name).
+
+    directory:
+        string, directory NCSMC ran in
+
+    keep:
+        boolean, keep the loose files as well?
+
+    returns:
+        string, path to the bundle
+    """
+    details = get_details(projectile, target, potential, freq, Nmax, affix)
+    outputs = find_outputs(details, directory)
+    bundle_path = os.path.join(directory, "ncsmc_" + details + ".zip")
+    toc = {"details": {"projectile": projectile, "target": target,
+                       "potential": potential, "freq": freq, "Nmax": Nmax,
+                       "affix": affix},
+           "files": []}
+    new_names = [new_name for _, new_name, _ in outputs]
+    if not outputs:
+        print("no NCSMC output files to bundle in", directory)
+        return bundle_path
+
+    tmp_path = bundle_path + ".tmp"
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED,
+                         compresslevel=compress_level) as bundle:
+        # start with whatever was already bundled, unless it's replaced
+        if os.path.exists(bundle_path):
+            with zipfile.ZipFile(bundle_path) as old_bundle:
+                if toc_name in old_bundle.namelist():
+                    old_toc = json.loads(old_bundle.read(toc_name))
+                    toc["files"] = [info for info in old_toc["files"]
+                                    if info["name"] not in new_names]
+                for info in old_bundle.infolist():
+                    if info.filename in new_names + [toc_name]:
+                        continue
+                    with old_bundle.open(info) as src, \
+                            bundle.open(info, "w") as dst:
+                        shutil.copyfileobj(src, dst, 1 << 20)
+        for old_name, new_name, entry in outputs:
+            bundle.write(entry.path, new_name)
+            stat = entry.stat()
+            toc["files"].append({"name": new_name, "original": old_name,
+                                 "size": stat.st_size,
+                                 "mtime": stat.st_mtime})
+            print("bundled "+old_name)
+        bundle.writestr(toc_name, json.dumps(toc, indent=1))
+    os.replace(tmp_path, bundle_path)
+
+    if not keep:
+        for _, _, entry in outputs:
+            os.remove(entry.path)
+    print("saved {} files in {}".format(len(outputs), bundle_path))
+    return bundle_path
 
 
 if __name__ == "__main__":
@@ -112,10 +219,20 @@ if __name__ == "__main__":
     parser.add_argument("--Nmax", nargs='?', const=Nmax, help="Nmax", type=str)
     parser.add_argument("--affix", nargs='?', const=affix,
                         help="extra text to affix to filenames", type=str)
+    parser.add_argument("--archive", action="store_true",
+                        help="pack files into one compressed bundle")
+    parser.add_argument("--keep", action="store_true",
+                        help="with --archive, keep the loose files too")
 
-    # get args in dictionary form
+    # get args in dictionary form, leaving out ones that weren't given
     args = vars(parser.parse_args())
+    archive, keep = args.pop("archive"), args.pop("keep")
+    args = {key: value for key, value in args.items() if value is not None}
 
     # then run the renaming function with those variables
-    rename_all(**args)
-    print("done renaming!")
+    if archive:
+        archive_all(keep=keep, **args)
+        print("done archiving!")
+    else:
+        rename_all(**args)
+        print("done renaming!")
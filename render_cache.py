@@ -0,0 +1,122 @@
+"""
+Keeps track of which output files (plots, xmgrace files, csv files, ...)
+are already up to date, so we don't render or write them again.
+
+Each output gets a "key", a hash of everything that goes into it
+(data arrays, titles, dpi, bounds, ...). Keys are stored in a small
+manifest file in each output directory. If a file exists and its key
+in the manifest matches, there's no need to make it again.
+
+Typical use::
+
+    cache = render_cache.RenderCache()
+    key = render_cache.content_hash(energies, phases, title=title, dpi=dpi)
+    if not cache.is_fresh(path, key):
+        make_the_file(path)
+        cache.record(path, key)
+    cache.save()
+
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+manifest_name = ".render_manifest.json"
+"""name of the manifest file stored in each output directory"""
+
+
+def content_hash(*arrays, **params):
+    """
+    Hash some arrays and parameters into a short hex string.
+
+    arrays:
+        any number of array-likes of floats (lists are fine too)
+
+    params:
+        keyword arguments, anything that can be turned into a string,
+        e.g. dpi=90, bounds=(0, 10), title="..."
+    """
+    sha = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=float)
+        sha.update(str(array.shape).encode())
+        sha.update(array.tobytes())
+    sha.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return sha.hexdigest()
+
+
+class RenderCache:
+    """
+    Manifests for any number of output directories.
+
+    Manifests are loaded the first time a directory is used,
+    and written back by ``save()``.
+
+    enabled:
+        boolean, if False nothing is ever considered fresh
+        (but keys are still recorded, so the next run can use them)
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.manifests = {}  # key = directory, value = {filename: key}
+        self.changed = set()  # directories whose manifest needs saving
+
+    def _manifest(self, directory):
+        """Get (and load if needed) the manifest for a directory"""
+        if directory not in self.manifests:
+            manifest_path = os.path.join(directory, manifest_name)
+            entries = {}
+            if os.path.exists(manifest_path):
+                try:
+                    with open(manifest_path, "r") as manifest_file:
+                        entries = json.load(manifest_file)
+                except ValueError:
+                    # a broken manifest just means re-rendering everything
+                    entries = {}
+            self.manifests[directory] = entries
+        return self.manifests[directory]
+
+    def is_fresh(self, path, key):
+        """
+        Is the file at path already up to date?
+
+        path:
+            string, path to an output file
+
+        key:
+            string, from ``content_hash``
+        """
+        if not self.enabled or not os.path.exists(path):
+            return False
+        directory, name = os.path.split(path)
+        return self._manifest(directory).get(name) == key
+
+    def record(self, path, key):
+        """
+        Remember that the file at path was made with this key.
+
+        path:
+            string, path to an output file
+
+        key:
+            string, from ``content_hash``
+        """
+        directory, name = os.path.split(path)
+        manifest = self._manifest(directory)
+        if manifest.get(name) != key:
+            manifest[name] = key
+            self.changed.add(directory)
+
+    def save(self):
+        """Write all changed manifests to disk"""
+        for directory in self.changed:
+            manifest_path = os.path.join(directory, manifest_name)
+            tmp_path = manifest_path + ".tmp"
+            with open(tmp_path, "w") as manifest_file:
+                json.dump(self.manifests[directory], manifest_file,
+                          indent=0, sort_keys=True)
+            os.replace(tmp_path, manifest_path)
+        self.changed = set()
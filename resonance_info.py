@@ -17,13 +17,43 @@ from os.path import join, exists
 import argparse
 
 import flipper
+import profiler
 import utils
 
 filename = "/path/to/eigenphase_shift.agr_flipped"
 flipped = True  # has the file at the path above been run through flipper.py?
 
 
-def get_resonance_info(filename, Nmax=None, already_flipped=False):
+@profiler.timed("resonance_info.classify_channels")
+def classify_channels(channels):
+    """
+    Decide which channels have resonances, by how much their
+    (flipped) phase shifts change: "strong" (over 90 degrees),
+    "possible" (over 60 degrees) or "none".
+
+    channels:
+        dict, key = ``utils.ChannelKey``, value = list of phases,
+        e.g. from ``flipper.separate_into_channels``
+
+    returns:
+        dict, key = ``utils.ChannelKey``, value = resonance type
+    """
+    resonance_info = {}
+    for key, phases in channels.items():
+        max_difference = abs(max(phases) - min(phases))
+        if max_difference > 90:
+            res_type = "strong"
+        elif max_difference > 60:
+            res_type = "possible"
+        else:
+            res_type = "none"
+        resonance_info[key] = res_type
+    return resonance_info
+
+
+@profiler.timed("resonance_info.get_resonance_info")
+def get_resonance_info(filename, Nmax=None, already_flipped=False,
+                       output_dir=None, suffix=""):
     """
     Parses a ncsmc (eigen)phase shift file and writes info about each
     channel to a .csv file, with information about whether or not there is a
@@ -38,6 +68,12 @@ def get_resonance_info(filename, Nmax=None, already_flipped=False):
     already_flipped:
         boolean, whether or not the file has already been
         "flipped" by flipper.py
+
+    output_dir:
+        string, directory to put output in, see ``utils.nmax_dir``
+
+    suffix:
+        string, added to the end of the .csv file name
      """
     filename = utils.abs_path(filename)
     phase_word = "Eigenphase" if "eigen" in filename else "Phase"
@@ -55,42 +91,23 @@ def get_resonance_info(filename, Nmax=None, already_flipped=False):
 
     # channels: dict, key = title, value = list with channel numbers
     channels, _ = flipper.separate_into_channels(new_filename)
-    
-    # now look in each channel for a resonance
-    resonance_info = {}
-    for title, phases in channels.items():
-        nice_title = utils.make_nice_title(title)
-
-        resonance = False
-        max_difference = abs(max(phases) - min(phases))
-
-        if max_difference > 90:
-            resonance = True
-            res_type = "strong"
-        elif max_difference > 60:
-            res_type = "possible"
-        else:
-            res_type = "none"
-
-        resonance_info[nice_title] = res_type
 
-        if resonance:
-            # anything we should do here?
-            pass
+    # now look in each channel for a resonance
+    resonance_info = classify_channels(channels)
 
     # write resonance info to a file, (res = resonance)
-    output_dir = utils.output_dir.format(Nmax)
+    output_dir = utils.nmax_dir(Nmax, output_dir)
     if not exists(output_dir):
-        os.mkdir(output_dir)
-    res_file_title = "resonances_"+phase_word.lower()+"_Nmax_"+str(Nmax)+".csv"
+        os.makedirs(output_dir)
+    res_file_title = (
+        "resonances_"+phase_word.lower()+"_Nmax_"+str(Nmax)+suffix+".csv")
     res_file_name = join(output_dir, res_file_title)
     with open(res_file_name, "w+") as res_file:
         res_file.write("2J,parity,2T,column_number,resonance_type\n")
-        for title, res_type in resonance_info.items():
-            Jx2, parity, Tx2, _, column_number = title.split("_")
-            write_list = [Jx2, parity, Tx2, column_number, res_type]
-            res_file.write(",".join(write_list) + "\n")
+        for key, res_type in resonance_info.items():
+            res_file.write(key.row + "," + res_type + "\n")
     print("Analyzed all channels, saved CSV with info to", res_file_name)
+    profiler.count(channels=len(resonance_info))
     return res_file_name
 
 
@@ -15,16 +15,28 @@ It will:
 - detect which channels have resonances (saved in resonances directory)
 - plot all channels
 
+To see how fast channel plots are rendered (in channels per second),
+and how much decimating the spaghetti plot saves, run
+
+``python resonance_plotter.py --benchmark``
+
 """
 from os.path import join, exists
 import os
 from math import inf
 import argparse
+import time
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
-import matplotlib.pyplot as plt
+import numpy as np
+# matplotlib is imported in the functions that plot: it's slow to import,
+# and lots of scripts use this module without plotting anything
 
 import utils
 import flipper
+import profiler
+import render_cache
 from resonance_info import get_resonance_info
 
 filepath = "/path/to/phase_shift.agr_flipped"
@@ -63,12 +75,363 @@ energy_bounds: the bounds to use for the energy (x) axis
 # res_types = ["strong"]  # if you just want "strong" resonances
 res_types = "all"  # if you want to plot everything
 
-# resolution of png images, dots per inch
-dpi = 90
+# resolution of png images, dots per inch (the "preview" render tier)
+dpi = utils.tier_dpi("preview")
+
+# how to save the individual channel plots:
+# "png" = one image per channel (in PNGs_[eigen]phase),
+# "pdf" = one multipage pdf with a page per channel,
+# "sheet" = contact sheets, i.e. a grid of many channels per image.
+# For "pdf" and "sheet", each channel is labeled with its row from
+# resonances_[eigen]phase_Nmax_[#].csv, ready to copy into interesting.txt
+channel_output = "png"
+
+# skip re-making plots / files whose inputs haven't changed since last time?
+# (see render_cache.py)
+use_render_cache = True
+
+# cap on the number of points per channel in the big spaghetti plot (and its
+# svg twin). Curves are thinned with ``decimate``, which keeps the shape
+# (including resonance swoops). None = plot every point.
+max_spaghetti_points = None
+
+# bump this if you change how plots look, so cached plots get remade
+render_version = 1
+
+# how many processes to use for rendering channel PNGs.
+# 1 = render everything in this process, None = one per core
+processes = None
+
+
+def _init_render_worker():
+    """
+    Make sure render workers never try to open a window,
+    and don't pay for profiling they can't report
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    profiler.disable()
+
+
+class ChannelRenderer:
+    """
+    One template figure for channel plots, reused for every channel.
+
+    Labels, limits and the line artist are set up once; rendering a channel
+    only swaps in new line data and a new title before saving, so we don't
+    build and tear down a whole figure per channel.
 
+    bounds:
+        (left, right) tuple of floats, energy axis limits
+    """
+
+    def __init__(self, bounds):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.bounds = bounds
+        # a bare Figure, so pyplot never has to keep track of it
+        self.fig = Figure()
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.subplots()
+        self.ax.set_title(" ")
+        self.ax.set_ylabel("Phase (degrees)")
+        # nothing interesting should happen outside this range, right?
+        # I'd let matplotlib autogenerate the graph limits,
+        # but then you get graphs with a range of -1 to 1, which have
+        # an interesting shape but are not large enough to be useful
+        self.ax.set_ylim(-50, 200)
+        self.ax.set_xlim(*bounds)
+        self.ax.set_xlabel("Energy (MeV)")
+        self.line, = self.ax.plot([], [])
+
+    def render(self, energies, phases, plot_title, path, dpi=dpi):
+        """
+        Save a plot of one channel, reusing the template figure.
+
+        energies, phases:
+            1D arrays of floats
+
+        plot_title:
+            string, title of the plot
+
+        path:
+            string, where to save the image
+
+        dpi:
+            resolution of the image
+        """
+        self.update(energies, phases, plot_title)
+        self.fig.savefig(path, dpi=dpi)
+        return path
+
+    def update(self, energies, phases, plot_title):
+        """
+        Put one channel on the template figure, without saving it.
+
+        energies, phases:
+            1D arrays of floats
+
+        plot_title:
+            string, title of the plot
+        """
+        self.line.set_data(energies, phases)
+        self.ax.title.set_text(plot_title)
+
+
+class ContactSheet:
+    """
+    A grid of small channel plots on one figure, reused for every page.
+
+    Each page only swaps line data and titles on the existing axes,
+    hiding the axes that aren't needed on the last page.
+
+    bounds:
+        (left, right) tuple of floats, energy axis limits
+
+    nrows, ncols:
+        ints, size of the grid on each page
+    """
+
+    def __init__(self, bounds, nrows=6, ncols=6):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.bounds = bounds
+        self.per_page = nrows * ncols
+        self.fig = Figure(figsize=(2.5 * ncols, 2 * nrows))
+        FigureCanvasAgg(self.fig)
+        # no shared axes: the bottom row may be hidden on the last page,
+        # and we still want tick labels on every plot
+        self.axes = self.fig.subplots(nrows, ncols, squeeze=False).ravel()
+        self.lines = []
+        for ax in self.axes:
+            ax.set_title(" ", fontsize="small")
+            ax.set_ylim(-50, 200)
+            ax.set_xlim(*bounds)
+            ax.tick_params(labelsize="x-small")
+            line, = ax.plot([], [])
+            self.lines.append(line)
+        self.fig.supxlabel("Energy (MeV)")
+        self.fig.supylabel("Phase (degrees)")
+        self.fig.tight_layout(rect=(0.02, 0.02, 1, 1))
+
+    def render(self, channels, path, dpi=dpi):
+        """
+        Save one page of channels.
+
+        channels:
+            list of (energies, phases, label) tuples, at most nrows * ncols
+
+        path:
+            string, where to save the page
+
+        dpi:
+            resolution of the image
+        """
+        for i, ax in enumerate(self.axes):
+            if i < len(channels):
+                energies, phases, label = channels[i]
+                self.lines[i].set_data(energies, phases)
+                ax.title.set_text(label)
+                ax.set_visible(True)
+            else:
+                ax.set_visible(False)
+        self.fig.savefig(path, dpi=dpi)
+        return path
+
+
+def write_channel_pdf(channels, path, bounds):
+    """
+    Save all channels as one multipage PDF, one channel per page,
+    reusing a single ``ChannelRenderer`` for every page.
+
+    channels:
+        list of (energies, phases, label) tuples
 
+    path:
+        string, where to save the PDF
+
+    bounds:
+        (left, right) tuple of floats, energy axis limits
+    """
+    from matplotlib.backends.backend_pdf import PdfPages
+    renderer = ChannelRenderer(bounds)
+    with PdfPages(path) as pdf:
+        for energies, phases, label in channels:
+            renderer.update(energies, phases, label)
+            pdf.savefig(renderer.fig)
+    return path
+
+
+def write_contact_sheets(channels, path_fmt, bounds, dpi=dpi,
+                         nrows=6, ncols=6):
+    """
+    Save all channels as tiled contact sheets, nrows x ncols per image.
+
+    channels:
+        list of (energies, phases, label) tuples
+
+    path_fmt:
+        string, path with a ``{}`` for the page number, starting at 1
+
+    bounds:
+        (left, right) tuple of floats, energy axis limits
+
+    dpi:
+        resolution of the images
+
+    returns:
+        list of paths to the saved pages
+    """
+    sheet = ContactSheet(bounds, nrows=nrows, ncols=ncols)
+    paths = []
+    for page, start in enumerate(range(0, len(channels), sheet.per_page)):
+        paths.append(sheet.render(channels[start:start+sheet.per_page],
+                                  path_fmt.format(page+1), dpi=dpi))
+    return paths
+
+
+# the renderer used by this process, see ``render_channel``
+_renderer = None
+
+
+def render_channel(job):
+    """
+    Render and save one channel's phase vs. energy PNG.
+
+    Reuses this process's ``ChannelRenderer`` while the bounds stay the same.
+
+    job:
+        tuple of (energies, phases, plot_title, path, bounds, dpi), where
+        energies and phases are 1D arrays, bounds is (left, right)
+        and path is where to save the PNG
+    """
+    global _renderer
+    energies, phases, plot_title, path, bounds, dpi = job
+    if _renderer is None or _renderer.bounds != bounds:
+        _renderer = ChannelRenderer(bounds)
+    return _renderer.render(energies, phases, plot_title, path, dpi=dpi)
+
+
+@profiler.timed("resonance_plotter.render_channels")
+def render_channels(jobs, processes=processes):
+    """
+    Render many channel PNGs, spread over a pool of Agg-only processes.
+
+    jobs:
+        list of tuples, see ``render_channel``
+
+    processes:
+        int or None, number of worker processes (None = one per core).
+        Use 1 to render everything in this process.
+
+    returns:
+        list of paths to the saved PNGs
+    """
+    profiler.count(plots=len(jobs))
+    if processes == 1 or len(jobs) <= 1:
+        return [render_channel(job) for job in jobs]
+    n_workers = processes or os.cpu_count() or 1
+    # send work in chunks so small plots don't drown in overhead
+    chunksize = max(1, len(jobs) // (4 * n_workers))
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=_init_render_worker) as pool:
+        return list(pool.map(render_channel, jobs, chunksize=chunksize))
+
+
+def _two_columns(x, y, sep):
+    """
+    Format two columns of floats as one block of text,
+    one ``x<sep>y`` line per row (same number formatting as ``str()``)
+
+    x, y:
+        1D arrays of floats
+
+    sep:
+        string, separator between columns, e.g. " " or ","
+    """
+    line_fmt = "{}" + sep + "{}\n"
+    return "".join(map(line_fmt.format, x.tolist(), y.tolist()))
+
+
+def decimate(x, y, n_out):
+    """
+    Thin a curve down to at most n_out points, keeping its visual shape,
+    using Largest-Triangle-Three-Buckets (Steinarsson, 2013).
+
+    The first and last points are always kept. The points in between are
+    split into n_out - 2 buckets, and from each bucket we keep the point
+    making the largest triangle with the previously kept point and the
+    average of the next bucket. Sharp features like resonance swoops make
+    big triangles, so they survive.
+
+    x, y:
+        1D arrays of floats, x increasing
+
+    n_out:
+        int, max number of points to keep (at least 3)
+
+    returns:
+        x, y; the thinned arrays (the originals if they were short enough)
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return x, y
+
+    # n_out - 2 buckets covering points 1 ... n-2
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    # average point of each bucket, all at once. Each bucket is compared to
+    # the average of the next one, and the last bucket to the last point
+    counts = np.diff(edges)
+    avg_x = np.append(np.add.reduceat(x[1:n-1], edges[:-1] - 1) / counts,
+                      x[-1])
+    avg_y = np.append(np.add.reduceat(y[1:n-1], edges[:-1] - 1) / counts,
+                      y[-1])
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0  # index of the last point we kept
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i+1]
+        # (twice the) triangle areas for every point in this bucket
+        areas = np.abs((x[a] - avg_x[i+1]) * (y[lo:hi] - y[a])
+                       - (x[a] - x[lo:hi]) * (avg_y[i+1] - y[a]))
+        a = lo + int(np.argmax(areas))
+        keep[i+1] = a
+    return x[keep], y[keep]
+
+
+def main_plot_path(filename, Nmax, file_suffix="auto", suffix="",
+                   output_dir=None):
+    """
+    Path of the main (spaghetti) PNG made by ``plot``.
+
+    filename:
+        string, the eigenphase_shift / phase_shift file given to ``plot``
+
+    Nmax:
+        float
+
+    file_suffix:
+        string, "auto" if all channels are plotted, "custom" if only some
+
+    suffix:
+        string, the suffix given to ``plot``
+
+    output_dir:
+        string, the output_dir given to ``plot``
+    """
+    phase_word = "eigenphase" if "eigen" in filename else "phase"
+    return join(
+        utils.nmax_dir(Nmax, output_dir), "PNGs_"+phase_word+suffix,
+        phase_word+"_Nmax_"+str(Nmax)+"_"+file_suffix+suffix+".png")
+
+
+@profiler.timed("resonance_plotter.plot")
 def plot(filename, flipped=False, e_bounds=(-inf, inf), res_types="all",
-         channels="", Nmax=None, dpi=dpi, suffix=""):
+         channels="", Nmax=None, dpi=dpi, suffix="", processes=processes,
+         use_cache=use_render_cache, max_points=max_spaghetti_points,
+         channel_output=channel_output, output_dir=None):
     """
     Makes a whole bunch of plots.
 
@@ -95,6 +458,33 @@ def plot(filename, flipped=False, e_bounds=(-inf, inf), res_types="all",
 
     dpi:
         resolution of the image
+
+    suffix:
+        string, added to the end of the main plot filenames, and of the
+        channel directories (PNGs_..., CSVs_..., grace_files_...) and the
+        resonances csv, so e.g. plots of an unflipped file don't overwrite
+        the channel files of the flipped one, which fits are made from
+
+    processes:
+        int or None, number of processes used to render channel PNGs
+        (None = one per core, 1 = no extra processes)
+
+    use_cache:
+        boolean, skip outputs whose data and style haven't changed since
+        they were last made (tracked in each output directory's manifest)
+
+    max_points:
+        int or None, max points per channel in the big spaghetti plot,
+        see ``decimate``. Channel plots and data files always get every point.
+
+    channel_output:
+        string, "png", "pdf" or "sheet"; how to save channel plots,
+        see ``channel_output`` at the top of this file
+
+    output_dir:
+        string, directory to put all output in, or None to use the one
+        from config.txt. Plots go in a subdirectory for each Nmax,
+        see ``utils.nmax_dir``.
     """
     if res_types == "all":
         res_types = ["strong", "possible", "none"]
@@ -114,28 +504,29 @@ def plot(filename, flipped=False, e_bounds=(-inf, inf), res_types="all",
         file_suffix = "auto"
         # get csv filename with resonance info
         res_output_file = get_resonance_info(
-            filename, Nmax=Nmax, already_flipped=True)
+            filename, Nmax=Nmax, already_flipped=True, output_dir=output_dir,
+            suffix=suffix)
         # take all channels, i.e. all text in the file
         with open(res_output_file, "r+") as channel_file:
             channels = channel_file.read()
     else:
         file_suffix = "custom"
 
-    # make channel titles
+    # which channels to plot
     lines = channels.split("\n")
-    input_titles = []
+    input_rows = {}  # key = ChannelKey, value = line from the channels string
     for line in lines:
         if line == "":
             continue
-        Jx2, parity, Tx2, col_num, res_type = line.split(",")
+        res_type = line.split(",")[-1]
         # only take the types of resonances we want to plot
         if res_type in res_types:
-            title = "_".join([Jx2, parity, Tx2, "column", col_num])
-            input_titles.append(title)
+            input_rows[utils.ChannelKey.from_csv_row(line)] = line
 
-    # all_channels: dict, key = title, value = list of phases for that channel
+    # all_channels: dict, key = ChannelKey, value = list of phases
     # energies: a list of energy values, possibly longer than some channels
     all_channels, energies = flipper.separate_into_channels(new_filename)
+    energies = np.array(energies)
 
     # if energy bounds are -inf, inf, let's set them to the min / max e values
     if e_bounds == (-inf, inf):
@@ -143,131 +534,325 @@ def plot(filename, flipped=False, e_bounds=(-inf, inf), res_types="all",
     else:
         l_bound, r_bound = e_bounds
 
-    output_dir = utils.output_dir.format(Nmax)
-    if not exists(output_dir):
-        os.mkdir(output_dir)
-    png_dir = join(output_dir, "PNGs_"+phase_word)
-    csv_dir = join(output_dir, "CSVs_"+phase_word)
-    grace_dir = join(output_dir, "grace_files_"+phase_word)
+    nmax_dir = utils.nmax_dir(Nmax, output_dir)
+    if not exists(nmax_dir):
+        os.makedirs(nmax_dir)
+    png_dir = join(nmax_dir, "PNGs_"+phase_word+suffix)
+    csv_dir = join(nmax_dir, "CSVs_"+phase_word+suffix)
+    grace_dir = join(nmax_dir, "grace_files_"+phase_word+suffix)
     for d in [png_dir, csv_dir, grace_dir]:
         if not exists(d):
             os.mkdir(d)
 
+    cache = render_cache.RenderCache(enabled=use_cache)
+    n_skipped = 0  # outputs that were already up to date
+
     print("Working on resonance plotting")
-    main_xmgrace_string = ""  # xmgrace string for the full file
-    channel_string = ""  # xmgrace string for each individual channel
+    main_xmgrace_parts = []  # pieces of the xmgrace string for the full file
     series_counter = 0  # xmgrace series titles
     csv_paths = []  # list of csv files of channels we plot
 
     # now look in each channel, plot the ones we care about
     to_plot = []
-    for title, phases in all_channels.items():
-        # see if the title matches one we were given. If so, plot
-        nice_title = utils.make_nice_title(title)
-        if nice_title in input_titles:
+    render_jobs = []  # channel PNGs, rendered all together at the end
+    png_keys = []  # cache keys for those PNGs
+    sheet_channels = []  # channels for the pdf / contact sheets
+    for key, phases in all_channels.items():
+        # see if the channel is one we were given. If so, plot
+        nice_title = key.title
+        if key in input_rows:
             print("adding", nice_title, "to plot\r", end="")
             # energies may be longer than phases,
             # so we truncate energy where needed
-            len_diff = len(energies) - len(phases)
-            if len_diff != 0:
-                trunc_energies = energies[len_diff:]
-            else:
-                trunc_energies = energies
+            phases = np.array(phases)
+            trunc_energies = flipper.channel_energies(energies, phases)
             # then only plot within the given bounds
-            plot_energies, plot_phases = [], []
-            for e, p in zip(trunc_energies, phases):
-                if l_bound <= e and e <= r_bound:
-                    plot_energies.append(e)
-                    plot_phases.append(p)
-
-            # make a matplotlib channel plot
-            channel_fig, channel_ax = plt.subplots()
-            plot_title = utils.make_plot_title(nice_title)
-            channel_ax.set_title(plot_title)
-            channel_ax.set_ylabel("Phase (degrees)")
-            # nothing interesting should happen outside this range, right?
-            # I'd let matplotlib autogenerate the graph limits,
-            # but then you get graphs with a range of -1 to 1, which have
-            # an interesting shape but are not large enough to be useful
-            channel_ax.set_ylim(-50, 200)
-            channel_ax.set_xlim(l_bound, r_bound)
-            channel_ax.set_xlabel("Energy (MeV)")
-            channel_ax.plot(plot_energies, plot_phases)
+            # (energies are increasing, so the bounds give us a slice)
+            left = np.searchsorted(trunc_energies, l_bound, side="left")
+            right = np.searchsorted(trunc_energies, r_bound, side="right")
+            plot_energies = trunc_energies[left:right]
+            plot_phases = phases[left:right]
+            # one "e<sep>p" line per point, built in one go
+            data_lines = _two_columns(plot_energies, plot_phases, " ")
+
+            # queue up a matplotlib channel plot
+            plot_title = key.latex
             channel_path = join(
                 png_dir,
                 phase_word+"_"+nice_title+"_Nmax_"+str(Nmax)+".png")
-            channel_fig.savefig(channel_path, dpi=dpi)
-            plt.close(channel_fig)
+            png_key = render_cache.content_hash(
+                plot_energies, plot_phases, title=plot_title, dpi=dpi,
+                bounds=(l_bound, r_bound), version=render_version)
+            if channel_output != "png":
+                sheet_channels.append((
+                    plot_energies, plot_phases,
+                    "{}  [{}]".format(plot_title, input_rows[key])))
+            elif cache.is_fresh(channel_path, png_key):
+                n_skipped += 1
+            else:
+                render_jobs.append((
+                    plot_energies, plot_phases, plot_title, channel_path,
+                    (l_bound, r_bound), dpi))
+                png_keys.append(png_key)
             to_plot.append((plot_energies, plot_phases, plot_title))
 
             # make xmgrace file for channel
-            c_title = utils.xmgrace_title(title, series_counter) + "\n"
-            channel_string = c_title
+            c_title = key.xmgrace_title(series_counter)
             series_counter += 1
-            for e, p in zip(plot_energies, plot_phases):
-                channel_string += str(e) + " " + str(p) + "\n"
-            channel_string += "&\n"
             # append it to the full file string
-            main_xmgrace_string += channel_string
+            main_xmgrace_parts.append(c_title + "\n" + data_lines + "&\n")
             # and also save it as its own file with series number = 0
-            lines = channel_string.splitlines()
-            lines[0] = utils.xmgrace_title(lines[0], 0)
-            channel_string = "\n".join(lines)
+            channel_string = (
+                key.xmgrace_title(0) + "\n" + data_lines + "&")
             grace_name = join(
                 grace_dir,
                 phase_word+"_"+nice_title+"_Nmax_"+str(Nmax)+".agr")
-            with open(grace_name, "w+") as channel_file:
-                channel_file.write(channel_string)
+            grace_key = render_cache.content_hash(text=channel_string)
+            if cache.is_fresh(grace_name, grace_key):
+                n_skipped += 1
+            else:
+                with open(grace_name, "w+") as channel_file:
+                    channel_file.write(channel_string)
+                cache.record(grace_name, grace_key)
 
             # make csv file for channel too
             csv_path = join(
                 csv_dir,
                 phase_word+"_"+nice_title+"_Nmax_"+str(Nmax)+".csv")
-            with open(csv_path, "w+") as csv_file:
-                for e, p in zip(plot_energies, plot_phases):
-                    csv_file.write(",".join([str(e), str(p)]) + "\n")
+            csv_key = render_cache.content_hash(plot_energies, plot_phases)
+            if cache.is_fresh(csv_path, csv_key):
+                n_skipped += 1
+            else:
+                with open(csv_path, "w+") as csv_file:
+                    csv_file.write(
+                        _two_columns(plot_energies, plot_phases, ","))
+                cache.record(csv_path, csv_key)
             csv_paths.append(csv_path)
 
+    # render all the channel plots
+    print("Rendering", len(render_jobs), "channel plots...\r", end="")
+    render_channels(render_jobs, processes=processes)
+    for job, png_key in zip(render_jobs, png_keys):
+        cache.record(job[3], png_key)
+
+    # or put them all in one pdf / a few contact sheets
+    if channel_output != "png" and sheet_channels:
+        sheet_base = join(
+            png_dir,
+            phase_word+"_channels_Nmax_"+str(Nmax)+"_"+file_suffix+suffix)
+        sheet_key = render_cache.content_hash(
+            *[a for energy, phase, _ in sheet_channels
+              for a in (energy, phase)],
+            labels=[label for _, _, label in sheet_channels],
+            dpi=dpi, bounds=(l_bound, r_bound), output=channel_output,
+            version=render_version)
+        if channel_output == "pdf":
+            sheet_paths = [sheet_base + ".pdf"]
+        else:
+            n_pages = -(-len(sheet_channels) // 36)  # 6 x 6 per page
+            sheet_paths = [sheet_base + "_sheet_{}.png".format(page+1)
+                           for page in range(n_pages)]
+        if all(cache.is_fresh(path, sheet_key) for path in sheet_paths):
+            n_skipped += len(sheet_paths)
+        else:
+            print("Saving", len(sheet_channels), "channels to",
+                  len(sheet_paths), channel_output, "file(s)...")
+            if channel_output == "pdf":
+                write_channel_pdf(
+                    sheet_channels, sheet_paths[0], (l_bound, r_bound))
+            else:
+                write_contact_sheets(
+                    sheet_channels, sheet_base + "_sheet_{}.png",
+                    (l_bound, r_bound), dpi=dpi)
+            for path in sheet_paths:
+                cache.record(path, sheet_key)
+
     # make main matplotlib plot
-    print("Making a big spaghetti plot...\r", end="")
-    plt.cla()
-    plt.clf()
-    plt.title(phase_word.title()+" Shift vs. Energy for $N_{max}$ = "+str(Nmax))
-    plt.ylabel("Phase (degrees)")
-    plt.ylim(-5, 150)
-    plt.xlim(l_bound, r_bound)
-    plt.xlabel("Energy (MeV)")
-    for energy, phase, title in to_plot:
-        plt.plot(energy, phase, label=title)
-    main_mpl_path = join(
-        png_dir,
-        phase_word+"_Nmax_"+str(Nmax)+"_"+file_suffix+suffix+".png")
-    plt.legend(loc='lower right', shadow=False, fontsize='medium')
-    plt.savefig(main_mpl_path, dpi=dpi)
-    plt.savefig(main_mpl_path.replace(".png", ".svg"))
-    plt.close()
+    main_title = (
+        phase_word.title()+" Shift vs. Energy for $N_{max}$ = "+str(Nmax))
+    main_mpl_path = main_plot_path(
+        filename, Nmax, file_suffix, suffix, output_dir)
+    main_svg_path = main_mpl_path.replace(".png", ".svg")
+    main_key = render_cache.content_hash(
+        *[a for energy, phase, _ in to_plot for a in (energy, phase)],
+        titles=[title for _, _, title in to_plot], main_title=main_title,
+        dpi=dpi, bounds=(l_bound, r_bound), max_points=max_points,
+        version=render_version)
+    if (cache.is_fresh(main_mpl_path, main_key)
+            and cache.is_fresh(main_svg_path, main_key)):
+        n_skipped += 2
+    else:
+        print("Making a big spaghetti plot...\r", end="")
+        import matplotlib.pyplot as plt
+        plt.cla()
+        plt.clf()
+        plt.title(main_title)
+        plt.ylabel("Phase (degrees)")
+        plt.ylim(-5, 150)
+        plt.xlim(l_bound, r_bound)
+        plt.xlabel("Energy (MeV)")
+        n_before, n_after = 0, 0
+        for energy, phase, title in to_plot:
+            n_before += len(energy)
+            if max_points is not None:
+                energy, phase = decimate(energy, phase, max_points)
+            n_after += len(energy)
+            plt.plot(energy, phase, label=title)
+        plt.legend(loc='lower right', shadow=False, fontsize='medium')
+        start = time.perf_counter()
+        plt.savefig(main_mpl_path, dpi=dpi)
+        plt.savefig(main_svg_path)
+        plt.close()
+        if n_after < n_before:
+            # absolute numbers: the saving needs an undecimated plot too,
+            # which is what benchmark_decimation measures
+            print("Decimated spaghetti plot from {} to {} points ({:.0f}% "
+                  "fewer). Writing it took {:.2f} s and the svg is {:.1f} kB "
+                  "(python resonance_plotter.py --benchmark measures the "
+                  "time and size saved)".format(
+                      n_before, n_after, 100 * (1 - n_after / n_before),
+                      time.perf_counter() - start,
+                      os.path.getsize(main_svg_path) / 1e3))
+        cache.record(main_mpl_path, main_key)
+        cache.record(main_svg_path, main_key)
 
     # make main xmgrace file
     main_grace_path = join(
         grace_dir,
         phase_word+"_plot_Nmax_"+str(Nmax)+"_"+file_suffix+suffix+".agr")
-    with open(main_grace_path, "w+") as grace_file:
-        grace_file.write(main_xmgrace_string)
+    main_xmgrace_string = "".join(main_xmgrace_parts)
+    main_grace_key = render_cache.content_hash(text=main_xmgrace_string)
+    if cache.is_fresh(main_grace_path, main_grace_key):
+        n_skipped += 1
+    else:
+        with open(main_grace_path, "w+") as grace_file:
+            grace_file.write(main_xmgrace_string)
+        cache.record(main_grace_path, main_grace_key)
+    cache.save()
+    if n_skipped > 0:
+        print("Skipped", n_skipped, "outputs that were already up to date")
 
     print("Done plotting! Saved main plot(s) to:")
     print(main_mpl_path)
-    print(main_mpl_path.replace(".png", ".svg"))
+    print(main_svg_path)
     print(main_grace_path)
 
+    profiler.count(channels=len(all_channels), rendered=len(render_jobs),
+                   skipped=n_skipped)
     # return paths to csv files of channels we plotted
     return csv_paths
 
 
+def benchmark(n_channels=200, n_points=500, dpi=dpi):
+    """
+    Time channel rendering, in channels per second, for a new figure per
+    channel (the old way) vs. reusing one ``ChannelRenderer``.
+
+    Uses fake arctan-shaped channels, saved to a temporary directory.
+
+    n_channels:
+        int, how many channel plots to make with each method
+
+    n_points:
+        int, number of energy points per channel
+
+    dpi:
+        resolution of the images
+    """
+    import matplotlib.pyplot as plt
+    energies = np.linspace(0, 10, n_points)
+    phases = np.degrees(np.arctan2(0.3, 5 - energies))
+    bounds = (energies[0], energies[-1])
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # a whole new figure for every channel
+        start = time.perf_counter()
+        for i in range(n_channels):
+            fig, ax = plt.subplots()
+            ax.set_title(str(i))
+            ax.set_ylabel("Phase (degrees)")
+            ax.set_ylim(-50, 200)
+            ax.set_xlim(*bounds)
+            ax.set_xlabel("Energy (MeV)")
+            ax.plot(energies, phases)
+            fig.savefig(join(tmp_dir, "new_{}.png".format(i)), dpi=dpi)
+            plt.close(fig)
+        results["new figure"] = n_channels / (time.perf_counter() - start)
+
+        # one template figure
+        start = time.perf_counter()
+        renderer = ChannelRenderer(bounds)
+        for i in range(n_channels):
+            renderer.render(energies, phases, str(i),
+                            join(tmp_dir, "reuse_{}.png".format(i)), dpi=dpi)
+        results["reused figure"] = n_channels / (time.perf_counter() - start)
+
+    for method, rate in results.items():
+        print("{:>15}: {:8.2f} channels/s".format(method, rate))
+    return results
+
+
+def benchmark_decimation(n_channels=20, n_points=100000, max_points=1000):
+    """
+    Compare saving a spaghetti plot (png + svg) with and without
+    ``decimate``, reporting the time and svg size saved.
+
+    Uses fake arctan-shaped channels, saved to a temporary directory.
+
+    n_channels:
+        int, number of curves on the plot
+
+    n_points:
+        int, number of energy points per curve
+
+    max_points:
+        int, points per curve after decimation
+    """
+    import matplotlib.pyplot as plt
+    energies = np.linspace(0, 10, n_points)
+    # a small ripple on top, like coupled channels often have, so matplotlib's
+    # own path simplification can't throw away most of the points for us
+    curves = [np.degrees(np.arctan2(0.1 + 0.05 * i, 1 + 0.4 * i - energies))
+              + np.sin(25 * energies + i) for i in range(n_channels)]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # warm up (font cache etc.) so the first timing isn't penalized
+        fig, _ = plt.subplots()
+        fig.savefig(join(tmp_dir, "warm_up.png"), dpi=dpi)
+        plt.close(fig)
+        for label, n_keep in [("full", None), ("decimated", max_points)]:
+            start = time.perf_counter()
+            fig, ax = plt.subplots()
+            for phases in curves:
+                e, p = energies, phases
+                if n_keep is not None:
+                    e, p = decimate(e, p, n_keep)
+                ax.plot(e, p)
+            path = join(tmp_dir, label)
+            fig.savefig(path + ".png", dpi=dpi)
+            fig.savefig(path + ".svg")
+            plt.close(fig)
+            results[label] = (time.perf_counter() - start,
+                              os.path.getsize(path + ".svg"))
+    for label, (seconds, size) in results.items():
+        print("{:>10}: {:6.2f} s, svg {:9.1f} kB".format(
+            label, seconds, size / 1e3))
+    (t_full, s_full), (t_dec, s_dec) = results["full"], results["decimated"]
+    print("saved {:.2f} s and {:.1f} kB ({:.0f}% of the svg)".format(
+        t_full - t_dec, (s_full - s_dec) / 1e3, 100 * (1 - s_dec / s_full)))
+    return results
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("Resonance Plotter")
     parser.add_argument("-f", nargs='?', const=None, help="filepath", type=str)
+    parser.add_argument("--benchmark", action="store_true",
+                        help="time channel rendering and decimation")
     args = parser.parse_args()
-    if args.f is not None:
+    if args.benchmark:
+        benchmark()
+        benchmark_decimation()
+    elif args.f is not None:
         plot(args.f)
     else:
         plot(filepath, flipped=flipped, e_bounds=energy_bounds,
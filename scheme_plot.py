@@ -13,16 +13,17 @@ To open / edit that file, may I recommend `Inkscape <https://inkscape.org/>`_?
 """
 
 
-import matplotlib.pyplot as plt
+import functools
 import numpy as np
 import os
+import profiler
 import utils
 
 # general plot formatting
-plt.style.use('seaborn-white')
+style = 'seaborn-white'
 
 # we'll pick colours from this colormap
-cmap = plt.get_cmap('viridis')
+cmap = 'viridis'
 
 dpi = 96
 dpi_high_res = 900
@@ -36,6 +37,18 @@ min_x = 0
 max_x = 10
 
 
+@functools.lru_cache(maxsize=None)
+def _pyplot():
+    """
+    Import pyplot and set our plot style, the first time we plot
+    (matplotlib is slow to import, and not every script that imports
+    this module makes plots)
+    """
+    import matplotlib.pyplot as plt
+    plt.style.use(style)
+    return plt
+
+
 def linewidth_from_data_units(linewidth, axis, reference='y'):
     """
     Convert a linewidth in data units to linewidth in points.
@@ -58,7 +71,8 @@ def linewidth_from_data_units(linewidth, axis, reference='y'):
     elif reference == 'y':
         length = fig.bbox_inches.height * axis.get_position().height
         value_range = np.diff(axis.get_ylim())
-    # Convert length to points
+    # Convert length to points (and the 1-element range to a plain float)
+    value_range = float(value_range[0])
     length *= 72
     # Scale linewidth to value range
     return linewidth * (length / value_range)
@@ -66,7 +80,7 @@ def linewidth_from_data_units(linewidth, axis, reference='y'):
 
 def plot_levels(energies, widths, channel_titles, main_title,
                 min_y, max_y, ax=None, y_label="Energy ($MeV$)",
-                colors=None):
+                colors=None, energy_cis=None, width_cis=None):
     """
     Makes a plot of a single level scheme.
 
@@ -77,7 +91,8 @@ def plot_levels(energies, widths, channel_titles, main_title,
         list of floats, widths to plot
 
     channel_titles:
-        list of strings, text to be placed beside levels
+        list of ``utils.ChannelKey``, channels to label levels with
+        (or strings, see ``utils.plot_title_2``)
 
     main_title:
         main plot title, usually something like 2\\hbar\\Omega
@@ -96,14 +111,31 @@ def plot_levels(energies, widths, channel_titles, main_title,
     colors:
         colors for each level's width, in any matplotlib-compatible format
 
+    energy_cis:
+        optional list of (low, high) confidence intervals on each energy,
+        (e.g. from ``fitter.bootstrap_channels``), drawn as error bars.
+        Use None for levels without one.
+
+    width_cis:
+        optional list of (low, high) confidence intervals on each width,
+        drawn as a faint band around the width bar. None entries are skipped.
+
     """
+    plt = _pyplot()
+    from matplotlib.collections import LineCollection
+
     # set up plot
     if ax is None:
         _, ax = plt.subplots(figsize=(x_size, y_size), dpi=dpi)
 
+    if energy_cis is None:
+        energy_cis = [None] * len(energies)
+    if width_cis is None:
+        width_cis = [None] * len(energies)
+
     # get colors for spectra if they're not given
     if colors is None:
-        colors = cmap(np.linspace(0, 1, len(energies)))
+        colors = plt.get_cmap(cmap)(np.linspace(0, 1, len(energies)))
 
     # Add titles
     ax.set_title(
@@ -130,50 +162,115 @@ def plot_levels(energies, widths, channel_titles, main_title,
     idx = list(reversed(np.argsort(energies)))
     energies = energies[idx]
     widths = widths[idx]
+    energy_cis = [energy_cis[i] for i in idx]
+    width_cis = [width_cis[i] for i in idx]
     e_titles = [x for i, x in sorted(zip(idx, e_titles))]
     channel_titles = [x for i, x in sorted(zip(idx, channel_titles))]
 
+    # x value of the middle of each level's width bar
+    x_mids = np.array(x[:len(energies)]) + x_inc / 2
+    # width bars are (almost) as wide as a column, same for every level
+    x_width = 0.9*linewidth_from_data_units(x_inc, ax, reference="x")
+
+    # figure out which widths will fit on the plot
+    tops = energies + widths / 2
+    btms = energies - widths / 2
+    itll_fit = (tops < max_y) & (btms > min_y)
+    bound = energies < 0
+    resonance = ~bound & itll_fit
+    too_wide = ~bound & ~itll_fit
+
+    # collect line segments for every level, then draw each kind at once
+    # a skinny line for each energy value (bound states are just this line)
+    levels = [[(x[0], e), (x[-1], e)] for e in energies]
+    ax.add_collection(LineCollection(
+        levels, colors='k', linewidths=1, capstyle="butt"))
+    # faint bars out to the upper end of the width intervals
+    ci_bars, ci_colors = [], []
+    for i in np.flatnonzero(resonance):
+        if width_cis[i] is not None:
+            w_hi = max(width_cis[i])
+            ci_bars.append([(x_mids[i], energies[i] + w_hi / 2),
+                            (x_mids[i], energies[i] - w_hi / 2)])
+            ci_colors.append(colors[i])
+    if ci_bars:
+        ax.add_collection(LineCollection(
+            ci_bars, colors=ci_colors, linewidths=x_width, alpha=0.25,
+            capstyle="butt"))
+    # typical resonances where the width bars will fit
+    res_idx = np.flatnonzero(resonance)
+    if len(res_idx) > 0:
+        bars = [[(x_mids[i], tops[i]), (x_mids[i], btms[i])]
+                for i in res_idx]
+        ax.add_collection(LineCollection(
+            bars, colors=[colors[i] for i in res_idx], linewidths=x_width,
+            alpha=0.7, capstyle="butt"))
+    # if width is too huge to put on the plot, make it a red line
+    if too_wide.any():
+        ax.add_collection(LineCollection(
+            [levels[i] for i in np.flatnonzero(too_wide)], colors="red",
+            linewidths=5, alpha=0.5, capstyle="butt"))
+
+    # collections don't rescale the axes by themselves, plot() lines do
+    ax.autoscale_view()
+
+    # error bars on the resonance energies, all in one go
+    ci_idx = [i for i in range(len(energies)) if energy_cis[i] is not None]
+    if ci_idx:
+        ci_lo = np.array([energy_cis[i][0] for i in ci_idx])
+        ci_hi = np.array([energy_cis[i][1] for i in ci_idx])
+        ax.errorbar(x_mids[ci_idx] + x_inc / 4, energies[ci_idx],
+                    yerr=[energies[ci_idx] - ci_lo, ci_hi - energies[ci_idx]],
+                    fmt='none', ecolor='k', elinewidth=1, capsize=2)
+
+    # text for energy values, state info (J, pi, T, in the form J^p T)
+    # and widths, sharing one set of text properties
+    text_x, text_y, text_s, text_c = [], [], [], []
     for i in range(len(energies)):
-        # make an initial skinny plot for each energy value
-        ax.plot(x, [energies[i]]*len(x),
-                marker='', color='k', linewidth=1, alpha=1,
-                solid_capstyle="butt")
-
-        # figure out if this energy's width will fit on the plot
-        top = energies[i] + widths[i] / 2
-        btm = energies[i] - widths[i] / 2
-        itll_fit = top < max_y and btm > min_y
-
-        # x value of the middle of this point
-        x_mid = x[i] + x_inc / 2
-
-        if energies[i] < 0:  # bound state
-            ax.plot(x, [energies[i]]*len(x), marker='', color="black",
-                    linewidth=1, alpha=1, solid_capstyle="butt")
-        elif itll_fit:  # typical resonance where the width bars will fit
-            x_width = 0.9*linewidth_from_data_units(x_inc, ax, reference="x")
-            ax.plot([x_mid, x_mid], [top, btm], marker='', color=colors[i],
-                    linewidth=x_width, alpha=0.7, solid_capstyle='butt')
-        else:  # if width is too huge to put on the plot, make it a red line
-            ax.plot(x, [energies[i]]*len(x), marker='', color="red",
-                    linewidth=5, alpha=0.5, solid_capstyle='butt')
-        # energy value title
-        ax.text(-0.5, energies[i], "{:.2f}".format(float(e_titles[i])),
-                horizontalalignment='center', size='small', color='black',
-                verticalalignment='center')
-        # state info (J, pi, T, in the form J^p T) title
-        plot_title = utils.plot_title_2(channel_titles[i])
-        ax.text(10.5, energies[i], plot_title,
-                horizontalalignment='center', size='small', color='black',
-                verticalalignment='center')
-        # width title
+        text_x += [-0.5, 10.5]
+        text_y += [energies[i], energies[i]]
+        text_s += ["{:.2f}".format(float(e_titles[i])),
+                   utils.channel_label(channel_titles[i])]
+        text_c += ["black", "black"]
         if widths[i] != 0:
-            ax.text(x_mid, energies[i], "{:.2f}".format(float(widths[i])),
-                    horizontalalignment='center', size='small', color='cyan',
-                    verticalalignment='center')
+            text_x.append(x_mids[i])
+            text_y.append(energies[i])
+            text_s.append("{:.2f}".format(float(widths[i])))
+            text_c.append("cyan")
+    add_texts(ax, text_x, text_y, text_s, text_c)
+
+
+def add_texts(ax, xs, ys, strings, colors):
+    """
+    Add many small, centred text labels to an axis at once,
+    all sharing one ``FontProperties`` object.
+
+    ax:
+        axis object to put the text on
+
+    xs, ys:
+        lists of floats, positions in data units
+
+    strings:
+        list of strings, the text
+
+    colors:
+        list of colors, one per string
+    """
+    from matplotlib.font_manager import FontProperties
+    from matplotlib.text import Text
+    font = FontProperties(size='small')
+    for x, y, string, color in zip(xs, ys, strings, colors):
+        ax.add_artist(Text(
+            x, y, string, color=color, fontproperties=font,
+            horizontalalignment='center', verticalalignment='center'))
 
+
+@profiler.timed("scheme_plot.plot_multi_levels")
 def plot_multi_levels(energies_list, widths_list, channel_title_list,
-                      main_title_list):
+                      main_title_list, energy_ci_list=None,
+                      width_ci_list=None, save_dpi=dpi_high_res,
+                      save_dir="level_schemes", tracks=None):
     """
     Make plots of many different schemes, stiched together into one figure.
 
@@ -184,16 +281,41 @@ def plot_multi_levels(energies_list, widths_list, channel_title_list,
         list of list of floats, widths of each channel on each plot
 
     channel_title_list:
-        list of list of strings, titles of each channel on each plot
+        list of list of ``utils.ChannelKey`` (or strings),
+        channels on each plot
 
     main_title_list:
         list of strings, main titles of each plot
+
+    energy_ci_list, width_ci_list:
+        optional, list of lists of (low, high) confidence intervals
+        (or None) for each channel on each plot. See ``plot_levels``.
+
+    save_dpi:
+        resolution of the saved png, e.g. ``utils.tier_dpi("preview")``
+        for a quick look
+
+    save_dir:
+        string, directory to save the plot in
+
+    tracks:
+        optional, list of tracks (the same state on different plots),
+        each a list of (plot index, energy) tuples, e.g. from
+        ``tracker.connectors``. Levels in a track are joined by dashed
+        lines between neighbouring plots.
     """
     n_spectra = len(energies_list)
+    profiler.count(spectra=n_spectra,
+                   levels=sum(len(energies) for energies in energies_list))
+    if energy_ci_list is None:
+        energy_ci_list = [None] * n_spectra
+    if width_ci_list is None:
+        width_ci_list = [None] * n_spectra
     n_lines = max([len(e) for e in energies_list])
 
     # pick colors for each line
-    colours = cmap(np.linspace(0, 1, n_lines))
+    plt = _pyplot()
+    colours = plt.get_cmap(cmap)(np.linspace(0, 1, n_lines))
 
     # make main figure
     _, axes = plt.subplots(
@@ -210,10 +332,12 @@ def plot_multi_levels(energies_list, widths_list, channel_title_list,
     max_y = max_energy + factor * abs(max_energy-min_energy)
     min_y = min_energy - factor * abs(max_energy-min_energy)
     # plot each individual spectrum
-    for ax, e, w, ct, mt in zip(axes, energies_list, widths_list,
-                                channel_title_list, main_title_list):
+    for ax, e, w, ct, mt, e_ci, w_ci in zip(
+            axes, energies_list, widths_list, channel_title_list,
+            main_title_list, energy_ci_list, width_ci_list):
         plot_levels(
-            e, w, ct, mt, min_y, max_y, ax=ax, y_label="", colors=colours)
+            e, w, ct, mt, min_y, max_y, ax=ax, y_label="", colors=colours,
+            energy_cis=e_ci, width_cis=w_ci)
 
     # set x limits
     plt.xlim(min_x-1, max_x+1)
@@ -223,10 +347,23 @@ def plot_multi_levels(energies_list, widths_list, channel_title_list,
     # put title only on the first one
     axes[0].set_ylabel("Energy ($MeV$)")
 
+    # join levels of the same state on neighbouring plots
+    if tracks is not None:
+        from matplotlib.patches import ConnectionPatch
+        fig = axes[0].figure
+        for this_track in tracks:
+            for (i, e_i), (j, e_j) in zip(this_track, this_track[1:]):
+                if j != i + 1:
+                    continue
+                fig.add_artist(ConnectionPatch(
+                    xyA=(max_x, e_i), coordsA=axes[i].transData,
+                    xyB=(min_x, e_j), coordsB=axes[j].transData,
+                    color="grey", linestyle="--", linewidth=0.8))
+
     # then save the plot
-    if not os.path.exists("level_schemes"):
-        os.mkdir("level_schemes")
-    fig_path = os.path.join("level_schemes", "level_scheme")
-    plt.savefig(fig_path+".png", dpi=dpi_high_res)
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    fig_path = os.path.join(save_dir, "level_scheme")
+    plt.savefig(fig_path+".png", dpi=save_dpi)
     plt.savefig(fig_path+".svg")
     print("Saved level scheme plot as", fig_path+".png")
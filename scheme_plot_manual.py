@@ -21,13 +21,26 @@ from matplotlib.ticker import MultipleLocator
 
 import utils
 
+# render text with LaTeX? That needs TeX on the machine and runs a LaTeX
+# subprocess for every new label (matplotlib keeps the output in
+# tex.cache in its cache directory, so repeated labels skip TeX).
+# If False, we use matplotlib's own mathtext with the STIX fonts, which look
+# like Times and ship with matplotlib, so this works on any node, and fast.
+use_tex = False
+
+# serif font for titles and labels
+font_name = "Times New Roman" if use_tex else "STIXGeneral"
+
 mpl.rcParams['lines.linewidth'] = '10'
 mpl.rcParams['axes.linewidth'] = '10'
 mpl.rcParams['lines.dashed_pattern'] = (7, 2)
 mpl.rcParams['lines.dotted_pattern'] = (1, 1.65)
-plt.rcParams["font.family"] = "Times New Roman"
+plt.rcParams["font.family"] = font_name
 plt.rcParams["font.weight"] = "bold"
-plt.rc('text', usetex=True)
+if use_tex:
+    plt.rc('text', usetex=True)
+else:
+    plt.rc('mathtext', fontset='stix')
 plt.rc('font', size=16)
 # general plot formatting
 plt.style.use('seaborn-white')
@@ -84,6 +97,27 @@ main_title_list = [
     "$\\textrm{Experiment}$",
 ]
 
+def tex_label(label):
+    """
+    Make a LaTeX label work with whichever text renderer we're using.
+
+    Mathtext doesn't know ``\\textrm``, so when ``use_tex`` is False
+    we switch it to ``\\mathrm`` (keeping spaces). Fractions, superscripts
+    etc., e.g. from ``utils.plot_title_2``, work the same in both.
+
+    label:
+        string, possibly containing $...$ math
+    """
+    if use_tex:
+        return label
+    while "\\textrm{" in label:
+        start = label.index("\\textrm{")
+        end = label.index("}", start)
+        text = label[start+len("\\textrm{"):end].replace(" ", "\\ ")
+        label = label[:start] + "\\mathrm{" + text + "}" + label[end+1:]
+    return label
+
+
 def linewidth_from_data_units(linewidth, axis, reference='y'):
     """
     Convert a linewidth in data units to linewidth in points.
@@ -106,7 +140,8 @@ def linewidth_from_data_units(linewidth, axis, reference='y'):
     elif reference == 'y':
         length = fig.bbox_inches.height * axis.get_position().height
         value_range = np.diff(axis.get_ylim())
-    # Convert length to points
+    # Convert length to points (and the 1-element range to a plain float)
+    value_range = float(value_range[0])
     length *= 72
     # Scale linewidth to value range
     return linewidth * (length / value_range)
@@ -153,10 +188,10 @@ def plot_levels(energies, widths, channel_titles, main_title,
     for axis in ['top','bottom','left','right']:
         ax.spines[axis].set_linewidth(3)
     ax.set_title(
-        "{}".format(main_title), loc='center', pad=15,
-        fontsize=axis_label_size, fontweight=20, color='black', fontname='Times New Roman')
+        tex_label(main_title), loc='center', pad=15,
+        fontsize=axis_label_size, fontweight=20, color='black', fontname=font_name)
     ax.set_xlabel("")
-    ax.set_ylabel(y_label, fontsize=axis_label_size, fontname='Times New Roman')
+    ax.set_ylabel(tex_label(y_label), fontsize=axis_label_size, fontname=font_name)
     ax.set_xticks([])
     ax.yaxis.set_minor_locator(MultipleLocator(0.25))
     ax.yaxis.set_major_locator(MultipleLocator(2))
@@ -251,7 +286,8 @@ def plot_multi_levels(energies_list, widths_list, channel_title_list,
     plt.ylim(-4.5, 5)
 
     # put title only on the first one
-    axes[0].set_ylabel("$E$ $\\textrm{[MeV]}$", fontsize=axis_label_size)
+    axes[0].set_ylabel(tex_label("$E$ $\\textrm{[MeV]}$"),
+                       fontsize=axis_label_size)
 
     # then save the plot
     if not os.path.exists("level_schemes"):
@@ -0,0 +1,257 @@
+"""
+Process a whole grid of NCSMC runs (several potentials, frequencies and
+Nmax values) in one go, without any human input.
+
+Runs are found by their file names (see ``rename_post_ncsmc.py``, bundles
+made with ``--archive`` work too). Then, for every run, on one shared pool
+of processes:
+
+1. flip the (eigen)phase shifts (in memory, nothing is written next to
+   the data)
+2. get bound states from the .out file
+3. find channels with strong resonances (``resonance_info.classify_channels``)
+4. fit each of those resonances, choosing fit windows automatically
+   (``fitter.fit_resonance``)
+
+Each run's results go in ``[output dir]/[details]/results.json``
+(details as in the renamed files, e.g. nLi8_n3lo-NN3Nlnl-srg2.0_20_Nmax6),
+and everything goes in one table, ``[output dir]/sweep_results.csv``.
+
+``python sweep.py /path/to/runs [/more/runs] [-o output_dir]
+[--only target=Li8 freq=20]``
+
+Automatic fit windows are a first look; for final numbers, check the
+interesting channels with ``process_ncsmc_output.py``.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+import zipfile
+
+import numpy as np
+
+import catalog
+import fitter
+import flipper
+import output_simplifier
+import rename_post_ncsmc
+import resonance_info
+import utils
+
+# where results go
+sweep_dir = os.path.join(utils.directory, "sweep")
+
+# processes to use, None = one per core
+n_processes = None
+
+# which kinds of files we process, and what we call them in results
+phase_kinds = {"eigenphase_shift": "eigenphase", "phase_shift": "phase"}
+out_kind = catalog.out_kind
+
+table_columns = catalog.metadata_keys + [
+    "file", "channel", "kind", "E", "width", "fit_left", "fit_right"]
+
+
+def find_runs(directories, **only):
+    """
+    Find all runs in some directories (and their subdirectories).
+
+    directories:
+        list of strings, where to look
+
+    only:
+        metadata values runs must have, e.g. target="Li8", Nmax=6
+
+    returns:
+        list of dicts, with keys ``catalog.metadata_keys``, directory, and
+        files (dict, key = kind of file e.g. "eigenphase_shift", value = path)
+        sorted by metadata
+    """
+    runs = {}
+    for root in directories:
+        for directory, _, names in os.walk(utils.abs_path(root)):
+            for name in names:
+                if name.startswith("ncsmc_") and name.endswith(".zip"):
+                    bundle = os.path.join(directory, name)
+                    with zipfile.ZipFile(bundle) as zip_file:
+                        members = zip_file.namelist()
+                    paths = [bundle + utils.bundle_separator + member
+                             for member in members]
+                    names_paths = zip(members, paths)
+                else:
+                    names_paths = [(name, os.path.join(directory, name))]
+                for file_name, path in names_paths:
+                    parsed = catalog.parse_name(file_name)
+                    if parsed is None:
+                        continue
+                    kind, metadata = parsed
+                    if any(str(metadata[key]) != str(value)
+                           for key, value in only.items()):
+                        continue
+                    key = tuple(metadata[k] for k in catalog.metadata_keys)
+                    run = runs.setdefault(key + (directory,), dict(
+                        metadata, directory=directory, files={}))
+                    run["files"][kind] = path
+    return [runs[key] for key in sorted(runs)]
+
+
+def run_details(run):
+    """Details string of a run, like in its renamed files"""
+    return rename_post_ncsmc.get_details(
+        *[str(run[key]) for key in catalog.metadata_keys])
+
+
+def fit_channels(phase_file):
+    """
+    Flip an (eigen)phase shift file (without writing the flipped file),
+    find strong resonances, and fit each of them.
+
+    phase_file:
+        string, path to a phase shift file (or ``bundle.zip::member``)
+
+    returns:
+        list of dicts with keys channel, E, width, fit_left, fit_right
+    """
+    channels, energies = flipper.flipped_channels(phase_file)
+    res_types = resonance_info.classify_channels(channels)
+    resonances = []
+    for key, phases in channels.items():
+        if res_types[key] != "strong":
+            continue
+        x = np.array(flipper.channel_energies(energies, phases))
+        try:
+            width, energy = fitter.fit_resonance(x, np.array(phases))
+        except (ValueError, np.linalg.LinAlgError):
+            continue  # can't fit this one automatically
+        resonances.append({
+            "channel": key.title, "E": float(energy), "width": float(width),
+            "fit_left": fitter.fit_window[0],
+            "fit_right": fitter.fit_window[1]})
+    return resonances
+
+
+def process_run(run, output_dir):
+    """
+    Flip, simplify, find and fit resonances for one run,
+    and save its results as JSON. Runs in a worker process.
+
+    run:
+        dict, from ``find_runs``
+
+    output_dir:
+        string, where to put results
+
+    returns:
+        dict, the results (run metadata plus bound_states, and resonances
+        for each kind of phase shift file)
+    """
+    results = {key: run[key] for key in catalog.metadata_keys}
+    results["directory"] = run["directory"]
+    results["bound_states"] = []
+    if out_kind in run["files"]:
+        # read, not simplify, so nothing is written next to the data
+        with utils.open_text(run["files"][out_kind]) as out_file:
+            _, _, _, energies, titles = output_simplifier.read_bound_states(
+                out_file.readlines())
+        results["bound_states"] = [
+            {"channel": title, "E": E} for E, title in zip(energies, titles)]
+    for kind, word in phase_kinds.items():
+        if kind in run["files"]:
+            results[word + "_resonances"] = fit_channels(run["files"][kind])
+
+    run_dir = os.path.join(output_dir, run_details(run))
+    if not os.path.exists(run_dir):
+        os.makedirs(run_dir)
+    with open(os.path.join(run_dir, "results.json"), "w") as results_file:
+        json.dump(results, results_file, indent=1)
+    return results
+
+
+def table_rows(results):
+    """Rows of the combined table for one run's results"""
+    metadata = [str(results[key]) for key in catalog.metadata_keys]
+    rows = []
+    for state in results["bound_states"]:
+        rows.append(metadata + [out_kind, state["channel"], "bound",
+                                str(state["E"]), "0", "", ""])
+    for word in phase_kinds.values():
+        for res in results.get(word + "_resonances", []):
+            rows.append(metadata + [
+                word, res["channel"], "resonance", str(res["E"]),
+                str(res["width"]), str(res["fit_left"]),
+                str(res["fit_right"])])
+    return rows
+
+
+def sweep(directories, output_dir=sweep_dir, processes=n_processes, **only):
+    """
+    Process every run in some directories, see the top of this file.
+
+    directories:
+        list of strings, where to look for runs
+
+    output_dir:
+        string, where to put results
+
+    processes:
+        int or None, number of processes (None = one per core)
+
+    only:
+        metadata values runs must have, e.g. target="Li8", freq="20"
+
+    returns:
+        list of dicts, results of each run (see ``process_run``)
+    """
+    runs = find_runs(directories, **only)
+    print("found", len(runs), "runs")
+    if not runs:
+        return []
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    all_results = []
+
+    def collect(run, get_results):
+        # one broken run shouldn't stop the whole sweep
+        try:
+            all_results.append(get_results())
+            print("done", run_details(run))
+        except Exception as error:
+            print("failed", run_details(run), "--", repr(error))
+
+    if processes == 1:
+        for run in runs:
+            collect(run, lambda: process_run(run, output_dir))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = {pool.submit(process_run, run, output_dir): run
+                       for run in runs}
+            for future in as_completed(futures):
+                collect(futures[future], future.result)
+    all_results.sort(key=lambda results: [
+        str(results[key]) for key in catalog.metadata_keys])
+
+    table_path = os.path.join(output_dir, "sweep_results.csv")
+    with open(table_path, "w") as table:
+        table.write(",".join(table_columns) + "\n")
+        for results in all_results:
+            for row in table_rows(results):
+                table.write(",".join(row) + "\n")
+    print("Saved results of", len(all_results), "runs to", table_path)
+    return all_results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process a grid of runs")
+    parser.add_argument("directories", nargs="+",
+                        help="directories to look for runs in")
+    parser.add_argument("-o", "--output", type=str, default=sweep_dir,
+                        help="directory to put results in")
+    parser.add_argument("-p", "--processes", type=int, default=n_processes,
+                        help="number of processes (default: one per core)")
+    parser.add_argument("--only", nargs="*", default=[],
+                        help="key=value pairs runs must match, e.g. freq=20")
+    args = parser.parse_args()
+    only = dict(pair.split("=", 1) for pair in args.only)
+    sweep(args.directories, args.output, args.processes, **only)
@@ -0,0 +1,430 @@
+"""
+Follow resonances and bound states from one Nmax to the next, i.e. work out
+that "this 3/2- resonance at Nmax 6 is that one at Nmax 8", instead of
+matching them by eye (column numbers in resonances_eigenphase_Nmax_*.csv
+change between Nmax, so they're no help).
+
+For each pair of neighbouring Nmax values, we compare every level at one
+Nmax with every level at the next, all at once, using:
+
+- J, parity and T, which have to be the same
+- how different their (flipped) eigenphase curves are, on a common
+  energy grid (RMS difference, in units of ``phase_scale``)
+- how far apart their energies are (in units of ``energy_scale``)
+- a penalty if a resonance becomes a bound state or vice versa
+
+then match the closest pairs first. Chains of matches are "tracks", which
+show how each state converges with Nmax. They can be saved as a csv file,
+and drawn as lines joining the levels of a level scheme
+(``scheme_plot.plot_multi_levels(..., tracks=...)``, or
+``connect_levels = True`` in ``process_ncsmc_output.py``).
+
+Run it with (flipped) eigenphase files and .out files, in Nmax order::
+
+    python tracker.py -n 4 6 8 -e eigen_4.agr eigen_6.agr eigen_8.agr \
+-o ncsmc_4.out ncsmc_6.out ncsmc_8.out
+
+"""
+import argparse
+import os
+
+import numpy as np
+
+import fitter
+import flipper
+import output_simplifier
+import resonance_info
+import utils
+
+# channels we follow, see resonance_info.classify_channels
+track_types = ["strong", "possible"]
+
+# how much each difference counts towards the distance between two levels
+phase_scale = 30.0  # degrees, RMS difference between eigenphase curves
+energy_scale = 1.0  # MeV, difference between energies
+kind_change_cost = 0.5  # a resonance at one Nmax, bound at the next
+
+# levels further apart than this are never matched
+max_distance = 2.0
+
+# number of points in the common energy grid for comparing curves
+n_grid = 200
+
+# where ``python tracker.py`` saves tracks
+tracks_file = "tracks.csv"
+
+track_columns = ["track", "2J", "parity", "2T", "Nmax", "kind", "column",
+                 "E", "width", "distance", "change"]
+
+
+def channel_curves(flipped_file):
+    """
+    Eigenphase curves of each channel in a flipped file.
+
+    flipped_file:
+        string, path to a flipped (eigen)phase shift file
+
+    returns:
+        dict, key = ``utils.ChannelKey``, value = (energies, phases) tuple
+        of 1D arrays, the same length
+    """
+    channels, energies = flipper.separate_into_channels(flipped_file)
+    energies = np.array(energies)
+    curves = {}
+    for key, phases in channels.items():
+        curves[key] = (flipper.channel_energies(energies, phases),
+                       np.array(phases))
+    return curves
+
+
+def resonance_levels(flipped_file, res_types=track_types):
+    """
+    Levels for the channels of a flipped eigenphase file with resonances,
+    with energies and widths from ``fitter.fit_resonance``
+    (NaN if the fit fails).
+
+    flipped_file:
+        string, path to a flipped eigenphase shift file
+
+    res_types:
+        list of strings, types of channels to take,
+        see ``resonance_info.classify_channels``
+
+    returns:
+        list of dicts, with keys key (``utils.ChannelKey``), kind
+        ("resonance"), E, width, and curve ((energies, phases) tuple)
+    """
+    curves = channel_curves(flipped_file)
+    res_info = resonance_info.classify_channels(
+        {key: phases for key, (_, phases) in curves.items()})
+    levels = []
+    for key, (energies, phases) in curves.items():
+        if res_info[key] not in res_types:
+            continue
+        try:
+            width, energy = fitter.fit_resonance(energies, phases)
+        except (ValueError, np.linalg.LinAlgError):
+            width, energy = np.nan, np.nan
+        levels.append({"key": key, "kind": "resonance", "E": float(energy),
+                       "width": float(width), "curve": (energies, phases)})
+    return levels
+
+
+def bound_levels(out_file):
+    """
+    Levels for the bound states in a .out file, see ``output_simplifier``
+
+    out_file:
+        string, path to a NCSMC .out file
+
+    returns:
+        list of dicts, same as ``resonance_levels`` (curve is None)
+    """
+    energies, titles = output_simplifier.simplify(out_file)
+    return [{"key": utils.ChannelKey.from_state(title), "kind": "bound",
+             "E": float(E), "width": 0.0, "curve": None}
+            for E, title in zip(energies, titles)]
+
+
+def scheme_levels(energies, widths, channels, flipped_file=None):
+    """
+    Levels for the states of one level scheme, e.g. from
+    ``process_ncsmc_output.add_resonances``
+
+    energies, widths:
+        lists of floats, like for ``scheme_plot.plot_levels``
+
+    channels:
+        list of ``utils.ChannelKey``; resonances have a column,
+        bound states don't
+
+    flipped_file:
+        string, path to the flipped eigenphase file, to compare curves of
+        resonances too. Or None to just use energies.
+
+    returns:
+        list of dicts, same as ``resonance_levels``
+    """
+    curves = {} if flipped_file is None else channel_curves(flipped_file)
+    levels = []
+    for E, width, key in zip(energies, widths, channels):
+        kind = "bound" if key.column is None else "resonance"
+        levels.append({"key": key, "kind": kind, "E": float(E),
+                       "width": float(width), "curve": curves.get(key)})
+    return levels
+
+
+def curve_matrix(levels, grid):
+    """
+    Curves of some levels on an energy grid, as one 2D array.
+
+    levels:
+        list of dicts, see ``resonance_levels``
+
+    grid:
+        1D array of floats, energies
+
+    returns:
+        2D array, one row per level, NaN outside each curve's energy range
+        (and all NaN for levels without a curve)
+    """
+    matrix = np.full((len(levels), len(grid)), np.nan)
+    for i, level in enumerate(levels):
+        if level["curve"] is None:
+            continue
+        energies, phases = level["curve"]
+        inside = (grid >= energies[0]) & (grid <= energies[-1])
+        matrix[i, inside] = np.interp(grid[inside], energies, phases)
+    return matrix
+
+
+def distance_matrix(levels_a, levels_b):
+    """
+    Distance between every level in levels_a and every one in levels_b,
+    see the top of this file. Levels with different J, parity or T,
+    or with nothing to compare, are infinitely far apart.
+
+    levels_a, levels_b:
+        lists of dicts, see ``resonance_levels``
+
+    returns:
+        2D array, shape (len(levels_a), len(levels_b))
+    """
+    # J, parity and T as group numbers, so we can compare them all at once
+    groups = {}
+    group_a = np.array([groups.setdefault(level["key"].with_column(None),
+                                          len(groups))
+                        for level in levels_a], dtype=int)
+    group_b = np.array([groups.setdefault(level["key"].with_column(None),
+                                          len(groups))
+                        for level in levels_b], dtype=int)
+
+    # curves on one grid covering all of them
+    curve_ends = [level["curve"][0][[0, -1]] for level in levels_a + levels_b
+                  if level["curve"] is not None]
+    if curve_ends:
+        curve_ends = np.array(curve_ends)
+        grid = np.linspace(curve_ends[:, 0].min(), curve_ends[:, 1].max(),
+                           n_grid)
+        curves_a = curve_matrix(levels_a, grid)
+        curves_b = curve_matrix(levels_b, grid)
+        # RMS difference, over the points where both curves exist
+        diffs = curves_a[:, None, :] - curves_b[None, :, :]
+        overlap = ~np.isnan(diffs)
+        n_overlap = overlap.sum(axis=-1)
+        squares = np.where(overlap, diffs, 0) ** 2
+        rms = np.sqrt(np.divide(
+            squares.sum(axis=-1), n_overlap,
+            out=np.full(n_overlap.shape, np.nan), where=n_overlap > 0))
+        curve_term = rms / phase_scale
+    else:
+        curve_term = np.full((len(levels_a), len(levels_b)), np.nan)
+
+    energy_a = np.array([level["E"] for level in levels_a], dtype=float)
+    energy_b = np.array([level["E"] for level in levels_b], dtype=float)
+    energy_term = np.abs(energy_a[:, None] - energy_b[None, :]) / energy_scale
+
+    kind_a = np.array([level["kind"] == "bound" for level in levels_a])
+    kind_b = np.array([level["kind"] == "bound" for level in levels_b])
+    kind_term = (kind_a[:, None] != kind_b[None, :]) * kind_change_cost
+
+    # missing terms don't count, but we need at least one of them
+    known = ~np.isnan(curve_term) | ~np.isnan(energy_term)
+    distances = (np.nan_to_num(curve_term) + np.nan_to_num(energy_term)
+                 + kind_term)
+    distances[~known] = np.inf
+    distances[group_a[:, None] != group_b[None, :]] = np.inf
+    return distances
+
+
+def greedy_match(distances, max_distance=max_distance):
+    """
+    Match rows to columns of a distance matrix, closest pairs first,
+    each row and column at most once.
+
+    distances:
+        2D array, e.g. from ``distance_matrix``
+
+    max_distance:
+        float, pairs further apart than this aren't matched
+
+    returns:
+        list of (row, column) tuples
+    """
+    rows, cols = np.unravel_index(np.argsort(distances, axis=None),
+                                  distances.shape)
+    used_rows, used_cols = set(), set()
+    matches = []
+    for i, j in zip(rows, cols):
+        if not distances[i, j] <= max_distance:
+            break  # sorted, so everything after this is too far too
+        if i in used_rows or j in used_cols:
+            continue
+        used_rows.add(i)
+        used_cols.add(j)
+        matches.append((int(i), int(j)))
+    return matches
+
+
+def track(Nmax_list, levels_list):
+    """
+    Follow levels from each Nmax to the next.
+
+    Nmax_list:
+        list of Nmax values, in order
+
+    levels_list:
+        list of lists of levels (dicts, see ``resonance_levels``),
+        one list for each Nmax
+
+    returns:
+        list of tracks, dicts with keys key (``utils.ChannelKey`` of J,
+        parity and T) and points (list of dicts with keys Nmax, index
+        (of the level in its Nmax's list), key, kind, E, width, and
+        distance (from the point before, NaN for the first one))
+    """
+    tracks = []
+    previous = []  # (track number, level) for the last Nmax
+    for Nmax, levels in zip(Nmax_list, levels_list):
+        matched = {}
+        if previous and levels:
+            distances = distance_matrix([level for _, level in previous],
+                                        levels)
+            for i, j in greedy_match(distances):
+                matched[j] = (previous[i][0], distances[i, j])
+        current = []
+        for j, level in enumerate(levels):
+            if j in matched:
+                number, distance = matched[j]
+            else:
+                number, distance = len(tracks), np.nan
+                tracks.append({"key": level["key"].with_column(None),
+                               "points": []})
+            tracks[number]["points"].append({
+                "Nmax": Nmax, "index": j, "key": level["key"],
+                "kind": level["kind"], "E": level["E"],
+                "width": level["width"], "distance": float(distance)})
+            current.append((number, level))
+        previous = current
+    return tracks
+
+
+def save_tracks(tracks, csv_path):
+    """
+    Save tracks to a csv file, one row per point. change is how much the
+    energy changed since the point before, to see how well it converges.
+
+    tracks:
+        list of dicts, from ``track``
+
+    csv_path:
+        string, where to save the file
+    """
+    def text(value):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return ""
+        return str(value)
+
+    with open(csv_path, "w") as csv_file:
+        csv_file.write(",".join(track_columns) + "\n")
+        for number, this_track in enumerate(tracks):
+            key = this_track["key"]
+            last_E = np.nan
+            for point in this_track["points"]:
+                row = [number, key.J2, key.parity, key.T2, point["Nmax"],
+                       point["kind"], point["key"].column, point["E"],
+                       point["width"], point["distance"],
+                       point["E"] - last_E]
+                csv_file.write(",".join(text(value) for value in row) + "\n")
+                last_E = point["E"]
+    print("Saved", len(tracks), "tracks to", csv_path)
+
+
+def print_tracks(tracks):
+    """Print each track that spans more than one Nmax, and its energies"""
+    for number, this_track in enumerate(tracks):
+        points = this_track["points"]
+        if len(points) < 2:
+            continue
+        energies = " -> ".join("{:.3f}".format(point["E"])
+                               for point in points)
+        print("track {} ({}), Nmax {}-{}: E = {} MeV".format(
+            number, this_track["key"].title, points[0]["Nmax"],
+            points[-1]["Nmax"], energies))
+
+
+def connectors(tracks, Nmax_list):
+    """
+    Tracks in the form ``scheme_plot.plot_multi_levels`` wants them,
+    for a level scheme with one plot per Nmax in Nmax_list.
+
+    tracks:
+        list of dicts, from ``track``
+
+    Nmax_list:
+        list of Nmax values, in the order of the plots
+
+    returns:
+        list of lists of (plot index, energy) tuples
+    """
+    lines = []
+    for this_track in tracks:
+        line = [(Nmax_list.index(point["Nmax"]), point["E"])
+                for point in this_track["points"]
+                if not np.isnan(point["E"])]
+        if len(line) > 1:
+            lines.append(line)
+    return lines
+
+
+def track_files(Nmax_list, eigenphase_files, out_files, csv_path=tracks_file):
+    """
+    Track resonances and bound states through files for several Nmax
+    values, and save the tracks.
+
+    Nmax_list:
+        list of Nmax values, in order
+
+    eigenphase_files:
+        list of strings, paths to eigenphase shift files, one per Nmax.
+        Files that don't end in _flipped are flipped first.
+
+    out_files:
+        list of strings, paths to .out files, one per Nmax
+
+    csv_path:
+        string, where to save the tracks
+
+    returns:
+        list of tracks, see ``track``
+    """
+    levels_list = []
+    for eigenphase_file, out_file in zip(eigenphase_files, out_files):
+        if not eigenphase_file.endswith("_flipped"):
+            eigenphase_file = flipper.flip(eigenphase_file, verbose=False)
+        levels_list.append(resonance_levels(eigenphase_file)
+                           + bound_levels(out_file))
+    tracks = track(Nmax_list, levels_list)
+    print_tracks(tracks)
+    directory = os.path.dirname(csv_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    save_tracks(tracks, csv_path)
+    return tracks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Track states across Nmax")
+    parser.add_argument("-n", "--nmax", nargs="+", type=int, required=True,
+                        help="Nmax values, in order")
+    parser.add_argument("-e", "--eigenphase", nargs="+", required=True,
+                        help="eigenphase shift files, one per Nmax")
+    parser.add_argument("-o", "--out", nargs="+", required=True,
+                        help=".out files, one per Nmax")
+    parser.add_argument("--csv", default=tracks_file,
+                        help="where to save the tracks")
+    args = parser.parse_args()
+    if not len(args.nmax) == len(args.eigenphase) == len(args.out):
+        parser.error("need one eigenphase file and one .out file per Nmax")
+    track_files(args.nmax, [utils.abs_path(f) for f in args.eigenphase],
+                [utils.abs_path(f) for f in args.out], args.csv)
@@ -2,17 +2,82 @@
 Things that are useful but didn't really belong anywhere else.
 """
 
+import contextlib
+import functools
+import io
 import os
+import re
 
-# get directory where we'll store info about resonances
+# config.txt has the directory where we'll store info about resonances.
+# It's only read when ``directory`` / ``output_dir`` are first used,
+# see ``__getattr__`` below
 conf_file = os.path.join(os.path.dirname(__file__), "config.txt")
-if os.path.exists(conf_file):
-    with open(conf_file, 'r') as conf:
-        directory = conf.read()
-else:
-    # default to the directory storing python files
-    directory = os.path.dirname(__file__)
-output_dir = os.path.join(directory, "resonances_Nmax_{}")
+
+
+def __getattr__(name):
+    """
+    Work out ``directory`` and ``output_dir`` (from config.txt) the first
+    time they're used, so scripts that don't need them start faster.
+    Setting them (e.g. ``utils.output_dir = ...``) works as usual.
+    """
+    if name == "directory":
+        if os.path.exists(conf_file):
+            with open(conf_file, 'r') as conf:
+                value = conf.read()
+        else:
+            # default to the directory storing python files
+            value = os.path.dirname(__file__)
+    elif name == "output_dir":
+        value = os.path.join(_config("directory"), "resonances_Nmax_{}")
+    else:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+    globals()[name] = value
+    return value
+
+
+def _config(name):
+    """Value of ``directory`` or ``output_dir``, see ``__getattr__``"""
+    if name in globals():
+        return globals()[name]
+    return __getattr__(name)
+
+
+# render tiers: "preview" is for quick looks while picking channels / fitting,
+# "final" is for plots that go into papers. Values are dots per inch.
+render_tiers = {"preview": 90, "final": 900}
+render_tier = "preview"
+
+
+def tier_dpi(tier=None):
+    """
+    Resolution (dots per inch) to use for high-quality plots in a render tier
+
+    tier:
+        string, a key of ``render_tiers``, or None to use ``render_tier``
+    """
+    if tier is None:
+        tier = render_tier
+    if tier not in render_tiers:
+        raise ValueError("Unknown render tier '{}', expected one of {}".format(
+            tier, ", ".join(render_tiers)))
+    return render_tiers[tier]
+
+
+def nmax_dir(Nmax, output_dir=None):
+    """
+    Directory for output files (plots, csvs, ...) for one Nmax value
+
+    Nmax:
+        float
+
+    output_dir:
+        string, directory to put all output in,
+        or None to use the one from config.txt (i.e. ``output_dir`` above)
+    """
+    if output_dir is None:
+        return _config("output_dir").format(Nmax)
+    return os.path.join(output_dir, "resonances_Nmax_{}".format(Nmax))
 
 
 def abs_path(path):
@@ -22,6 +87,63 @@ def abs_path(path):
     return os.path.realpath(os.path.expanduser(path))
 
 
+# separates a bundle made by ``rename_post_ncsmc.py --archive`` from a file
+# inside it, e.g. "/runs/ncsmc_nLi8_[...]_Nmax6.zip::eigenphase_shift.agr"
+bundle_separator = "::"
+
+
+def split_bundle_path(path):
+    """
+    Split a path to a file inside a bundle into (bundle, member).
+    For a normal path, returns (path, None).
+
+    path:
+        string, path to a file, or to a file in a bundle
+    """
+    if bundle_separator in path:
+        bundle, member = path.split(bundle_separator, 1)
+        return bundle, member
+    return path, None
+
+
+@contextlib.contextmanager
+def open_text(path):
+    """
+    Open a text file for reading, either a normal one or one inside a bundle
+    (read straight from the bundle, without extracting it), e.g.::
+
+        with utils.open_text("run.zip::eigenphase_shift.agr") as agr:
+            lines = agr.readlines()
+
+    path:
+        string, path to a file, or ``bundle.zip::member``
+    """
+    bundle, member = split_bundle_path(path)
+    if member is None:
+        with open(path, "r") as text_file:
+            yield text_file
+    else:
+        import zipfile  # only needed for bundles
+        with zipfile.ZipFile(bundle) as zip_file:
+            with zip_file.open(member) as raw_file:
+                yield io.TextIOWrapper(raw_file)
+
+
+def unbundled_path(path):
+    """
+    Where to write files made from this one (flipped, simplified, ...).
+    For a file inside a bundle, that's next to the bundle, with the file's
+    own name. For a normal file it's just the path.
+
+    path:
+        string, path to a file, or ``bundle.zip::member``
+    """
+    bundle, member = split_bundle_path(path)
+    if member is None:
+        return path
+    return os.path.join(os.path.dirname(bundle), member)
+
+
 def is_float(string):
     """
     Checks if a string can be cast as a float, returns boolean
@@ -86,108 +208,258 @@ def multi_strip(string, list_of_strs):
     return string
 
 
+def _half(x2):
+    """LaTeX for x2 / 2, e.g. 4 -> 2 and 3 -> \\frac{3}{2} (input: int)"""
+    if x2 % 2 == 0:
+        return str(x2 // 2)
+    return "\\frac{{{}}}{{{}}}".format(x2, 2)
+
+
+# 2J, parity and 2T in an xmgrace legend, e.g. '@    s0 legend "3\S-\N3"',
+# maybe followed by a column, like the titles from ``flipper``
+xmgrace_regex = re.compile(
+    r'"\s*(\d+)\s*(?:\\S)?\s*([+-])\s*(?:\\N)?\s*(\d+)\s*"?'
+    r'\s*(?:column\s+(\d+))?')
+
+
+class ChannelKey:
+    """
+    Which channel some phases belong to: 2J, parity ("+" or "-"), 2T,
+    and column (which column of its J pi T section in the xmgrace file,
+    starting from 1, or None for the whole section / a bound state).
+
+    Keys can't be changed, and are interned, i.e. there's only ever one
+    key for each channel, so they're quick to compare and use in dicts.
+    Make them with ``ChannelKey(J2, parity, T2, column)`` or with the
+    ``from_...`` functions, which remember everything they've parsed.
+    Titles (``title``, ``latex``, ...) are also only made once per channel.
+    """
+    __slots__ = ("J2", "parity", "T2", "column", "_texts")
+    _interned = {}
+
+    def __new__(cls, J2, parity, T2, column=None):
+        if parity in (1, "1", "+1"):
+            parity = "+"
+        elif parity in (-1, "-1"):
+            parity = "-"
+        elif parity not in ("+", "-"):
+            raise ValueError("Invalid parity value '{}'".format(parity))
+        J2, T2 = int(J2), int(T2)
+        if column is not None:
+            column = int(column)
+        values = (J2, parity, T2, column)
+        key = cls._interned.get(values)
+        if key is None:
+            key = object.__new__(cls)
+            for name, value in zip(cls.__slots__, values + ({},)):
+                object.__setattr__(key, name, value)
+            key = cls._interned.setdefault(values, key)
+        return key
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ChannelKey can't be changed")
+
+    def __delattr__(self, name):
+        raise AttributeError("ChannelKey can't be changed")
+
+    def __reduce__(self):
+        # so keys sent to other processes get interned there too
+        return ChannelKey, (self.J2, self.parity, self.T2, self.column)
+
+    def __repr__(self):
+        return "ChannelKey({}, '{}', {}, {})".format(
+            self.J2, self.parity, self.T2, self.column)
+
+    def __str__(self):
+        return self.title
+
+    def with_column(self, column):
+        """The key for one column of this channel's section (input: int)"""
+        return ChannelKey(self.J2, self.parity, self.T2, column)
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def from_xmgrace(cls, xmtitle, column=None):
+        """
+        Key from an xmgrace title, e.g. '@    s0 legend "3\\S-\\N3"'.
+        Titles from ``flipper`` (with " column [col]" at the end) work too.
+
+        column:
+            int, column number, if it's not in the title
+        """
+        match = xmgrace_regex.search(xmtitle)
+        if match is None:
+            raise ValueError("No +- parity specified... Title is " + xmtitle)
+        J2, parity, T2, title_column = match.groups()
+        if column is None:
+            column = title_column
+        return cls(J2, parity, T2, column)
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def from_title(cls, title):
+        """
+        Key from a title like 3_-_3_column_1, 3_-_3_1, or 3_-_3
+        (i.e. 2J_parity_2T, maybe with a column)
+        """
+        hunks = [h for h in title.strip().split("_") if h != "column"]
+        if len(hunks) not in (3, 4):
+            raise ValueError("Invalid title: {}".format(title))
+        return cls(*hunks)
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def from_csv_row(cls, row):
+        """
+        Key from a row of a resonances csv file (see ``resonance_info``),
+        e.g. "3,-,3,1,strong". Rows without the resonance type work too.
+        """
+        J2, parity, T2, column = row.strip().split(",")[:4]
+        return cls(J2, parity, T2, column)
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def from_filename(cls, path):
+        """
+        Key from the name of a channel file, like
+        ``path/to/[word]_[2J]_[parity]_[2T]_column_[col]_Nmax_[Nmax].csv``
+        """
+        name = os.path.splitext(os.path.basename(path))[0]
+        _, J2, parity, T2, _, column, _, _ = name.split("_")
+        return cls(J2, parity, T2, column)
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def from_state(cls, title):
+        """
+        Key from a bound state title from ``output_simplifier``, like
+        1.5_-1_1.5 (J_parity_T, with J and T not doubled)
+        """
+        J, parity, T = title.strip().split("_")
+        return cls(round(2 * float(J)), parity, round(2 * float(T)))
+
+    def _text(self, kind, make):
+        """Make a title once, then remember it"""
+        text = self._texts.get(kind)
+        if text is None:
+            text = self._texts[kind] = make()
+        return text
+
+    @property
+    def title(self):
+        """Title for file names etc., e.g. 3_-_3_column_1"""
+        return self._text("title", lambda: "_".join(
+            [str(self.J2), self.parity, str(self.T2)] +
+            ([] if self.column is None else ["column", str(self.column)])))
+
+    @property
+    def short_title(self):
+        """Title for csv files of resonances, e.g. 3_-_3_1"""
+        return self._text("short_title", lambda: "_".join(
+            [str(self.J2), self.parity, str(self.T2)] +
+            ([] if self.column is None else [str(self.column)])))
+
+    @property
+    def row(self):
+        """Fields for a resonances csv row, e.g. 3,-,3,1"""
+        return self._text("row", lambda: self.short_title.replace("_", ","))
+
+    @property
+    def latex(self):
+        """LaTeX title for channel plots, e.g. $\\frac{3}{2}^{-}\\frac{3}{2}$"""
+        return self._text("latex", lambda: "${}^{{{}}}{}$".format(
+            _half(self.J2), self.parity, _half(self.T2)))
+
+    @property
+    def label(self):
+        """LaTeX label for level schemes, e.g. $\\frac{3}{2}^- \\frac{3}{2}$"""
+        return self._text("label", lambda: "${}^{} {}$".format(
+            _half(self.J2), self.parity, _half(self.T2)))
+
+    @property
+    def fit_title(self):
+        """LaTeX title for fitting, e.g. $J=\\frac{3}{2},\\pi=-,T=\\frac{3}{2}$"""
+        return self._text("fit_title", lambda: "$J={},\\pi={},T={}$".format(
+            _half(self.J2), self.parity, _half(self.T2)))
+
+    def xmgrace_title(self, series_num):
+        """
+        xmgrace series title, e.g. '@ s2 legend "3\\S-\\N3 column 1"'
+
+        series_num:
+            integer, number of series in your xmgrace file
+        """
+        legend = self._text("legend", lambda: "{}\\S{}\\N{}{}".format(
+            self.J2, self.parity, self.T2,
+            "" if self.column is None else " column {}".format(self.column)))
+        return '@ s{} legend "{}"'.format(series_num, legend)
+
+
 def make_nice_title(xmtitle):
     """
-    Makes nicer-looking titles than the ones provided in xmgrace files
+    Makes nicer-looking titles than the ones provided in xmgrace files,
+    e.g. 3_-_3_column_1. See ``ChannelKey.title``.
 
     xmtitle:
-        string, xmgrace title format
+        string, xmgrace title format, or a ``ChannelKey``
     """
-    # we'll want a good title for plotting etc., so remove all gross bits
-    nice_title = multi_strip(xmtitle, ["\n", "\\", "S", "N", "@", "legend"])
-    # remove s0, s1, ..., (the first word), that's just used for xmgrace
-    nice_title = nice_title[nice_title.index('"'):]
-    # remove extra spaces
-    nice_title = " ".join(nice_title.split())
-    # remove quotes and replace spaces with underscores
-    nice_title = nice_title.replace('"', "").replace(" ", "_")
-    # put underscores between 2J, parity, 2T
-    if "+" in nice_title:
-        parity_index = nice_title.index("+")
-        parity = "+"
-    elif "-" in nice_title:
-        parity_index = nice_title.index("-")
-        parity = "-"
-    else:
-        raise ValueError("No +- parity specified... Title is "+xmtitle)
-    j2 = nice_title[:parity_index]
-    t2 = nice_title[parity_index+1:]
-    nice_title = "_".join([j2, parity, t2])
-    return nice_title
+    if isinstance(xmtitle, ChannelKey):
+        return xmtitle.title
+    return ChannelKey.from_xmgrace(xmtitle).title
 
 
 def make_plot_title(nice_title):
     """
-    Makes a plottable, LaTeX formatted title, for use in matplotlib graphs
+    Makes a plottable, LaTeX formatted title, for use in matplotlib graphs.
+    See ``ChannelKey.latex``.
 
     nice_title:
-        a human-readable, but not very pretty string, like 3_1_3
+        a human-readable, but not very pretty string, like 3_-_3_column_1
     """
-    hunks = nice_title.split("_")
-    J2, parity, T2, _, _ = hunks
-
-    J = float(J2) / 2
-    if J == int(J):
-        J = str(int(J))
-    else:
-        J = "\\frac{{{}}}{{{}}}".format(J2, 2)
-    T = float(T2) / 2
-    if T == int(T):
-        T = str(int(T))
-    else:
-        T = "\\frac{{{}}}{{{}}}".format(T2, 2)
-    plot_title = f"${J}^{{{parity}}}{T}$"
-    return plot_title
+    return ChannelKey.from_title(nice_title).latex
 
 
+@functools.lru_cache(maxsize=None)
 def plot_title_2(title):
     """
     Makes another kind of plottable, LaTeX formatted title.
+    See ``ChannelKey.label``.
 
     title:
-        string of the form ``J_parity_T[_column]`` (the _column is optional).
-        E.g. 3_1_3
+        string of the form ``J_parity_T`` (any of which may be ?, if
+        unknown), or ``2J_parity_2T_column``. E.g. 1.5_-1_1.5, or 3_-_3_1
     """
     # remove \n in case it exists
     title = title.replace("\n", "")
 
     hunks = title.split("_")
-    if len(hunks) == 3:
-        J, parity, T = hunks
-        if parity in ["+", "-", "?"]:
-            pass
-        elif parity in ["1", "-1", "+1"]:
-            parity = "+" if float(parity) == 1 else "-"
-        else:
-            raise ValueError("Invalid parity value '{}'".format(parity))
-        if J == "?":
-            pass
-        elif float(J) == int(float(J)):
-            J = str(int(float(J)))
-        else:
-            J = "\\frac{{{}}}{{{}}}".format(int(2*float(J)), 2)
-        if T == "?":
-            pass
-        elif float(T) == int(float(T)):
-            T = str(int(float(T)))
-        else:
-            T = "\\frac{{{}}}{{{}}}".format(int(2*float(T)), 2)
-    elif len(hunks) == 4:
-        J2, parity, T2, _ = hunks
-        J = float(J2) / 2
-        if J == int(J):
-            J = str(int(J))
-        else:
-            J = "\\frac{{{}}}{{{}}}".format(J2, 2)
-        T = float(T2) / 2
-        if T == int(T):
-            T = str(int(T))
-        else:
-            T = "\\frac{{{}}}{{{}}}".format(T2, 2)
-    else:
+    if len(hunks) == 4:
+        return ChannelKey.from_title(title).label
+    if len(hunks) != 3:
         raise ValueError("Invalid title: {}".format(title))
-    plot_title = "${}^{} {}$".format(J, parity, T)
-    return plot_title
+    if "?" not in hunks:
+        return ChannelKey.from_state(title).label
+    # some things unknown, e.g. from experiment
+    J, parity, T = hunks
+    if parity in ["1", "-1", "+1"]:
+        parity = "+" if float(parity) == 1 else "-"
+    elif parity not in ["+", "-", "?"]:
+        raise ValueError("Invalid parity value '{}'".format(parity))
+    J = J if J == "?" else _half(round(2 * float(J)))
+    T = T if T == "?" else _half(round(2 * float(T)))
+    return "${}^{} {}$".format(J, parity, T)
+
+
+def channel_label(channel):
+    """
+    Level scheme label for a channel, see ``ChannelKey.label``.
+
+    channel:
+        a ``ChannelKey``, or a string title, see ``plot_title_2``
+    """
+    if isinstance(channel, ChannelKey):
+        return channel.label
+    return plot_title_2(channel)
 
 
 def xmgrace_title(xmtitle, series_num):